@@ -1,10 +1,18 @@
 import streamlit as st
-from database import get_database, clear_all_collections, clear_specific_collection
+from database import get_database, clear_all_collections, clear_specific_collection, get_connection_health
 import pandas as pd
-from Data import save_data
-from datetime import datetime
-from auth import require_auth, create_user, init_auth
-from custom_logging import log_action, get_logs_by_action
+from Data import (save_data, enforce_schema, dataframe_to_documents, new_row_id, ROW_ID_COLUMN,
+                  bump_data_version, invalidate_technical_needs_cache, get_technical_needs_cache_stats,
+                  format_stockholm, stockholm_day_start)
+from datetime import datetime, timedelta
+from auth import require_auth, create_user, init_auth, get_login_metrics, list_sessions, revoke_sessions
+from config import get_bcrypt_rounds
+from custom_logging import log_action, query_logs, LOG_ACTIONS
+from db_monitor import summarize, trace_json, monitor
+from write_journal import list_entries, retry_entry, discard_entry
+from analytics_cache import get_analytics_cache_stats
+from complexity import recompute_complexity_scores, resolve_profile, SCORES_COLLECTION
+from plan_rollups import verify_plan_rollups, rebuild_plan_rollups, ROLLUPS_COLLECTION
 
 def validate_csv_data(df, collection_type):
     """Validate uploaded CSV data based on collection type"""
@@ -30,18 +38,25 @@ def import_csv_to_mongodb(df, collection_name):
     try:
         db = get_database()
         
-        # Convert DataFrame to records
-        records = df.to_dict('records')
-        
-        # Handle date columns if present
-        for record in records:
-            for key, value in record.items():
-                if 'Date' in key and pd.notnull(value):
-                    try:
-                        # Convert to datetime then to ISO format string
-                        record[key] = pd.to_datetime(value).isoformat()
-                    except:
-                        pass
+        if collection_name == 'goals':
+            # Planeringsdata typas enligt PLAN_SCHEMA och får stabila Row_Id innan den sparas
+            df = enforce_schema(df)
+            missing_ids = df[ROW_ID_COLUMN].isna()
+            df.loc[missing_ids, ROW_ID_COLUMN] = [new_row_id() for _ in range(int(missing_ids.sum()))]
+            records = dataframe_to_documents(df)
+        else:
+            # Convert DataFrame to records
+            records = df.to_dict('records')
+
+            # Handle date columns if present
+            for record in records:
+                for key, value in record.items():
+                    if 'Date' in key and pd.notnull(value):
+                        try:
+                            # Convert to datetime then to ISO format string
+                            record[key] = pd.to_datetime(value).isoformat()
+                        except:
+                            pass
         
         # Get existing data
         existing_data = list(db[collection_name].find({}, {'_id': 0}))
@@ -74,6 +89,12 @@ def import_csv_to_mongodb(df, collection_name):
                 # For other collections, just insert (you can add specific logic for other collections)
                 db[collection_name].insert_one(record)
                 added_count += 1
+        if collection_name == 'goals':
+            # Importen skriver direkt till goals, så månadssummorna byggs om från planen
+            rebuild_plan_rollups(db)
+        bump_data_version(db, plan_changed=(collection_name == 'goals'))
+        if collection_name == 'technical_needs':
+            invalidate_technical_needs_cache()
         log_action("import_data", (f"{st.session_state.username} Importerade data," 
                                     f"{added_count} poster lades till men hoppade över {skipped_count} poster som var dubbletter"), 
                                     "Admin Panel/Import/Export")
@@ -88,7 +109,8 @@ def admin_panel():
     st.title("Admin Panel")
     
     # Create tabs for different admin functions
-    tab1, tab2, tab3, tab4, tab5 = st.tabs(["Clear Data", "Import/Export", "Database Stats", "User Management", "Loggar",])
+    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["Clear Data", "Import/Export", "Database Stats", "User Management",
+                                                  "Loggar", "DB-prestanda"])
     
     with tab1:
         st.header("Clear Data")
@@ -188,12 +210,91 @@ def admin_panel():
         st.header("Database Statistics")
         try:
             db = get_database()
+
+            st.subheader("Connection")
+            health = get_connection_health()
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Status", {True: "OK", False: "Degraded", None: "Checking"}[health['healthy']])
+            col2.metric("Ping (ms)", health['latency_ms'] if health['latency_ms'] is not None else "-")
+            col3.metric("Last Check", format_stockholm(datetime.fromtimestamp(health['checked_at']).astimezone(), "%H:%M:%S")
+                        if health['checked_at'] else "-")
+            if health['error']:
+                st.caption(health['error'])
             
             # Get collection stats
             collections = ["goals", "technical_needs", "bugs", "history", "risks"]
             for collection in collections:
                 count = db[collection].count_documents({})
                 st.metric(f"{collection.capitalize()} Count", count)
+
+            st.subheader("Write Journal")
+            journal_entries = list_entries()
+            if journal_entries:
+                journal_df = pd.DataFrame(journal_entries)
+                journal_df['created_at'] = journal_df['created_at'].map(
+                    lambda value: format_stockholm(datetime.fromtimestamp(value).astimezone()))
+                st.dataframe(journal_df, hide_index=True)
+                failed_entries = [entry for entry in journal_entries if entry['status'] == 'failed']
+                if failed_entries:
+                    st.error(f"{len(failed_entries)} journal entries failed and block later writes. "
+                             "Retry them once the cause is fixed, or discard them (their changes are lost).")
+                    for entry in failed_entries:
+                        col1, col2, col3 = st.columns([4, 1, 1])
+                        col1.write(f"#{entry['seq']} {entry['collection']}: {entry['description']} "
+                                   f"({entry['last_error']})")
+                        if col2.button("Retry", key=f"journal_retry_{entry['seq']}"):
+                            retry_entry(entry['seq'])
+                            log_action("retry_journal_entry", f"Försökte journalpost {entry['seq']} igen",
+                                       "Admin/Database")
+                            st.rerun()
+                        if col3.button("Discard", key=f"journal_discard_{entry['seq']}"):
+                            discard_entry(entry['seq'])
+                            log_action("discard_journal_entry", f"Kastade journalpost {entry['seq']}",
+                                       "Admin/Database")
+                            st.rerun()
+            else:
+                st.write("No writes waiting for the database.")
+
+            st.subheader("Analytics Cache")
+            analytics_stats = get_analytics_cache_stats()
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Hits", analytics_stats['hits'])
+            col2.metric("Misses", analytics_stats['misses'])
+            col3.metric("Cached Results", f"{analytics_stats['entries']} / {analytics_stats['max_entries']}")
+            if analytics_stats['builders']:
+                st.dataframe(pd.DataFrame.from_dict(analytics_stats['builders'], orient='index'))
+
+            st.subheader("Complexity Scores")
+            st.caption(f"Profile: {resolve_profile()['name']}, "
+                       f"{db[SCORES_COLLECTION].count_documents({})} stored scores")
+            if st.button("Recompute Complexity Scores", key="recompute_complexity"):
+                counts = recompute_complexity_scores(db)
+                st.success(f"Scored {counts['plan']} planned and {counts['history']} archived tasks")
+
+            st.subheader("Plan Rollups")
+            st.caption(f"{db[ROLLUPS_COLLECTION].count_documents({})} month/goal rollups, "
+                       f"updated incrementally when the plan is saved")
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("Verify Plan Rollups", key="verify_plan_rollups"):
+                    mismatches = verify_plan_rollups(db)
+                    if mismatches.empty:
+                        st.success("Rollups match the plan")
+                    else:
+                        st.warning(f"{len(mismatches)} rollups differ from the plan")
+                        st.dataframe(mismatches, use_container_width=True, hide_index=True)
+            with col2:
+                if st.button("Rebuild Plan Rollups", key="rebuild_plan_rollups"):
+                    count = rebuild_plan_rollups(db)
+                    bump_data_version(db)
+                    st.success(f"Rebuilt {count} rollups from the plan")
+
+            st.subheader("Technical Needs Cache")
+            cache_stats = get_technical_needs_cache_stats()
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Hits", cache_stats['hits'])
+            col2.metric("Misses", cache_stats['misses'])
+            col3.metric("Cached Items", cache_stats['cached_items'])
             
         except Exception as e:
             st.error(f"Error getting database statistics: {str(e)}")
@@ -228,11 +329,10 @@ def admin_panel():
                 # Convert ObjectId to string
                 if '_id' in user:
                     user['_id'] = str(user['_id'])
-                # Ensure last_login is a string or None
-                if 'last_login' in user and user['last_login'] is not None:
-                    if isinstance(user['last_login'], datetime):
-                        user['last_login'] = user['last_login'].isoformat()
-                    # If it's already a string, leave it as is
+                # Tider lagras i UTC och visas i Stockholmstid
+                for field in ('created_at', 'last_login'):
+                    if field in user:
+                        user[field] = format_stockholm(user[field])
             
             user_df = pd.DataFrame(users)
             user_df = user_df.drop('_id', axis=1)
@@ -240,27 +340,147 @@ def admin_panel():
         else:
             st.info("No users found")
 
+        # Aktiva sessioner (inloggningar som överlever omladdning) kan återkallas
+        st.subheader("Active Sessions")
+        sessions = list_sessions()
+        if sessions:
+            sessions_df = pd.DataFrame([{
+                'username': session['username'],
+                'role': session['role'],
+                'created_at': format_stockholm(session['created_at']),
+                'expires_at': format_stockholm(session['expires_at']),
+                'session': session['_id'][:8],
+            } for session in sessions])
+            st.dataframe(sessions_df, hide_index=True)
+
+            col1, col2 = st.columns([2, 1])
+            with col1:
+                revoke_user = st.selectbox("Revoke sessions for", sorted(sessions_df['username'].unique()))
+            with col2:
+                if st.button("Revoke", key="revoke_user_sessions"):
+                    revoked = revoke_sessions(username=revoke_user)
+                    log_action("revoke_sessions", f"Återkallade {revoked} sessioner för {revoke_user}",
+                               "Admin/User Management")
+                    st.success(f"Revoked {revoked} sessions for {revoke_user}")
+                    st.rerun()
+        else:
+            st.info("No active sessions")
+
+        # Svarstider för inloggningar sedan processen startade
+        st.subheader("Login Latency")
+        metrics = get_login_metrics()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Logins", metrics['logins'], help=f"{metrics['failed']} failed, {metrics['rehashed']} rehashed")
+        col2.metric("p50 (ms)", metrics['total_p50_ms'] if metrics['logins'] else "-")
+        col3.metric("p95 (ms)", metrics['total_p95_ms'] if metrics['logins'] else "-")
+        col4.metric("bcrypt p95 (ms)", metrics['verify_p95_ms'] if metrics['logins'] else "-")
+        st.caption(f"bcrypt cost factor: {get_bcrypt_rounds()}")
+
     with tab5:
         st.header("Loggar")
 
-        # Hämta loggar
-        logs_by_action = get_logs_by_action()
+        # Filter för loggvyn, sparas i sessionen så att sidbyten behåller dem
+        with st.form("log_filter_form"):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                filter_actions = st.multiselect("Action", LOG_ACTIONS)
+            with col2:
+                filter_username = st.text_input("Användare")
+            with col3:
+                filter_location = st.text_input("Plats")
 
-        # Skapa flikar för varje action
-        if logs_by_action:
-            tab_labels = list(logs_by_action.keys())
-            tabs = st.tabs(tab_labels)
+            col4, col5, col6 = st.columns(3)
+            with col4:
+                filter_start = st.date_input("Från datum", value=None)
+            with col5:
+                filter_end = st.date_input("Till och med datum", value=None)
+            with col6:
+                page_size = st.selectbox("Loggar per sida", [25, 50, 100], index=1)
 
-            for tab, action in zip(tabs, tab_labels):
-                with tab:
-                    st.header(f"Loggar för {action}")
-                    logs = logs_by_action[action]
+            if st.form_submit_button("Filtrera"):
+                st.session_state.log_filters = {
+                    'actions': filter_actions,
+                    'username': filter_username.strip() or None,
+                    'location': filter_location.strip() or None,
+                    'start': stockholm_day_start(filter_start) if filter_start else None,
+                    'end': stockholm_day_start(filter_end + timedelta(days=1)) if filter_end else None,
+                    'page_size': page_size,
+                }
+                st.session_state.log_cursors = [None]
 
-                    if logs:
-                        # Visa loggarna som en tabell
-                        st.dataframe(logs)
-                    else:
-                        st.write("Inga loggar hittades för denna action.")
+        log_filters = st.session_state.get('log_filters', {'page_size': 50})
+        if 'log_cursors' not in st.session_state:
+            st.session_state.log_cursors = [None]
+
+        result = query_logs(cursor=st.session_state.log_cursors[-1], **log_filters)
+
+        # Antal per action (beräknat på servern)
+        if result['counts']:
+            st.write(f"Totalt {result['total']} loggar")
+            counts_df = pd.DataFrame(
+                [{'Action': action, 'Antal': count} for action, count in result['counts'].items()]
+            )
+            st.dataframe(counts_df, hide_index=True)
+
+        if result['logs']:
+            # Visa loggarna som en tabell, tidsstämplar i Stockholmstid
+            for log in result['logs']:
+                log['timestamp'] = format_stockholm(log.get('timestamp'))
+            page_number = len(st.session_state.log_cursors)
+            st.caption(f"Sida {page_number}")
+            st.dataframe([{key: value for key, value in log.items() if key != 'changes'}
+                          for log in result['logs']])
+
+            # Changesets från redigeringar kan expanderas för att se varje fältändring
+            for log in result['logs']:
+                if log.get('changes'):
+                    with st.expander(f"{log['timestamp']} - {log.get('username')}: "
+                                     f"{len(log['changes'])} ändringar"):
+                        st.dataframe(pd.DataFrame(log['changes']), hide_index=True)
+
+            col_prev, col_next = st.columns(2)
+            with col_prev:
+                if page_number > 1 and st.button("Föregående sida", key="logs_prev"):
+                    st.session_state.log_cursors.pop()
+                    st.rerun()
+            with col_next:
+                if result['next_cursor'] and st.button("Nästa sida", key="logs_next"):
+                    st.session_state.log_cursors.append(result['next_cursor'])
+                    st.rerun()
+        else:
+            st.warning("Inga loggar hittades för valda filter.")
+
+    with tab6:
+        st.header("DB-prestanda")
+        st.write("Tid för MongoDB-kommandon per flik och anropare, jämfört med flikens totala tid. "
+                 "p50/p95 räknas per körning av sidan.")
+        summary = summarize()
+
+        if summary['per_call'].empty:
+            st.info("Inga databaskommandon har mätts ännu (mätningen gäller MongoDB-backenden).")
         else:
-            st.warning("Har inte lyckats sortera loggarna eller så finns det inga loggar.")
+            st.subheader("Per flik")
+            st.dataframe(summary['per_tab'].round(1), hide_index=True)
 
+            st.subheader("Per anropare och kommando")
+            st.dataframe(summary['per_call'].round(1), hide_index=True)
+
+            st.subheader("Senaste körningar")
+            reruns = summary['reruns'].head(50).copy()
+            if 'timestamp' in reruns:
+                reruns['timestamp'] = reruns['timestamp'].map(
+                    lambda value: format_stockholm(datetime.fromtimestamp(value).astimezone(), "%H:%M:%S"))
+            st.dataframe(reruns.round(1), hide_index=True)
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button(
+                label="Ladda ner spårning (JSON)",
+                data=trace_json(),
+                file_name=f"db_trace_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                mime="application/json"
+            )
+        with col2:
+            if st.button("Nollställ mätningar", key="db_monitor_clear"):
+                monitor.clear()
+                st.rerun()
@@ -1,11 +1,15 @@
 import plotly.express as px
 import plotly.graph_objects as plotly_graph_objects
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
+from collections import namedtuple
+from analytics_cache import cached_figures
+from complexity import score_tasks
+from config import get_task_chart_settings
 
 # Importerade moduler som inte används för tillfället men kan behövas senare:
 # - from plotly.subplots import make_subplots
-# - import numpy as ny
 # - import streamlit as st
 
 """
@@ -38,15 +42,184 @@ pd.options.mode.chained_assignment = None
 pd.set_option('future.no_silent_downcasting', True)
 
 
-def create_cost_analysis(dataframe):
-    tasks = dataframe[dataframe["Type"] == "Task"]
+def explode_list_column(series, name):
+    """Delar en kommaseparerad kolumn till en lång tabell med en rad per värde.
+
+    Returnerar en DataFrame med kolumnerna 'task' (radens position) och name (kategori).
+    Strängarna delas en gång per kategori och expanderas sedan med kategorikoderna,
+    så kostnaden beror på antalet unika kombinationer i stället för antalet uppgifter."""
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype(object).where(series.notna(), None).astype('category')
+
+    parts = pd.Series(series.cat.categories, dtype=object).str.split(',').explode().str.strip()
+    parts = parts[parts.notna() & ~parts.isin(['No data', ''])]
+
+    codes = series.cat.codes.to_numpy()
+    per_code = np.bincount(parts.index.to_numpy(), minlength=len(series.cat.categories))
+    rows = np.flatnonzero(codes >= 0)
+    repeats = per_code[codes[rows]] if len(per_code) else np.zeros(len(rows), dtype=int)
+
+    # Sortera delarna per kategori så att varje rad kan hämta sitt block med en offset
+    order = np.argsort(parts.index.to_numpy(), kind='stable')
+    sorted_values = parts.to_numpy()[order]
+    starts = np.concatenate([[0], np.cumsum(per_code)[:-1]]) if len(per_code) else np.zeros(0, dtype=int)
+    task_positions = np.repeat(rows, repeats)
+    offsets = np.arange(len(task_positions)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    values = sorted_values[np.repeat(starts[codes[rows]], repeats) + offsets] if len(task_positions) else []
+
+    return pd.DataFrame({'task': task_positions, name: pd.Categorical(values)})
+
+
+def co_occurrence(left, left_name, right, right_name):
+    """Samförekomstmatris mellan två långa tabeller från explode_list_column:
+    hur många gånger värdena förekommer på samma uppgift (räknat på kategorikoderna)"""
+    if left.empty or right.empty:
+        return pd.DataFrame()
+    pairs = left.merge(right, on='task')
+    left_categories = left[left_name].cat.categories
+    right_categories = right[right_name].cat.categories
+    combined = pairs[left_name].cat.codes.to_numpy() * len(right_categories) + pairs[right_name].cat.codes.to_numpy()
+    counts = np.bincount(combined, minlength=len(left_categories) * len(right_categories))
+    matrix = pd.DataFrame(counts.reshape(len(left_categories), len(right_categories)),
+                          index=pd.Index(left_categories, name=left_name),
+                          columns=pd.Index(right_categories, name=right_name))
+    # Behåll bara värden som faktiskt förekommer tillsammans
+    return matrix.loc[matrix.sum(axis=1) > 0, matrix.sum(axis=0) > 0]
+
+
+def build_task_facts(dataframe):
+    """Bygger faktatabellen som alla analyser läser från, i ett svep över planen.
+
+    Returnerar ett dictionary med:
+    - goals: målraderna
+    - tasks: uppgiftsraderna med härledda kolumner (Month, Cost_Per_Hour, Personnel_Hours,
+      tools_count, weather_count, Complexity_Score, Status)
+    - per_goal: summor per mål (kostnad, hyra, övriga kostnader, timmar, personal, antal, klara)
+    - per_month: summor per startmånad
+    - tools / weather: en rad per redskap/väder och uppgift (task = position i tasks)
+    - weather_tools: samförekomst väder × redskap"""
+    goals = dataframe[dataframe["Type"] == "Goal"]
+    tasks = dataframe[dataframe["Type"] == "Task"].reset_index(drop=True)
+
+    tasks['Month'] = pd.to_datetime(tasks['Task_Start_Date']).dt.strftime('%Y-%m')
+    work_hours = (tasks['Task_Estimated_Time'] * tasks['Task_Personnel_Count']).astype('float64')
+    tasks['Personnel_Hours'] = work_hours.fillna(0)
+    tasks['Cost_Per_Hour'] = (tasks['Task_Estimated_Cost'].astype('float64') / work_hours).fillna(0)
+    tools = explode_list_column(tasks['Task_Technical_Needs'], 'Tool')
+    weather = explode_list_column(tasks['Task_Weather_Conditions'], 'Weather')
+    tasks['tools_count'] = np.bincount(tools['task'], minlength=len(tasks))
+    tasks['weather_count'] = np.bincount(weather['task'], minlength=len(tasks))
+    tasks['Complexity_Score'] = score_tasks(tasks)['Complexity_Score']
+    tasks['Status'] = np.where(tasks['Task_Completed'].fillna(False).astype(bool), 'Slutförda', 'Pågående')
+
+    per_goal = tasks.groupby('Goal_Name', observed=True).agg(
+        Task_Estimated_Cost=('Task_Estimated_Cost', 'sum'),
+        Task_Total_Rental_Cost=('Task_Total_Rental_Cost', 'sum'),
+        Task_Estimated_Time=('Task_Estimated_Time', 'sum'),
+        Task_Personnel_Count=('Task_Personnel_Count', 'max'),
+        Personnel_Hours=('Personnel_Hours', 'sum'),
+        Tasks=('Task_Name', 'size'),
+        Completed=('Status', lambda status: int((status == 'Slutförda').sum()))
+    ).reset_index()
+    per_goal['Övriga Kostnader'] = per_goal['Task_Estimated_Cost'] - per_goal['Task_Total_Rental_Cost']
+
+    per_month = tasks.groupby('Month').agg(
+        Task_Estimated_Cost=('Task_Estimated_Cost', 'sum'),
+        Task_Total_Rental_Cost=('Task_Total_Rental_Cost', 'sum'),
+        Task_Estimated_Time=('Task_Estimated_Time', 'sum'),
+        Personnel_Hours=('Personnel_Hours', 'sum'),
+        Tasks=('Task_Name', 'size')
+    ).reset_index()
+
+    return {'goals': goals, 'tasks': tasks, 'per_goal': per_goal, 'per_month': per_month,
+            'tools': tools, 'weather': weather,
+            'weather_tools': co_occurrence(weather, 'Weather', tools, 'Tool')}
+
+
+def get_task_facts(dataframe, plan_key=None):
+    """Faktatabellen för planen, byggd en gång per planinnehåll (delas mellan alla analyser).
+    Tabellerna delas mellan anropare och får inte ändras. plan_key är planens
+    analytics_cache.content_key när anroparen redan har den; annars hashas planen här."""
+    return cached_figures(build_task_facts, dataframe, key=plan_key)
+
+
+# Inställningar för diagram med en stapel per uppgift (se config.get_task_chart_settings)
+TaskChartSettings = namedtuple('TaskChartSettings', ['threshold', 'mode', 'top_n', 'bins'])
+
+
+def task_chart_settings(**overrides):
+    """Inställningarna från config, med användarens val (värden som inte är None) ovanpå"""
+    settings = get_task_chart_settings()
+    settings.update({name: value for name, value in overrides.items() if value is not None})
+    return TaskChartSettings(**{field: settings[field] for field in TaskChartSettings._fields})
+
+
+def per_task_chart(tasks, value, title, labels, settings=None, others='sum', sort=False):
+    """Diagram med ett värde per uppgift.
+
+    Upp till settings.threshold uppgifter ritas en stapel per uppgift som tidigare. Över
+    gränsen byts diagrammet enligt settings.mode så att webbläsaren inte får en stapel per uppgift:
+    - 'top_n': de settings.top_n största uppgifterna plus en stapel "Övriga" (summa eller medel, se others)
+    - 'histogram': antal uppgifter per värdeintervall och mål, binnat här i stället för i webbläsaren
+    - 'webgl': en Scattergl-punkt per uppgift"""
+    settings = settings or task_chart_settings()
+    if len(tasks) <= settings.threshold:
+        data = tasks.sort_values(value, ascending=False) if sort else tasks
+        return px.bar(data, x='Task_Name', y=value, color='Goal_Name', title=title, labels=labels)
+
+    values = tasks[value].astype('float64').fillna(0).to_numpy()
+    goal_names = tasks['Goal_Name'].astype(object).to_numpy()
+    task_names = tasks['Task_Name'].astype(object).to_numpy()
+
+    if settings.mode == 'histogram':
+        edges = np.histogram_bin_edges(values, bins=settings.bins)
+        bins = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, len(edges) - 2)
+        counts = (pd.DataFrame({'Goal_Name': goal_names, 'bin': bins})
+                  .groupby(['bin', 'Goal_Name']).size().reset_index(name='Antal'))
+        counts[value] = (edges[counts['bin']] + edges[counts['bin'] + 1]) / 2
+        fig = px.bar(counts, x=value, y='Antal', color='Goal_Name',
+                     title=f"{title} (fördelning av {len(tasks)} uppgifter)",
+                     labels=dict(labels, Antal='Antal Uppgifter'))
+        fig.update_traces(width=float(edges[1] - edges[0]) if len(edges) > 1 else None)
+        fig.update_layout(barmode='stack', bargap=0)
+        return fig
+
+    order = np.argsort(-values, kind='stable') if sort else np.arange(len(values))
+    if settings.mode == 'webgl':
+        fig = go.Figure()
+        positions = pd.Series(goal_names[order]).groupby(goal_names[order], sort=False).indices
+        for goal_name, goal_positions in positions.items():
+            rows = order[goal_positions]
+            fig.add_trace(go.Scattergl(x=goal_positions, y=values[rows].astype('float32'), text=task_names[rows],
+                                       mode='markers', name=str(goal_name),
+                                       hovertemplate='%{text}: %{y}'))
+        fig.update_layout(title=f"{title} ({len(tasks)} uppgifter)",
+                          xaxis_title=labels.get('Task_Name', 'Uppgift'),
+                          yaxis_title=labels.get(value, value), legend_title=labels.get('Goal_Name', 'Mål'))
+        return fig
+
+    # top_n: de största uppgifterna och resten som en stapel
+    top = np.argsort(-values, kind='stable')[:min(settings.top_n, len(values))]
+    rest = np.setdiff1d(np.arange(len(values)), top)
+    data = pd.DataFrame({'Task_Name': task_names[top], 'Goal_Name': goal_names[top], value: values[top]})
+    # Ingen "Övriga"-stapel när top_n (valbart i gränssnittet) täcker alla uppgifter
+    if len(rest):
+        rest_value = values[rest].mean() if others == 'mean' else values[rest].sum()
+        rest_label = 'medel' if others == 'mean' else 'summa'
+        data.loc[len(data)] = [f"Övriga ({len(rest)} uppgifter, {rest_label})", 'Övriga', rest_value]
+    return px.bar(data, x='Task_Name', y=value, color='Goal_Name',
+                  title=f"{title} (topp {len(top)} av {len(tasks)})", labels=labels)
+
+
+def create_cost_analysis(dataframe, rollups=None, chart_settings=None, plan_key=None):
+    """Kostnadsdiagram. Med rollups (analytics_queries.PlanRollups) tas summorna per mål
+    och månad, och den kumulativa kostnaden, från databasen i stället för från faktatabellen.
+    chart_settings (TaskChartSettings) styr diagrammet per uppgift vid många uppgifter."""
+    facts = get_task_facts(dataframe, plan_key)
+    tasks = facts['tasks']
 
     # Kostnadsfördelning per mål
-    goal_costs = tasks.groupby("Goal_Name").agg({
-        "Task_Estimated_Cost": "sum",
-        "Task_Total_Rental_Cost": "sum"
-    }).reset_index()
-    goal_costs.loc[:, "Övriga Kostnader"] = goal_costs["Task_Estimated_Cost"] - goal_costs["Task_Total_Rental_Cost"]
+    goal_costs = rollups.per_goal if rollups is not None else facts['per_goal']
 
     figure_costs = px.bar(
         goal_costs,
@@ -58,10 +231,7 @@ def create_cost_analysis(dataframe):
     )
 
     # Lägg till tidsbaserad kostnadsfördelning
-    tasks['Month'] = pd.to_datetime(tasks['Task_Start_Date']).dt.strftime('%Y-%m')
-    monthly_costs = tasks.groupby('Month').agg({
-        'Task_Estimated_Cost': 'sum'
-    }).reset_index()
+    monthly_costs = rollups.per_month if rollups is not None else facts['per_month']
 
     fig_monthly_costs = px.line(
         monthly_costs,
@@ -72,25 +242,26 @@ def create_cost_analysis(dataframe):
     )
 
     # Lägg till kostnad per arbetstimme-diagram
-    tasks['Cost_Per_Hour'] = tasks['Task_Estimated_Cost'] / (
-            tasks['Task_Estimated_Time'] * tasks['Task_Personnel_Count'])
-    tasks['Cost_Per_Hour'] = tasks['Cost_Per_Hour'].fillna(0)
-
-    fig_cost_per_hour = px.bar(
+    fig_cost_per_hour = per_task_chart(
         tasks,
-        x='Task_Name',
-        y='Cost_Per_Hour',
-        color='Goal_Name',
-        title='Kostnad per Arbetstimme',
-        labels={'Cost_Per_Hour': 'Kostnad/Timme', 'Task_Name': 'Uppgift'}
+        'Cost_Per_Hour',
+        'Kostnad per Arbetstimme',
+        {'Cost_Per_Hour': 'Kostnad/Timme', 'Task_Name': 'Uppgift'},
+        chart_settings,
+        others='mean'
     )
 
     # Lägg till kumulativt kostnadsdiagram
-    tasks = tasks.sort_values('Task_Start_Date')
-    tasks['Cumulative_Cost'] = tasks['Task_Estimated_Cost'].cumsum()
+    if rollups is not None:
+        # Per månad från de materialiserade månadssummorna i stället för att sortera alla uppgifter
+        cumulative = pd.DataFrame({'Task_Start_Date': pd.to_datetime(monthly_costs['Month'], format='%Y-%m'),
+                                   'Cumulative_Cost': monthly_costs['Task_Estimated_Cost'].cumsum()})
+    else:
+        cumulative = tasks[['Task_Start_Date', 'Task_Estimated_Cost']].sort_values('Task_Start_Date')
+        cumulative['Cumulative_Cost'] = cumulative['Task_Estimated_Cost'].cumsum()
 
     fig_cumulative = px.line(
-        tasks,
+        cumulative,
         x='Task_Start_Date',
         y='Cumulative_Cost',
         title='Kumulativ Kostnadsutveckling',
@@ -98,12 +269,8 @@ def create_cost_analysis(dataframe):
     )
 
     # Lägg till kostnadskategorier pajdiagram
-    cost_categories = tasks.groupby('Goal_Name').agg({
-        'Task_Estimated_Cost': 'sum'
-    }).reset_index()
-
     fig_cost_categories = px.pie(
-        cost_categories,
+        goal_costs,
         values='Task_Estimated_Cost',
         names='Goal_Name',
         title='Kostnadsfördelning per Projekt'
@@ -112,76 +279,153 @@ def create_cost_analysis(dataframe):
     return [figure_costs, fig_monthly_costs, fig_cost_categories, fig_cost_per_hour, fig_cumulative]
 
 
-def create_gantt_charts(dataframe):
-    """Skapar Gantt-scheman för mål och uppgifter
-    Returnerar ett dictionary med översiktsschema och individuella uppgiftsscheman per mål"""
-    gantt_figures = {"overview": None, "tasks": {}}
+def build_timeline_index(timeline):
+    """Sorterar tidslinjedata (Start, Finish, ...) på startdatum för snabba datumfönster.
+
+    Returnerar ett dictionary med raderna sorterade på Start, start- och slutdatum som
+    int64-arrayer och den längsta varaktigheten. Rader utan startdatum kan inte ritas
+    och räknas bara i 'undated'."""
+    dated = timeline[timeline["Start"].notna()].sort_values("Start", kind="stable").reset_index(drop=True)
+    starts = dated["Start"].to_numpy(dtype="datetime64[ns]").astype("int64")
+    # Saknat slutdatum räknas som en stapel utan längd
+    finishes = dated["Finish"].fillna(dated["Start"]).to_numpy(dtype="datetime64[ns]").astype("int64")
+    return {
+        "data": dated,
+        "starts": starts,
+        "finishes": finishes,
+        "max_duration": int(np.max(finishes - starts, initial=0)),
+        "undated": int(len(timeline) - len(dated)),
+    }
+
 
+def slice_timeline(index, window=None):
+    """Raderna som syns i datumfönstret (start, slut), i O(log n + k).
+
+    En stapel syns om den startar före fönstrets slut och slutar efter dess början.
+    Eftersom raderna är sorterade på Start begränsar searchsorted kandidaterna till de
+    som startar mellan (fönstrets början - längsta varaktighet) och fönstrets slut."""
+    if window is None:
+        return index["data"]
+    window_start, window_end = (pd.Timestamp(bound).value for bound in window)
+    low = np.searchsorted(index["starts"], window_start - index["max_duration"], side="left")
+    high = np.searchsorted(index["starts"], window_end, side="right")
+    visible = low + np.flatnonzero(index["finishes"][low:high] >= window_start)
+    return index["data"].iloc[visible]
+
+
+def timeline_window(choice, today=None, custom_range=None):
+    """Datumfönster för valen i Gantt-fliken: None för "Allt", annars (start, slut)"""
+    today = pd.Timestamp(today or pd.Timestamp.now()).normalize()
+    if choice == "Denna vecka":
+        start = today - pd.Timedelta(days=today.weekday())
+        return start, start + pd.Timedelta(days=7) - pd.Timedelta(1)
+    if choice == "Denna månad":
+        start = today.replace(day=1)
+        return start, start + pd.offsets.MonthBegin(1) - pd.Timedelta(1)
+    if choice == "Anpassat" and custom_range and len(custom_range) == 2:
+        return pd.Timestamp(custom_range[0]), pd.Timestamp(custom_range[1]) + pd.Timedelta(days=1) - pd.Timedelta(1)
+    return None
+
+
+def build_gantt_specs(dataframe, plan_key=None):
+    """Delar upp uppgifterna per mål i en enda groupby.
+
+    Returnerar ett dictionary med:
+    - overview: tidslinjeindex (build_timeline_index) för målen, None om det inte finns några mål
+    - goals: mål -> tidslinjeindex för målets uppgifter (Task, Start, Finish, Completed),
+      i målens ordning. Diagrammen byggs först med create_gantt_overview/create_goal_gantt
+      för det datumfönster som visas."""
+    specs = {"overview": None, "goals": {}}
+    if dataframe.empty:
+        return specs
+
+    facts = get_task_facts(dataframe, plan_key)
+    goals = facts['goals']
+    if goals.empty:
+        return specs
+
+    goals_data = goals[["Goal_Name", "Goal_Start_Date", "Goal_End_Date", "Goal_Completed"]]
+    goals_data.columns = ["Goal", "Start", "Finish", "Completed"]
+    goals_data['Completed'] = goals_data['Completed'].fillna(False).infer_objects(copy=False)
+    specs["overview"] = build_timeline_index(goals_data)
+
+    timeline = facts['tasks'][["Goal_Name", "Task_Name", "Task_Start_Date", "Task_End_Date", "Task_Completed"]]
+    timeline.columns = ["Goal", "Task", "Start", "Finish", "Completed"]
+    timeline['Completed'] = timeline['Completed'].fillna(False)
+    per_goal = {goal_name: goal_tasks.drop(columns="Goal")
+                for goal_name, goal_tasks in timeline.groupby("Goal", observed=True, sort=False)}
+
+    # Mål utan uppgifter får ingen tidslinje
+    for goal_name in goals['Goal_Name'].dropna().unique():
+        if goal_name in per_goal:
+            specs["goals"][goal_name] = build_timeline_index(per_goal[goal_name])
+    return specs
+
+
+def get_gantt_specs(dataframe, plan_key=None):
+    """Tidslinjedata per mål, byggd en gång per planinnehåll. Tabellerna får inte ändras."""
+    return cached_figures(build_gantt_specs, dataframe, key=plan_key, plan_key=plan_key)
+
+
+def _timeline_figure(data, y, title, window):
+    fig = px.timeline(
+        data,
+        x_start="Start",
+        x_end="Finish",
+        y=y,
+        title=title,
+        color="Completed",
+        color_discrete_map={True: "#2ecc71", False: "#e74c3c"}
+    )
+    if window is not None:
+        # Visa hela fönstret även om staplarna börjar före eller slutar efter det
+        fig.update_xaxes(range=[window[0], window[1]])
+    return fig
+
+
+def create_gantt_overview(dataframe, window=None, plan_key=None):
+    """Gantt-schemat för målöversikten med bara de mål som syns i datumfönstret.
+    Returnerar None om planen saknar mål."""
+    index = get_gantt_specs(dataframe, plan_key)["overview"]
+    if index is None:
+        return None
     try:
-        if dataframe.empty:
-            return gantt_figures
-
-        goals = dataframe[dataframe["Type"] == "Goal"]
-        tasks = dataframe[dataframe["Type"] == "Task"]
-
-        if goals.empty:
-            return gantt_figures
-
-        # Skapa Gantt-schema för målöversikt
-        try:
-            goals_data = goals[["Goal_Name", "Goal_Start_Date", "Goal_End_Date", "Goal_Completed"]]
-            goals_data.columns = ["Goal", "Start", "Finish", "Completed"]
-            goals_data['Completed'] = goals_data['Completed'].fillna(False).infer_objects(copy=False)
-
-            overview_fig = px.timeline(
-                goals_data,
-                x_start="Start",
-                x_end="Finish",
-                y="Goal",
-                title="Översikt av Projektmål",
-                color="Completed",
-                color_discrete_map={True: "#2ecc71", False: "#e74c3c"}
-            )
+        return _timeline_figure(slice_timeline(index, window), "Goal", "Översikt av Projektmål", window)
+    except Exception as e:
+        print(f"Fel vid skapande av översikt Gantt-schema: {str(e)}")
+        return None
+
+
+def create_goal_gantt(dataframe, goal_name, window=None, plan_key=None):
+    """Tidslinjen för ett mål med bara de uppgifter som syns i datumfönstret
+    (None om målet saknar uppgifter eller inget syns i fönstret).
+    Anropas via analytics_cache.cached_figures så att varje mål och fönster byggs en gång per planinnehåll."""
+    index = get_gantt_specs(dataframe, plan_key)["goals"].get(goal_name)
+    if index is None:
+        return None
+    gantt_data = slice_timeline(index, window)
+    if gantt_data.empty:
+        return None
+    try:
+        return _timeline_figure(gantt_data, "Task", f"Tidslinje för Uppgifter - {goal_name}", window)
+    except Exception as e:
+        print(f"Fel vid skapande av Gantt-schema för mål {goal_name}: {str(e)}")
+        return None
 
-            gantt_figures["overview"] = overview_fig
-        except Exception as e:
-            print(f"Fel vid skapande av översikt Gantt-schema: {str(e)}")
-            return gantt_figures
 
-        # Skapa individuella uppgiftsscheman för varje mål
-        for _, goal in goals.iterrows():
-            try:
-                goal_name = goal['Goal_Name']
-                goal_tasks = tasks[tasks['Goal_Name'] == goal_name]
-
-                if goal_tasks.empty:
-                    continue
-
-                gantt_data = goal_tasks[["Task_Name", "Task_Start_Date", "Task_End_Date", "Task_Completed"]]
-                gantt_data.columns = ["Task", "Start", "Finish", "Completed"]
-                ####Confirmed working but get futurewarning!!!############################################
-                gantt_data['Completed'] = gantt_data['Completed'].fillna(False)
-                ##########################################################################################
-
-                ####Hopefully fix for futurewarning!!!####################################################
-                #gantt_data['Completed'] = gantt_data['Completed'].result.infer_objects(copy=False)
-                ##########################################################################################
-
-                fig = px.timeline(
-                    gantt_data,
-                    x_start="Start",
-                    x_end="Finish",
-                    y="Task",
-                    title=f"Tidslinje för Uppgifter - {goal_name}",
-                    color="Completed",
-                    color_discrete_map={True: "#2ecc71", False: "#e74c3c"}
-                )
+def create_gantt_charts(dataframe, window=None, plan_key=None):
+    """Skapar Gantt-scheman för mål och uppgifter
+    Returnerar ett dictionary med översiktsschema och individuella uppgiftsscheman per mål.
+    Bygger alla mål på en gång; i appen visas de i stället ett i taget med create_goal_gantt."""
+    gantt_figures = {"overview": None, "tasks": {}}
 
+    try:
+        specs = get_gantt_specs(dataframe, plan_key)
+        gantt_figures["overview"] = create_gantt_overview(dataframe, window, plan_key)
+        for goal_name in specs["goals"]:
+            fig = create_goal_gantt(dataframe, goal_name, window, plan_key)
+            if fig is not None:
                 gantt_figures["tasks"][goal_name] = fig
-            except Exception as e:
-                print(f"Fel vid skapande av Gantt-schema för mål {goal_name}: {str(e)}")
-                continue
-
         return gantt_figures
 
     except Exception as e:
@@ -190,80 +434,36 @@ def create_gantt_charts(dataframe):
 
 
 def calculate_complexity(tasks):
-    # Normalisera värden till en skala mellan 0-1
-    def normalize(series):
-        min_val = series.min()
-        max_val = series.max()
-        if max_val == min_val:
-            return series.map(lambda x: 1)
-        return (series - min_val) / (max_val - min_val)
-
-    # Räkna antal tekniska behov/redskap för varje uppgift
-    tasks['tools_count'] = tasks['Task_Technical_Needs'].map(
-        lambda x: 0 if x == 'No data' else len(str(x).split(','))
-    )
+    """Komplexitetspoäng (1-10) per uppgift enligt viktprofilen i config.
+    Beräkningen görs i complexity.score_tasks och ändrar inte tasks."""
+    return score_tasks(tasks)['Complexity_Score']
 
-    # Basera komplexitet på flera faktorer
-    complexity_factors = {
-        'time_factor': normalize(tasks['Task_Estimated_Time']),
-        'personnel_factor': normalize(tasks['Task_Personnel_Count']),
-        'cost_factor': normalize(tasks['Task_Estimated_Cost']),
-        'rental_factor': normalize(tasks['Task_Total_Rental_Cost']),
-        'weather_factor': tasks['Task_Weather_Conditions'].map(
-            lambda x: 0.5 if x == 'No data' else len(str(x).split(',')) / 4
-        ),
-        'tools_factor': normalize(tasks['tools_count'])  # Ny faktor för redskap
-    }
-    
-    # Uppdaterade vikter med tools_factor
-    weights = {
-        'time_factor': 0.25,        # Minskad från 0.3
-        'personnel_factor': 0.20,   # Minskad från 0.25
-        'cost_factor': 0.15,        # Minskad från 0.2
-        'rental_factor': 0.15,      # Oförändrad
-        'weather_factor': 0.1,      # Oförändrad
-        'tools_factor': 0.15        # Ny vikt för redskap
-    }
-    
-    # Beräkna viktad komplexitet
-    total_complexity = sum(
-        complexity_factors[factor] * weight 
-        for factor, weight in weights.items()
-    )
-    
-    # Normalisera till en 1-10 skala för enklare tolkning
-    return (total_complexity * 9) + 1
 
-
-def analyze_work_hours(dataframe):
-    tasks = dataframe[dataframe["Type"] == "Task"]
+def analyze_work_hours(dataframe, rollups=None, chart_settings=None, plan_key=None):
+    """Arbetstidsdiagram; resursallokeringen per mål läses från rollups om de finns.
+    chart_settings (TaskChartSettings) styr diagrammen per uppgift vid många uppgifter."""
+    facts = get_task_facts(dataframe, plan_key)
+    tasks = facts['tasks']
+    settings = chart_settings or task_chart_settings()
 
     # Tidsfördelning för uppgifter
-    fig_duration = px.bar(
+    fig_duration = per_task_chart(
         tasks,
-        x='Task_Name',
-        y='Task_Estimated_Time',
-        color='Goal_Name',
-        title='Uppgifternas Tidsfördelning',
-        labels={'Task_Estimated_Time': 'Uppskattad Tid (timmar)',
-                'Task_Name': 'Uppgift',
-                'Goal_Name': 'Mål'},
+        'Task_Estimated_Time',
+        'Uppgifternas Tidsfördelning',
+        {'Task_Estimated_Time': 'Uppskattad Tid (timmar)',
+         'Task_Name': 'Uppgift',
+         'Goal_Name': 'Mål'},
+        settings
     )
     # Sätter minimi höjd i pixlar
-    fig_duration.update_layout(height=600)
-    fig_duration.update_layout(
-        height=600,
-        xaxis=dict(
-            rangeslider=dict(visible=True),  # Aktiverar områdeslider
-        ),
-        yaxis=dict(title='Uppskattad Tid (timmar)')
-    )
+    fig_duration.update_layout(height=600, yaxis=dict(title='Uppskattad Tid (timmar)'))
+    if len(tasks) <= settings.threshold or settings.mode == 'webgl':
+        # Aktiverar områdeslider när varje uppgift har en egen punkt eller stapel
+        fig_duration.update_layout(xaxis=dict(rangeslider=dict(visible=True)))
 
     # Resursallokering per mål
-    goal_resources = tasks.groupby('Goal_Name').agg({
-        'Task_Personnel_Count': 'max',
-        'Task_Estimated_Time': 'sum'
-    }).reset_index()
+    goal_resources = rollups.per_goal if rollups is not None else facts['per_goal']
 
     fig_resources = px.scatter(
         goal_resources,
@@ -280,34 +480,28 @@ def analyze_work_hours(dataframe):
     )
 
     # Analys av uppgiftskomplexitet
-    tasks['Complexity_Score'] = calculate_complexity(tasks)
-    fig_complexity = px.bar(
-        tasks.sort_values('Complexity_Score', ascending=False),
-        x='Task_Name',
-        y='Complexity_Score',
-        color='Goal_Name',
-        title='Uppgiftskomplexitet',
-        labels={'Complexity_Score': 'Komplexitetspoäng',
-                'Task_Name': 'Uppgift',
-                'Goal_Name': 'Mål'}
+    fig_complexity = per_task_chart(
+        tasks,
+        'Complexity_Score',
+        'Uppgiftskomplexitet',
+        {'Complexity_Score': 'Komplexitetspoäng',
+         'Task_Name': 'Uppgift',
+         'Goal_Name': 'Mål'},
+        settings,
+        others='mean',
+        sort=True
     )
 
     return [fig_duration, fig_resources, fig_complexity]
 
 
-def create_technical_needs_analysis(dataframe):
-    tasks = dataframe[dataframe["Type"] == "Task"]
+def create_technical_needs_analysis(dataframe, plan_key=None):
+    facts = get_task_facts(dataframe, plan_key)
 
     # Frekvens av verktygsanvändning
-    tool_counts = []
-    for tools in tasks['Task_Technical_Needs'].str.split(','):
-        if isinstance(tools, list):
-            tool_counts.extend(tools)
-
-    tool_freq = pd.DataFrame({
-        'Tool': tool_counts
-    }).value_counts().reset_index()
+    tool_freq = facts['tools']['Tool'].value_counts().reset_index()
     tool_freq.columns = ['Tool', 'Count']
+    tool_freq = tool_freq[tool_freq['Count'] > 0]
 
     fig_tool_usage = px.bar(
         tool_freq,
@@ -318,25 +512,14 @@ def create_technical_needs_analysis(dataframe):
     )
 
     # Korrelation med väder
-    weather_tools = []
-    for idx, row in tasks.iterrows():
-        if row['Task_Weather_Conditions'] != 'No data' and row['Task_Technical_Needs'] != 'No data':
-            weathers = str(row['Task_Weather_Conditions']).split(',')
-            tools = str(row['Task_Technical_Needs']).split(',')
-            for weather in weathers:
-                for tool in tools:
-                    weather_tools.append({
-                        'Weather': weather.strip(),
-                        'Tool': tool.strip()
-                    })
-
-    weather_tool_df = pd.DataFrame(weather_tools)
-    if not weather_tool_df.empty:
-        fig_weather_correlation = px.density_heatmap(
-            weather_tool_df,
-            x='Weather',
-            y='Tool',
-            title='Väder och Verktygskorrelation'
+    weather_tools = facts['weather_tools']
+    if not weather_tools.empty:
+        fig_weather_correlation = px.imshow(
+            weather_tools.T,
+            labels={'x': 'Weather', 'y': 'Tool', 'color': 'Antal'},
+            title='Väder och Verktygskorrelation',
+            aspect='auto',
+            text_auto=True
         )
     else:
         fig_weather_correlation = None
@@ -344,6 +527,16 @@ def create_technical_needs_analysis(dataframe):
     return [fig_tool_usage, fig_weather_correlation]
 
 
+def create_weather_summary(dataframe, plan_key=None):
+    """Pajdiagram över väderbehov, eller None om inga uppgifter har väderkrav"""
+    weather_df = get_task_facts(dataframe, plan_key)['weather']['Weather'].value_counts().reset_index()
+    weather_df.columns = ['Weather', 'Count']
+    weather_df = weather_df[weather_df['Count'] > 0]
+    if weather_df.empty:
+        return None
+    return px.pie(weather_df, values='Count', names='Weather', title='Väderbehov')
+
+
 def create_risk_matrix():
     data = [[1, 2, 3, 4],
             [2, 4, 6, 8],
@@ -381,30 +574,36 @@ def create_risk_matrix():
     return figure_risk
 
 
-def create_completion_analysis(dataframe):
+def _completion_counts(flags):
+    """(antal klara, antal totalt) för en kolumn med slutförandeflaggor"""
+    completion = flags.fillna(False).infer_objects(copy=False).value_counts()
+    return int(completion.get(True, 0)), len(flags)
+
+
+def create_completion_analysis(dataframe, rollups=None, plan_key=None):
     """Skapar visualiseringar för mål- och uppgiftsstatus
-    Returnerar en lista med diagram för mål- och uppgiftsstatus"""
+    Returnerar en lista med diagram för mål- och uppgiftsstatus.
+    Med rollups (analytics_queries.PlanRollups) tas antalen från databasens aggregering."""
     completion_figures = []
 
     try:
         # Statistisk över målstatus
-        goals = dataframe[dataframe['Type'] == 'Goal']
-        if goals.empty:
+        facts = get_task_facts(dataframe, plan_key)
+        if rollups is not None:
+            goals_completed, goals_total = rollups.goal_status['completed'], rollups.goal_status['total']
+        else:
+            goals_completed, goals_total = _completion_counts(facts['goals']['Goal_Completed'])
+        if not goals_total:
             return [go.Figure().update_layout(
                 title="Inga Mål Tillgängliga",
                 annotations=[{"text": "Lägg till några mål för att se slutförandestatistik",
                               "x": 0.5, "y": 0.5, "showarrow": False}]
             )]
 
-        goal_completion = goals['Goal_Completed'].fillna(False).infer_objects(copy=False).value_counts()
-
         fig_goals = go.Figure(data=[
             go.Pie(
                 labels=['Slutförda', 'Pågående'],
-                values=[
-                    goal_completion.get(True, 0),
-                    goal_completion.get(False, 0)
-                ],
+                values=[goals_completed, goals_total - goals_completed],
                 hole=.3,
                 marker_colors=['#2ecc71', '#e74c3c']
             )
@@ -412,7 +611,7 @@ def create_completion_analysis(dataframe):
         fig_goals.update_layout(
             title="Målstatus",
             annotations=[{
-                'text': f"{(goal_completion.get(True, 0) / len(goals) * 100):.1f}%<br>Slutförda",
+                'text': f"{(goals_completed / goals_total * 100):.1f}%<br>Slutförda",
                 'x': 0.5, 'y': 0.5,
                 'font_size': 20,
                 'showarrow': False
@@ -421,17 +620,15 @@ def create_completion_analysis(dataframe):
         completion_figures.append(fig_goals)
 
         # Statistisk över uppgiftsstatus
-        tasks = dataframe[dataframe['Type'] == 'Task']
-        if not tasks.empty:
-            task_completion = tasks['Task_Completed'].fillna(False).infer_objects(copy=False).value_counts()
-
+        if rollups is not None:
+            tasks_completed, tasks_total = rollups.task_status['completed'], rollups.task_status['total']
+        else:
+            tasks_completed, tasks_total = _completion_counts(facts['tasks']['Task_Completed'])
+        if tasks_total:
             fig_tasks = go.Figure(data=[
                 go.Pie(
                     labels=['Slutförda', 'Pågående'],
-                    values=[
-                        task_completion.get(True, 0),
-                        task_completion.get(False, 0)
-                    ],
+                    values=[tasks_completed, tasks_total - tasks_completed],
                     hole=.3,
                     marker_colors=['#2ecc71', '#e74c3c']
                 )
@@ -439,7 +636,7 @@ def create_completion_analysis(dataframe):
             fig_tasks.update_layout(
                 title="Uppgiftsstatus",
                 annotations=[{
-                    'text': f"{(task_completion.get(True, 0) / len(tasks) * 100):.1f}%<br>Slutförda",
+                    'text': f"{(tasks_completed / tasks_total * 100):.1f}%<br>Slutförda",
                     'x': 0.5, 'y': 0.5,
                     'font_size': 20,
                     'showarrow': False
@@ -449,18 +646,13 @@ def create_completion_analysis(dataframe):
 
             # Uppgiftsstatus per mål
             try:
-                # Säkerställ att Task_Completed är korrekt mappat
-                tasks['Status'] = tasks['Task_Completed'].fillna(False).infer_objects(copy=False).map({
-                    True: 'Slutförda', 
-                    False: 'Pågående'
+                # Klara och pågående uppgifter per mål från summeringen per mål
+                per_goal = rollups.per_goal if rollups is not None else facts['per_goal']
+                task_by_goal = per_goal.set_index('Goal_Name')
+                task_by_goal = pd.DataFrame({
+                    'Slutförda': task_by_goal['Completed'],
+                    'Pågående': task_by_goal['Tasks'] - task_by_goal['Completed']
                 })
-                
-                task_by_goal = tasks.groupby(['Goal_Name', 'Status']).size().unstack(fill_value=0)
-                
-                if 'Slutförda' not in task_by_goal.columns:
-                    task_by_goal['Slutförda'] = 0
-                if 'Pågående' not in task_by_goal.columns:
-                    task_by_goal['Pågående'] = 0
 
                 fig_by_goal = go.Figure(data=[
                     go.Bar(name='Slutförda', y=task_by_goal.index, x=task_by_goal['Slutförda'],
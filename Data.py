@@ -1,6 +1,11 @@
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, date, timezone as dt_timezone
+import hashlib
+import json
+import threading
+import uuid
 import pytz
+import streamlit as st
 
 
 
@@ -11,10 +16,45 @@ def current_time():
     # Hämta aktuell tid med rätt tidszon
     stockholm_time = datetime.now(timezone)
 
-    formatted_time = stockholm_time.strftime("Datum: %Y-%m-%d Tid: %H:%M:%S")
+    formatted_time = stockholm_time.strftime(LEGACY_TIME_FORMAT)
     
     return formatted_time
 
+
+# Formatet som current_time() använder, och som äldre loggar/användare sparades med
+LEGACY_TIME_FORMAT = "Datum: %Y-%m-%d Tid: %H:%M:%S"
+
+
+def utc_now():
+    """Current time as a timezone-aware UTC datetime, for storing in the database"""
+    return datetime.now(dt_timezone.utc)
+
+
+def format_stockholm(value, fmt=LEGACY_TIME_FORMAT):
+    """Render a stored UTC datetime in Stockholm time for display"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    if isinstance(value, str):
+        return value  # Äldre poster som ännu inte migrerats
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt_timezone.utc)  # pymongo returnerar naiv UTC
+    return value.astimezone(pytz.timezone('Europe/Stockholm')).strftime(fmt)
+
+
+def stockholm_day_start(day):
+    """UTC datetime for midnight Stockholm time at the start of the given date"""
+    local_midnight = pytz.timezone('Europe/Stockholm').localize(datetime.combine(day, datetime.min.time()))
+    return local_midnight.astimezone(dt_timezone.utc)
+
+
+def parse_legacy_timestamp(text):
+    """Parse a current_time() string (Stockholm local time) into a UTC datetime, or None"""
+    try:
+        local_time = datetime.strptime(text.strip(), LEGACY_TIME_FORMAT)
+    except (ValueError, AttributeError):
+        return None
+    return pytz.timezone('Europe/Stockholm').localize(local_time).astimezone(dt_timezone.utc)
+
 def year_one_month_ago():
     # Hämta den aktuella tiden för Stockholm (som beaktar sommartid)
     timezone = pytz.timezone('Europe/Stockholm')
@@ -27,97 +67,481 @@ def year_one_month_ago():
     return one_month_ago.year
 
 
+# Stabil radidentitet som följer med varje mål/uppgift genom namnbyten och redigeringar
+ROW_ID_COLUMN = 'Row_Id'
+
+# Används när Data-funktionerna körs utanför Streamlit (skript, CLI)
+_HEADLESS_SESSION = {}
+
+
+def new_row_id():
+    """Return a new stable identifier for a goal or task row"""
+    return uuid.uuid4().hex
+
+
+def _session_store():
+    """Per-session state, falls back to a module dict when not running under Streamlit"""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        if get_script_run_ctx(suppress_warning=True) is not None:
+            return st.session_state
+    except Exception:
+        pass
+    return _HEADLESS_SESSION
+
+
 # DataFrame structure
+# Deklarerat schema för planeringstabellen. Upprepade strängar lagras som kategorier,
+# datum som datetime64 och tal/flaggor med nullbara typer så att analyserna slipper object-aritmetik.
+PLAN_SCHEMA = {
+    ROW_ID_COLUMN: 'object',
+    'Type': 'category',
+    'Goal_Name': 'category',
+    'Goal_Description': 'object',
+    'Goal_Start_Date': 'datetime64[ns]',
+    'Goal_End_Date': 'datetime64[ns]',
+    'Goal_Completed': 'boolean',
+    'Task_Completed': 'boolean',
+    'Task_Name': 'object',
+    'Task_Description': 'object',
+    'Task_Start_Date': 'datetime64[ns]',
+    'Task_End_Date': 'datetime64[ns]',
+    'Task_Estimated_Time': 'Int64',
+    'Task_Estimated_Cost': 'float64',
+    'Task_Technical_Needs': 'category',
+    'Task_Weather_Conditions': 'category',
+    'Task_Needs_Rental': 'boolean',
+    'Task_Rental_Item': 'object',
+    'Task_Rental_Type': 'category',
+    'Task_Rental_Duration': 'Int64',
+    'Task_Rental_Cost_Per_Unit': 'float64',
+    'Task_Total_Rental_Cost': 'float64',
+    'Task_Personnel_Count': 'Int64',
+    'Task_Other_Needs': 'object',
+}
+
+DATE_COLUMNS = [column for column, dtype in PLAN_SCHEMA.items() if dtype.startswith('datetime64')]
+
+# Flaggor där saknat värde betyder "inte klar"/"ingen hyra"
+_FALSE_WHEN_MISSING = ['Goal_Completed', 'Task_Completed', 'Task_Needs_Rental']
+
+
+def _to_boolean(series):
+    if series.dtype == object:
+        series = series.replace({'True': True, 'False': False, 'true': True, 'false': False})
+    return series.astype('boolean')
+
+
+def _to_integer(series):
+    numbers = pd.to_numeric(series, errors='coerce')
+    # Heltalskolumner med decimaler (äldre data) behåller decimalerna hellre än att avrundas
+    if (numbers.dropna() % 1 != 0).any():
+        return numbers.astype('Float64')
+    return numbers.astype('Int64')
+
+
+def enforce_schema(df):
+    """Cast the plan DataFrame to PLAN_SCHEMA, adding any missing columns"""
+    df = df.copy()
+    for column, dtype in PLAN_SCHEMA.items():
+        if column not in df.columns:
+            df[column] = None
+
+        if dtype == 'category':
+            df[column] = df[column].astype(object).where(df[column].notna(), None).astype('category')
+        elif dtype == 'boolean':
+            df[column] = _to_boolean(df[column])
+            if column in _FALSE_WHEN_MISSING:
+                df[column] = df[column].fillna(False)
+        elif dtype.startswith('datetime64'):
+            df[column] = pd.to_datetime(df[column], format='mixed', errors='coerce').astype(dtype)
+        elif dtype == 'Int64':
+            df[column] = _to_integer(df[column])
+        elif dtype == 'float64':
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype('float64')
+        else:
+            df[column] = df[column].astype(object)
+    return df
+
+
+def set_plan_value(df, mask, column, value):
+    """Assign a value to plan cells while keeping the declared column dtype"""
+    if isinstance(df[column].dtype, pd.CategoricalDtype):
+        if value is not None and value not in df[column].cat.categories:
+            df[column] = df[column].cat.add_categories([value])
+    elif column in DATE_COLUMNS:
+        if isinstance(value, (tuple, list)):
+            value = value[0] if value else None
+        value = pd.Timestamp(value) if value is not None else pd.NaT
+    df.loc[mask, column] = value
+
+
+def format_date(value):
+    """Render a plan date for display"""
+    return value.strftime('%Y-%m-%d') if pd.notna(value) else ""
+
+
 def create_empty_dataframe():
-    return pd.DataFrame(columns=[
-        'Type', 'Goal_Name', 'Goal_Description', 'Goal_Start_Date', 'Goal_End_Date',
-        'Goal_Completed', 'Task_Completed',
-        'Task_Name', 'Task_Description', 'Task_Start_Date', 'Task_End_Date',
-        'Task_Estimated_Time', 'Task_Estimated_Cost', 'Task_Technical_Needs',
-        'Task_Weather_Conditions', 'Task_Needs_Rental', 'Task_Rental_Item',
-        'Task_Rental_Type', 'Task_Rental_Duration', 'Task_Rental_Cost_Per_Unit',
-        'Task_Total_Rental_Cost', 'Task_Personnel_Count', 'Task_Other_Needs'
-    ])
+    return enforce_schema(pd.DataFrame(columns=list(PLAN_SCHEMA)))
 
 
 # Data loading and saving functions
+def to_document_value(value):
+    """Convert a DataFrame cell to a value MongoDB can store"""
+    if value is None:
+        return None
+    if isinstance(value, (list, dict)):
+        return value
+    if pd.isna(value):
+        return None
+    if isinstance(value, pd.Timestamp) and value == value.normalize():
+        # Datum sparas som ISO-strängar (YYYY-MM-DD), precis som tidigare
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        # numpy-skalärer (int64, bool_, float64) -> Python-typer
+        return value.item()
+    return value
+
+
+def _row_to_document(record):
+    return {key: to_document_value(value) for key, value in record.items()}
+
+
+def dataframe_to_documents(df):
+    """Convert a plan DataFrame to MongoDB-ready documents"""
+    return [_row_to_document(record) for record in df.to_dict('records')]
+
+
+def _document_hash(document):
+    # 0 och 0.0 ska räknas som samma värde, annars ger dtype-byten i pandas falska ändringar
+    normalized = {
+        key: int(value) if isinstance(value, float) and value.is_integer() else value
+        for key, value in document.items()
+    }
+    payload = json.dumps(normalized, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _get_plan_snapshot():
+    """Row_Id -> content hash of the rows as they were last loaded or saved by this session"""
+    return _session_store().get('goals_snapshot', {})
+
+
+def _set_plan_snapshot(snapshot):
+    _session_store()['goals_snapshot'] = snapshot
+
+
+def _plan_snapshot_of(df):
+    return {
+        document[ROW_ID_COLUMN]: _document_hash(document)
+        for document in dataframe_to_documents(df)
+    }
+
+
+# Dataversion: en monoton räknare i databasen som ökas vid varje skrivning.
+# Den laddade planen delas mellan alla sessioner i processen så länge versionen är oförändrad.
+DATA_VERSION_ID = 'data_version'
+
+_plan_cache = {'version': None, 'df': None, 'snapshot': None}
+_plan_cache_lock = threading.Lock()
+
+
+def get_data_version(db=None):
+    """Return the current data version stored in the database (0 if never written)"""
+    if db is None:
+        from database import get_database
+        db = get_database()
+    document = db.meta.find_one({'_id': DATA_VERSION_ID})
+    return document['value'] if document else 0
+
+
+def bump_data_version(db, plan_changed=False):
+    """
+    Increment the data version after a write and keep this session current if possible.
+    plan_changed=True drops the shared plan cache, since its rows no longer match the database.
+    """
+    from pymongo import ReturnDocument
+    document = db.meta.find_one_and_update(
+        {'_id': DATA_VERSION_ID},
+        {'$inc': {'value': 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    new_version = document['value']
+
+    # Om ingen annan skrivit sedan sessionen laddade sin version följer den med till den nya.
+    # Annars lämnas den gammal så att nästa körning hämtar om planen.
+    session = _session_store()
+    if session.get('data_version') == new_version - 1:
+        session['data_version'] = new_version
+    with _plan_cache_lock:
+        if plan_changed:
+            _plan_cache.update({'version': None, 'df': None, 'snapshot': None})
+        elif _plan_cache['version'] == new_version - 1:
+            _plan_cache['version'] = new_version
+    return new_version
+
+
+def _report_connection_error(error):
+    """Flagga degraderat läge direkt när en databasoperation inte når servern"""
+    from pymongo.errors import ConnectionFailure
+    if isinstance(error, ConnectionFailure):
+        from database import report_database_error
+        report_database_error(error)
+
+
+def plan_is_stale():
+    """True if another write has happened since this session loaded its plan"""
+    try:
+        from database import is_degraded
+        from write_journal import pending_count
+        if is_degraded() or pending_count():
+            # Behåll sessionens plan hellre än att vänta på en databas som inte svarar,
+            # eller att läsa in en plan som saknar ändringar som ännu ligger i journalen
+            return False
+        return get_data_version() != _session_store().get('data_version')
+    except Exception as e:
+        _report_connection_error(e)
+        print(f"Error checking data version: {e}")
+        return False
+
+
+def _backfill_row_ids(db, documents):
+    """Give documents saved before Row_Id existed a stable id based on their _id"""
+    from pymongo import UpdateOne
+    updates = []
+    for document in documents:
+        if not document.get(ROW_ID_COLUMN):
+            document[ROW_ID_COLUMN] = str(document['_id'])
+            updates.append(UpdateOne({'_id': document['_id']},
+                                     {'$set': {ROW_ID_COLUMN: document[ROW_ID_COLUMN]}}))
+    if updates:
+        db.goals.bulk_write(updates, ordered=False)
+        print(f"Assigned {ROW_ID_COLUMN} to {len(updates)} existing documents")
+
+
 def load_data():
     try:
         from database import get_database
         db = get_database()
-        data = list(db.goals.find({}, {'_id': 0}))  # Exclude MongoDB _id field
-        
-        if not data:
-            return create_empty_dataframe()
-            
-        df = pd.DataFrame(data)
-        
-        # Convert date strings to datetime.date objects
-        date_columns = ['Goal_Start_Date', 'Goal_End_Date', 'Task_Start_Date', 'Task_End_Date']
-        for col in date_columns:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], format='mixed', errors='coerce').dt.date
-        
-        # Initialize completion columns if they don't exist
-        if 'Goal_Completed' not in df.columns: df['Goal_Completed'] = False
-        if 'Task_Completed' not in df.columns: df['Task_Completed'] = False
-        
+        version = get_data_version(db)
+
+        with _plan_cache_lock:
+            if _plan_cache['version'] == version:
+                df = _plan_cache['df'].copy()
+                snapshot = dict(_plan_cache['snapshot'])
+            else:
+                df = None
+
+        if df is None:
+            data = list(db.goals.find({}))
+
+            if data:
+                _backfill_row_ids(db, data)
+                for document in data:
+                    document.pop('_id', None)  # Exclude MongoDB _id field
+
+                # Typa kolumnerna enligt PLAN_SCHEMA (datum, kategorier, flaggor, tal)
+                df = enforce_schema(pd.DataFrame(data))
+            else:
+                df = create_empty_dataframe()
+
+            snapshot = _plan_snapshot_of(df)
+            with _plan_cache_lock:
+                _plan_cache.update({'version': version, 'df': df.copy(), 'snapshot': dict(snapshot)})
+
+        _set_plan_snapshot(snapshot)
+        _session_store()['data_version'] = version
+        _set_plan_contributions(df)
         return df
     except Exception as e:
+        _report_connection_error(e)
         print(f"Error loading data from MongoDB: {e}")
         return create_empty_dataframe()
 
 
+def _plan_write_operations(df, snapshot):
+    """Build upserts for new/changed rows and deletes for rows removed since the snapshot"""
+    from pymongo import ReplaceOne, DeleteOne
+
+    missing_ids = df[ROW_ID_COLUMN].isna() if ROW_ID_COLUMN in df.columns else None
+    if missing_ids is None:
+        df[ROW_ID_COLUMN] = [new_row_id() for _ in range(len(df))]
+    elif missing_ids.any():
+        df.loc[missing_ids, ROW_ID_COLUMN] = [new_row_id() for _ in range(int(missing_ids.sum()))]
+
+    operations = []
+    new_snapshot = {}
+    for document in dataframe_to_documents(df):
+        row_id = document[ROW_ID_COLUMN]
+        row_hash = _document_hash(document)
+        new_snapshot[row_id] = row_hash
+        if snapshot.get(row_id) != row_hash:
+            operations.append(ReplaceOne({ROW_ID_COLUMN: row_id}, document, upsert=True))
+
+    for row_id in snapshot.keys() - new_snapshot.keys():
+        operations.append(DeleteOne({ROW_ID_COLUMN: row_id}))
+
+    return operations, new_snapshot
+
+
+def _set_plan_contributions(df):
+    """Keep each task's share of plan_rollups as loaded/saved, so the next save can send only the difference"""
+    from plan_rollups import contributions
+    _session_store()['plan_contributions'] = contributions(df)
+
+
+def _plan_rollup_operations(df, snapshot, new_snapshot):
+    """
+    Recomputed plan_rollups documents for the months/goals touched by rows that differ
+    between the two snapshots, plus any left over from a save whose rollup write failed.
+
+    :return: (operations, contributions to keep once the operations are written, keys)
+    """
+    from plan_rollups import contributions, affected_keys, rollup_operations
+    previous = _session_store().get('plan_contributions')
+    current = contributions(df)
+    if previous is None:
+        previous = current.iloc[0:0]
+    changed = {row_id for row_id in snapshot.keys() | new_snapshot.keys()
+               if snapshot.get(row_id) != new_snapshot.get(row_id)}
+    keys = affected_keys(previous, current, changed) | _session_store().get('plan_rollups_dirty', set())
+    return rollup_operations(current, keys), current, keys
+
+
+# save_data: ändringen ligger i den lokala journalen och är ännu inte skriven till databasen
+SAVE_JOURNALED = "journaled"
+
+
 def save_data(df):
+    """
+    Save the plan incrementally: only rows added, changed or removed since the
+    last load/save are sent, as one ordered bulk_write keyed on Row_Id.
+    Returns the number of documents touched, SAVE_JOURNALED when the write was
+    kept in the local journal to be replayed later, 0 when nothing has changed,
+    or None if the save failed.
+    """
     try:
         from database import get_database
+        from write_journal import journaled_bulk_write
+        snapshot = _get_plan_snapshot()
+        operations, new_snapshot = _plan_write_operations(df, snapshot)
+        if not operations:
+            return 0
+
+        result = journaled_bulk_write('goals', operations, f"Plan: {len(operations)} ändringar")
+        _set_plan_snapshot(new_snapshot)
+
+        # Månadssummorna räknas om för samma ändringar (journalförs efter planen om databasen inte svarar)
+        rollup_keys = set()
+        try:
+            rollup_operations, contributions, rollup_keys = _plan_rollup_operations(df, snapshot, new_snapshot)
+            if rollup_operations:
+                journaled_bulk_write('plan_rollups', rollup_operations, "Plan: månadssummor")
+            # Först när summorna är skrivna (eller ligger i journalen) räknas de som aktuella
+            _session_store()['plan_contributions'] = contributions
+            _session_store().pop('plan_rollups_dirty', None)
+        except Exception as e:
+            _report_connection_error(e)
+            # Räknas om vid nästa sparning
+            _session_store()['plan_rollups_dirty'] = _session_store().get('plan_rollups_dirty', set()) | rollup_keys
+            print(f"Error updating plan rollups (run 'python plan_rollups.py rebuild'): {e}")
+
+        if result is None:
+            # Databasen svarar inte: ändringen ligger i journalen och sessionen behåller sin plan
+            print(f"Saved plan to the local journal: {len(operations)} operations pending")
+            return SAVE_JOURNALED
+
         db = get_database()
-        # Convert DataFrame to dict records
-        records = df.to_dict('records')
-        
-        # Convert date objects to strings for MongoDB
-        for record in records:
-            for key, value in record.items():
-                if isinstance(value, datetime.date):
-                    record[key] = value.isoformat()
-        
-        # Clear existing data and insert new
-        db.goals.delete_many({})
-        if records:
-            db.goals.insert_many(records)
+        held_version = _session_store().get('data_version')
+        new_version = bump_data_version(db, plan_changed=True)
+        if new_version == (held_version or 0) + 1:
+            # Ingen annan har skrivit emellan: sessionens plan är den nya delade versionen
+            with _plan_cache_lock:
+                _plan_cache.update({'version': new_version, 'df': df.copy(), 'snapshot': dict(new_snapshot)})
+
+        touched = result.upserted_count + result.matched_count + result.deleted_count
+        print(f"Saved plan: {len(operations)} operations, {touched} documents touched")
+        return touched
     except Exception as e:
+        _report_connection_error(e)
         print(f"Error saving data to MongoDB: {e}")
+        return None
 
 
 # Technical needs management
+# Katalogen över redskap hålls i minnet för hela processen. Den läses från databasen
+# första gången och uppdateras sedan bara när katalogen sparas (write-through).
+_technical_needs_cache = {'needs': None, 'hits': 0, 'misses': 0}
+_technical_needs_lock = threading.Lock()
+
+
+def _fetch_technical_needs():
+    from database import get_database
+    db = get_database()
+    needs = list(db.technical_needs.find({}, {'_id': 0}))
+    if not needs:
+        default_needs = [
+            'Traktor - Utan Redskap',
+            'Fyrhjuling - Utan Redskap',
+            'Handverktyg - Övrigt',
+            'Elverktyg - Övrigt',
+            'Övrigt - Bil'
+        ]
+        db.technical_needs.insert_many([{'Redskap': need} for need in default_needs])
+        return default_needs
+    return [need['Redskap'] for need in needs]
+
+
 def load_technical_needs():
+    with _technical_needs_lock:
+        if _technical_needs_cache['needs'] is not None:
+            _technical_needs_cache['hits'] += 1
+            return list(_technical_needs_cache['needs'])
+        _technical_needs_cache['misses'] += 1
+
     try:
-        from database import get_database
-        db = get_database()
-        needs = list(db.technical_needs.find({}, {'_id': 0}))
-        if not needs:
-            default_needs = [
-                'Traktor - Utan Redskap',
-                'Fyrhjuling - Utan Redskap',
-                'Handverktyg - Övrigt',
-                'Elverktyg - Övrigt',
-                'Övrigt - Bil'
-            ]
-            db.technical_needs.insert_many([{'Redskap': need} for need in default_needs])
-            return default_needs
-        return [need['Redskap'] for need in needs]
+        needs = _fetch_technical_needs()
     except Exception as e:
         print(f"Error loading technical needs from MongoDB: {e}")
         return []
 
+    with _technical_needs_lock:
+        _technical_needs_cache['needs'] = list(needs)
+    return list(needs)
+
+
+def invalidate_technical_needs_cache():
+    """Drop the cached catalogue so the next read goes to the database"""
+    with _technical_needs_lock:
+        _technical_needs_cache['needs'] = None
+
+
+def get_technical_needs_cache_stats():
+    """Hit/miss counters for the technical-needs catalogue cache"""
+    with _technical_needs_lock:
+        needs = _technical_needs_cache['needs']
+        return {
+            'hits': _technical_needs_cache['hits'],
+            'misses': _technical_needs_cache['misses'],
+            'cached_items': len(needs) if needs is not None else 0,
+        }
+
 
 def save_technical_needs(needs_list):
     try:
+        from database import get_database
         db = get_database()
         db.technical_needs.delete_many({})
         if needs_list:
             db.technical_needs.insert_many([{'Redskap': need} for need in needs_list])
+        bump_data_version(db)
+        with _technical_needs_lock:
+            _technical_needs_cache['needs'] = list(needs_list)
     except Exception as e:
+        invalidate_technical_needs_cache()
         print(f"Error saving technical needs to MongoDB: {e}")
 
 
@@ -175,26 +599,24 @@ def convert_rental_info(rental_item, rental_duration, rental_cost_unit):
 
 
 def save_risk_data(risks):
-    """Save risks to MongoDB"""
+    """
+    Save risks to MongoDB.
+    Replaces the whole collection in one ordered bulk_write; if the database is
+    unreachable the write is kept in the local journal and replayed later.
+    """
     try:
         from database import get_database
-        db = get_database()
-        # Clear existing risks
-        db.risks.delete_many({})
-        # Insert new risks if any exist
-        if risks:
-            """             
-            # Convert any date objects to strings
-            formatted_risks = []
-            for risk in risks:
-                risk_copy = risk.copy()
-                for key, value in risk_copy.items():
-                    if isinstance(value, (datetime.date, datetime)):
-                        risk_copy[key] = value.isoformat()
-                formatted_risks.append(risk_copy) """
-            
-            db.risks.insert_many(risks)
-            print(f"Saved {len(risks)} risks to database")  # Debug print
+        from pymongo import DeleteMany, InsertOne
+        from write_journal import journaled_bulk_write
+
+        operations = [DeleteMany({})] + [InsertOne(dict(risk)) for risk in risks or []]
+        result = journaled_bulk_write('risks', operations, f"Risker: {len(risks or [])} st")
+        if result is None:
+            print(f"Saved {len(risks or [])} risks to the local journal")
+            return True
+
+        print(f"Saved {len(risks or [])} risks to database")  # Debug print
+        bump_data_version(get_database())
         return True
     except Exception as e:
         print(f"Error saving risks: {str(e)}")
@@ -3,7 +3,9 @@ import plotly.express as px
 import plotly.graph_objects as go
 import streamlit as st
 from datetime import datetime
-from Data import current_time, year_one_month_ago
+from Data import current_time, year_one_month_ago, dataframe_to_documents, enforce_schema
+from Analysis import get_task_facts
+from analytics_cache import content_key
 from custom_logging import log_action
 import pytz
 from database import get_database
@@ -16,7 +18,8 @@ def load_historical_data():
         data = list(db.history.find({}, {'_id': 0}))
         if not data:
             return pd.DataFrame()
-        return pd.DataFrame(data)
+        # Samma typer som planen så att analysernas faktatabell kan användas
+        return enforce_schema(pd.DataFrame(data))
     except Exception as e:
         print(f"Error loading historical data: {e}")
         return pd.DataFrame()
@@ -34,14 +37,8 @@ def save_year_to_history(current_data):
         data_to_save['Archive_Year'] = datetime.now().year
         data_to_save['Archive_Date'] = current_time()
         
-        # Convert DataFrame to records
-        records = data_to_save.to_dict('records')
-        
-        # Convert date objects to strings for MongoDB
-        for record in records:
-            for key, value in record.items():
-                if hasattr(value, 'isoformat'):  # Check if object has isoformat method
-                    record[key] = value.isoformat()
+        # Convert DataFrame to records (dates as ISO strings, typed columns as plain Python values)
+        records = dataframe_to_documents(data_to_save)
         
         # Insert new records
         if records:
@@ -63,41 +60,56 @@ def compare_years(years):
     # Filter for selected years
     df_filtered = hist_df[hist_df['Archive_Year'].isin(years)]
 
-    # Create comparative visualizations
-    create_cost_comparison(df_filtered)
-    create_resource_comparison(df_filtered)
-
+    # Create comparative visualizations (faktatabellen byggs en gång för båda)
+    history_key = content_key(df_filtered)
+    create_cost_comparison(df_filtered, history_key)
+    create_resource_comparison(df_filtered, history_key)
 
-def create_cost_comparison(dataframe):
-    """Create cost comparison visualizations"""
-    st.subheader("Cost Comparison Across Years")
 
+def build_cost_comparison(dataframe, plan_key=None):
+    """Cost comparison figure for the given history rows (used by the app and report.py)"""
     # Yearly total costs
-    yearly_costs = dataframe.groupby('Archive_Year').agg({
+    tasks = get_task_facts(dataframe, plan_key)['tasks']
+    yearly_costs = tasks.groupby('Archive_Year').agg({
         'Task_Estimated_Cost': 'sum',
         'Task_Total_Rental_Cost': 'sum'
     }).reset_index()
 
-    figure = px.bar(yearly_costs,
-                    x='Archive_Year',
-                    y=['Task_Estimated_Cost', 'Task_Total_Rental_Cost'],
-                    title='Cost Comparison by Year',
-                    barmode='group')
-    st.plotly_chart(figure)
+    return px.bar(yearly_costs,
+                  x='Archive_Year',
+                  y=['Task_Estimated_Cost', 'Task_Total_Rental_Cost'],
+                  title='Cost Comparison by Year',
+                  barmode='group')
 
 
-def create_resource_comparison(dataframe):
-    """Create resource usage comparison visualizations"""
-    st.subheader("Resource Usage Comparison")
+def create_cost_comparison(dataframe, plan_key=None):
+    """Create cost comparison visualizations"""
+    st.subheader("Cost Comparison Across Years")
+    st.plotly_chart(build_cost_comparison(dataframe, plan_key))
+
 
+def build_resource_comparison(dataframe, plan_key=None):
+    """Equipment usage figure for the given history rows (used by the app and report.py)"""
     # Equipment usage frequency by year
-    equipment_usage = dataframe.groupby(['Archive_Year', 'Task_Technical_Needs']).size().reset_index(name='count')
-    figure = px.bar(equipment_usage,
-                    x='Task_Technical_Needs',
-                    y='count',
-                    color='Archive_Year',
-                    title='Equipment Usage by Year')
-    st.plotly_chart(figure)
+    # En rad per redskap och uppgift från faktatabellen, med uppgiftens arkivår
+    facts = get_task_facts(dataframe, plan_key)
+    tools = facts['tools']
+    usage = pd.DataFrame({
+        'Archive_Year': facts['tasks']['Archive_Year'].to_numpy()[tools['task'].to_numpy()],
+        'Task_Technical_Needs': tools['Tool'].to_numpy()
+    })
+    equipment_usage = usage.groupby(['Archive_Year', 'Task_Technical_Needs'], observed=True).size().reset_index(name='count')
+    return px.bar(equipment_usage,
+                  x='Task_Technical_Needs',
+                  y='count',
+                  color='Archive_Year',
+                  title='Equipment Usage by Year')
+
+
+def create_resource_comparison(dataframe, plan_key=None):
+    """Create resource usage comparison visualizations"""
+    st.subheader("Resource Usage Comparison")
+    st.plotly_chart(build_resource_comparison(dataframe, plan_key))
 
 
 def show_historical_analysis():
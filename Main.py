@@ -3,21 +3,26 @@ from datetime import datetime, timedelta
 from Data import current_time
 import pytz
 import sys
-import pandas as pd
-import plotly.express as px
-from auth import init_auth, show_login_page, logout
+from auth import init_auth, show_login_page, logout, restore_session
 from custom_logging import log_action, compare_and_log_changes
 
 # Importerat från andra filer
-from Data import (load_data, save_data, get_technical_needs_list,
-                  load_technical_needs, save_technical_needs, WEATHER_CONDITIONS)
+from Data import (load_data, save_data, plan_is_stale, get_technical_needs_list,
+                  load_technical_needs, save_technical_needs, WEATHER_CONDITIONS, format_date)
 from History import save_year_to_history, show_historical_analysis, load_historical_data
-from Analysis import (create_cost_analysis, create_gantt_charts,
-                      analyze_work_hours, create_technical_needs_analysis, create_completion_analysis)
+from Analysis import (create_cost_analysis, build_gantt_specs, create_gantt_overview, create_goal_gantt,
+                      timeline_window, analyze_work_hours, create_technical_needs_analysis, create_completion_analysis,
+                      create_weather_summary, task_chart_settings)
 from Planning import (add_goal, add_task, update_dataframe, toggle_task_completion, toggle_goal_completion,
                       bug_tracking_tab)
 from Risk_Assessment import risk_assessment_app, display_risk_overview
 from Admin import admin_panel
+from analytics_cache import cached_figures, content_key
+from analytics_queries import get_plan_rollups
+from migrations import bootstrap_database
+from database import is_degraded
+from db_monitor import track_rerun, monitor_tab
+from write_journal import start_replay, pending_count, failed_count
 
 # """
 # Emojis som används i programmet:
@@ -177,11 +182,24 @@ if 'authenticated' not in st.session_state:
 if 'user_role' not in st.session_state:
     st.session_state.user_role = None
 
+def show_figure(fig):
+    """Visa ett diagram, med storleken på diagramdatan som skickas till webbläsaren om det är valt"""
+    st.plotly_chart(fig, use_container_width=True)
+    if st.session_state.get('show_chart_payload'):
+        st.caption(f"Diagramdata: {len(fig.to_json()) / 1024:.0f} kB")
+
+
 # Main application function
 def main_app():
     """Main application logic - only shown when user is authenticated"""
+    # Databasens hälsa kontrolleras i bakgrunden; visa en varning i stället för att vänta
+    if is_degraded():
+        st.warning("⚠️ Databasen svarar inte just nu. Visar senast hämtade data; "
+                   "ändringar sparas lokalt och skickas när anslutningen är tillbaka.")
+
     # Initialize session state variables
-    if 'df' not in st.session_state:
+    # Planen hämtas bara om när en annan skrivning har ökat dataversionen
+    if 'df' not in st.session_state or plan_is_stale():
         st.session_state.df = load_data()
     if 'edit_mode' not in st.session_state:
         st.session_state.edit_mode = False
@@ -203,6 +221,15 @@ def main_app():
         logout()
         st.rerun()
 
+    # Skrivningar som ligger i den lokala journalen och väntar på databasen
+    pending_writes = pending_count()
+    if pending_writes:
+        st.sidebar.warning(f"⏳ {pending_writes} ändringar väntar på att sparas till databasen")
+        failed_writes = failed_count()
+        if failed_writes:
+            st.sidebar.error(f"⚠️ {failed_writes} ändringar kunde inte sparas och stoppar kön. "
+                             "En administratör behöver försöka igen eller kasta dem under Admin.")
+
     # Your existing main app code here
     st.title("Projektplaneringsverktyg")
     
@@ -262,7 +289,7 @@ def main_app():
                 "🐛 Rapportera Buggar"
             ])
 
-        with main_tab1:
+        with main_tab1, monitor_tab("Planering"):
             planning_tab1, planning_tab2, planning_tab3, planning_tab4, planning_tab5 = st.tabs([
                 "🎯 Lägg till Mål",
                 "📋 Lägg till Uppgift",
@@ -271,7 +298,7 @@ def main_app():
                 "🛠️ Hantera Tekniska Behov"
             ])
 
-            with planning_tab1:
+            with planning_tab1, monitor_tab("Lägg till Mål"):
                 with st.form("goal_form", clear_on_submit=True):
                     st.subheader("🎯 Lägg till Nytt Mål")
 
@@ -299,7 +326,7 @@ def main_app():
                             log_action("add_goal", f"{st.session_state.username} lade till ett nytt mål, {goal_name}", "Planering/Lägg till Mål")
                             st.success("🎉 Mål tillagt!")
 
-            with planning_tab2:
+            with planning_tab2, monitor_tab("Lägg till Uppgift"):
                 if len(st.session_state.df[st.session_state.df['Type'] == 'Goal']) > 0:
                     with st.form("task_form", clear_on_submit=True):
                         st.subheader("📋 Lägg till Ny Uppgift")
@@ -393,10 +420,10 @@ def main_app():
                 else:
                     st.warning("Lägg till ett mål först innan du skapar uppgifter.")
 
-            with planning_tab3:
+            with planning_tab3, monitor_tab("Riskbedömning"):
                 risk_assessment_app(st.session_state.df)
 
-            with planning_tab4:
+            with planning_tab4, monitor_tab("Översikt"):
                 st.subheader("Mål- och Uppgiftsöversikt")
 
                 st.write(f"Här får man en översikt över de mål och uppgifter man lagt till.")
@@ -423,10 +450,12 @@ def main_app():
                     if st.session_state.edited_data:  # Only show if there are changes to save
                         if st.button("Spara Ändringar"):
                             
+                            edited_df = update_dataframe(st.session_state.df.copy(), st.session_state.edited_data)
+
                             #Logga ändringar
-                            compare_and_log_changes(st.session_state.df, st.session_state.edited_data)
+                            compare_and_log_changes(st.session_state.df, edited_df)
 
-                            st.session_state.df = update_dataframe(st.session_state.df, st.session_state.edited_data)
+                            st.session_state.df = edited_df
                             save_data(st.session_state.df)  # Save to file
 
                             # Clear the edited data and reset states
@@ -467,7 +496,8 @@ def main_app():
                             st.session_state.edited_data[f"goal_{goal['Goal_Name']}"] = edited_goal
                         else:
                             st.write(f"**Beskrivning:** {goal['Goal_Description']}")
-                            st.write(f"**Varaktighet:** {goal['Goal_Start_Date']} till {goal['Goal_End_Date']}")
+                            st.write(f"**Varaktighet:** {format_date(goal['Goal_Start_Date'])} till "
+                                     f"{format_date(goal['Goal_End_Date'])}")
 
                         tasks = st.session_state.df[
                             (st.session_state.df['Type'] == 'Task') &
@@ -607,7 +637,8 @@ def main_app():
                                         else:
                                             st.write(f"**Beskrivning:** {task['Task_Description']}")
                                             st.write(
-                                                f"**Varaktighet:** {task['Task_Start_Date']} till {task['Task_End_Date']}")
+                                                f"**Varaktighet:** {format_date(task['Task_Start_Date'])} till "
+                                                f"{format_date(task['Task_End_Date'])}")
 
                                         if not st.session_state.edit_mode:
                                             st.write(f"**Uppskattad Tid:** {task['Task_Estimated_Time']} timmar")
@@ -637,7 +668,7 @@ def main_app():
                                         st.divider()
                                         task_completed = st.checkbox(
                                             "Uppgift slutförd",
-                                            value=task['Task_Completed'],
+                                            value=bool(task['Task_Completed']),
                                             key=f"task_complete_{goal['Goal_Name']}_{task['Task_Name']}"
                                         )
                                         st.divider()
@@ -678,60 +709,78 @@ def main_app():
                         else:
                             st.warning("❌ Ingen uppgift har ännu gjorts för detta målet.")
 
-                with planning_tab5:
-                    st.subheader("Hantera Tekniska Behov")
+            with planning_tab5, monitor_tab("Tekniska Behov"):
+                st.subheader("Hantera Tekniska Behov")
 
-                    st.write(f"Här lägger man till redskap som sedan blir valbara när man skapar uppgifter.")
-                    st.write(f"Verktygen delas upp i övergripande kategorier, välj en kategori och skriv namnet på redskapet.")
+                st.write(f"Här lägger man till redskap som sedan blir valbara när man skapar uppgifter.")
+                st.write(f"Verktygen delas upp i övergripande kategorier, välj en kategori och skriv namnet på redskapet.")
 
-                    st.divider()
+                st.divider()
+
+                tech_needs = load_technical_needs()
+
+                categories = sorted(set(need.split(" - ")[0] for need in tech_needs))
 
-                    tech_needs = load_technical_needs()
-
-                    categories = sorted(set(need.split(" - ")[0] for need in tech_needs))
-
-                    with st.expander("🔨 Lägg till nytt redskap"):
-                        with st.form("add_need"):
-                            category = st.selectbox(
-                                "Välj Kategori",
-                                options=categories
-                            )
-                            need = st.text_input("Nytt redskap")
-                            submit_need = st.form_submit_button("Lägg till redskap")
-                            if submit_need and need:
-                                full_need = f"{category} - {need}"
-                                if full_need not in tech_needs:
-                                    tech_needs.append(full_need)
-                                    tech_needs.sort(key=lambda x: x.split(" - ")[0])
+                with st.expander("🔨 Lägg till nytt redskap"):
+                    with st.form("add_need"):
+                        category = st.selectbox(
+                            "Välj Kategori",
+                            options=categories
+                        )
+                        need = st.text_input("Nytt redskap")
+                        submit_need = st.form_submit_button("Lägg till redskap")
+                        if submit_need and need:
+                            full_need = f"{category} - {need}"
+                            if full_need not in tech_needs:
+                                tech_needs.append(full_need)
+                                tech_needs.sort(key=lambda x: x.split(" - ")[0])
+                                save_technical_needs(tech_needs)
+                                st.success(f"Redskap '{full_need}' tillagt!")
+                                log_action("add_tool", f"{st.session_state.username} la till nytt redskap, {full_need}", "Planering/Hantera Tekniska Behov")
+                                st.rerun()
+                            else:
+                                st.error("Detta redskap finns redan!")
+
+                st.subheader("Befintliga Redskap")
+                for category in categories:
+                    with st.expander(category):
+                        category_needs = [need for need in tech_needs if need.startswith(category)]
+                        for need in category_needs:
+                            col1, col2 = st.columns([3, 1])
+                            with col1:
+                                st.write(need)
+                            with col2:
+                                if st.button("Ta Bort", key=f"del_{need}"):
+                                    tech_needs.remove(need)
                                     save_technical_needs(tech_needs)
-                                    st.success(f"Redskap '{full_need}' tillagt!")
-                                    log_action("add_tool", f"{st.session_state.username} la till nytt redskap, {full_need}", "Planering/Hantera Tekniska Behov")
+                                    st.success(f"Behov '{need}' borttaget!")
+                                    log_action("remove_tool", f"{st.session_state.username} tog bort redskap, {need}", "Planering/Hantera Tekniska Behov")
                                     st.rerun()
-                                else:
-                                    st.error("Detta redskap finns redan!")
-
-                    st.subheader("Befintliga Redskap")
-                    for category in categories:
-                        with st.expander(category):
-                            category_needs = [need for need in tech_needs if need.startswith(category)]
-                            for need in category_needs:
-                                col1, col2 = st.columns([3, 1])
-                                with col1:
-                                    st.write(need)
-                                with col2:
-                                    if st.button("Ta Bort", key=f"del_{need}"):
-                                        tech_needs.remove(need)
-                                        save_technical_needs(tech_needs)
-                                        st.success(f"Behov '{need}' borttaget!")
-                                        log_action("remove_tool", f"{st.session_state.username} tog bort redskap, {need}", "Planering/Hantera Tekniska Behov")
-                                        st.rerun()
 
-        with main_tab2:  # Analys Tab
+        with main_tab2, monitor_tab("Analys"):  # Analys Tab
             st.subheader("Analys")
             st.info("💡 **Tips:**\n"
                     "- Dra i diagrammen för att zooma\n"
                     "- Dubbelklicka för att återställa vyn\n"
                     "- Hovra över datapunkter för mer information")
+
+            # Diagram med en stapel per uppgift byts mot en sammanfattning när uppgifterna blir många
+            defaults = task_chart_settings()
+            modes = {"top_n": "Topp N + Övriga", "histogram": "Histogram", "webgl": "WebGL-punkter"}
+            with st.expander("⚙️ Diagraminställningar"):
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    threshold = st.number_input("Max staplar per uppgift", min_value=1,
+                                                value=defaults.threshold, key="task_chart_threshold")
+                with col2:
+                    mode = st.selectbox("Visning över gränsen", list(modes), format_func=modes.get,
+                                        index=list(modes).index(defaults.mode), key="task_chart_mode")
+                with col3:
+                    top_n = st.number_input("Antal i topplistan", min_value=1,
+                                            value=defaults.top_n, key="task_chart_top_n")
+                st.checkbox("Visa diagrammens datastorlek", key="show_chart_payload")
+            chart_settings = task_chart_settings(threshold=int(threshold), mode=mode, top_n=int(top_n))
+
             gantt_charts, cost_analysis, work_hours, technical_needs, completion_status, historical_data, \
                 risk_matrix, risk_analysis, other = st.tabs([
                     "📊 Gantt Schema",
@@ -744,62 +793,79 @@ def main_app():
                     "👷 Riskanalys",
                     "🛑 Inget Ännu"])
 
-            with cost_analysis:
+            # Diagrammen byggs bara om när planens innehåll har ändrats (analytics_cache)
+            # Nyckeln räknas en gång per körning och skickas vidare som plan_key, så att
+            # diagrammen hittar den delade faktatabellen utan att hasha planen igen
+            plan_key = content_key(st.session_state.df)
+
+            def cached(builder, *args):
+                return cached_figures(builder, st.session_state.df, *args, key=plan_key, plan_key=plan_key)
+
+            # Summor per mål/månad räknas i databasen när sessionens plan är aktuell (annars None)
+            rollups = get_plan_rollups()
+
+            with cost_analysis, monitor_tab("Kostnadsanalys"):
                 # Get all cost analysis figures at once
-                cost_figures = create_cost_analysis(st.session_state.df)
+                cost_figures = cached(create_cost_analysis, rollups, chart_settings)
                 for fig in cost_figures:
-                    st.plotly_chart(fig, use_container_width=True)
+                    show_figure(fig)
+
+            with gantt_charts, monitor_tab("Gantt-schema"):
+                gantt_specs = cached(build_gantt_specs)
+                if gantt_specs["overview"] is not None:
+                    # Bara staplarna i det valda datumfönstret skickas till webbläsaren
+                    window_choice = st.radio("Visa period", ["Allt", "Denna vecka", "Denna månad", "Anpassat"],
+                                             horizontal=True, key="gantt_window")
+                    custom_range = None
+                    if window_choice == "Anpassat":
+                        custom_range = st.date_input("Datumintervall",
+                                                     value=(datetime.now(), datetime.now() + timedelta(days=30)),
+                                                     key="gantt_custom_range")
+                    window = timeline_window(window_choice, custom_range=custom_range)
 
-            with gantt_charts:
-                gantt_figs = create_gantt_charts(st.session_state.df)
-                if gantt_figs:
                     # Display overview chart first (outside of expanders)
-                    if gantt_figs["overview"] is not None:
-                        st.plotly_chart(gantt_figs["overview"], use_container_width=True)
+                    overview = cached(create_gantt_overview, window)
+                    if overview is not None:
+                        show_figure(overview)
 
-                    # Display task timelines in expanders
-                    for goal_name, fig in gantt_figs["tasks"].items():
+                    # Tidslinjerna byggs först när användaren väljer att visa dem (en cache per mål och fönster)
+                    for goal_name in gantt_specs["goals"]:
                         with st.expander(f"Tidslinje för {goal_name}"):
-                            st.plotly_chart(fig, use_container_width=True)
+                            if st.toggle("Visa tidslinje", key=f"gantt_{goal_name}"):
+                                fig = cached(create_goal_gantt, goal_name, window)
+                                if fig is not None:
+                                    show_figure(fig)
+                                else:
+                                    st.info("Inga uppgifter under vald period")
 
-                    if not gantt_figs["tasks"]:
+                    if not gantt_specs["goals"]:
                         st.info("Inga uppgifter att visa i tidslinjer")
 
                 else:
                     st.warning("Inga uppgifter att visa i Gantt-schema")
 
-            with work_hours:
-                work_figures = analyze_work_hours(st.session_state.df)
+            with work_hours, monitor_tab("Arbetstimmar"):
+                work_figures = cached(analyze_work_hours, rollups, chart_settings)
                 for fig in work_figures:
-                    st.plotly_chart(fig, use_container_width=True)
+                    show_figure(fig)
 
-            with technical_needs:
-                tech_figures = create_technical_needs_analysis(st.session_state.df)
+            with technical_needs, monitor_tab("Tekniska Behov"):
+                tech_figures = cached(create_technical_needs_analysis)
                 for fig in tech_figures:
                     if fig is not None:
-                        st.plotly_chart(fig, use_container_width=True)
+                        show_figure(fig)
 
                 # Add weather conditions summary
-                tasks = st.session_state.df[st.session_state.df['Type'] == 'Task']
-                weather_counts = []
-                for weather in tasks['Task_Weather_Conditions'].str.split(','):
-                    if isinstance(weather, list):
-                        weather_counts.extend([w.strip() for w in weather if w != 'No data'])
-
-                if weather_counts:
-                    weather_df = pd.DataFrame({
-                        'Weather': weather_counts
-                    }).value_counts().reset_index()
-                    weather_df.columns = ['Weather', 'Count']
-                    st.plotly_chart(px.pie(weather_df, values='Count', names='Weather',
-                                           title='Väderbehov'), use_container_width=True)
-
-            with completion_status:
-                completion_figures = create_completion_analysis(st.session_state.df)
+                weather_figure = cached(create_weather_summary)
+                if weather_figure is not None:
+                    show_figure(weather_figure)
+
+            with completion_status, monitor_tab("Slutförande"):
+                completion_figures = cached(create_completion_analysis, rollups)
                 for fig in completion_figures:
-                    st.plotly_chart(fig, use_container_width=True)
+                    show_figure(fig)
 
-            with historical_data:
+            with historical_data, monitor_tab("Historik"):
                 # Add Archive Data button at the top of historical data tab
                 if st.button("Arkivera Årets Data"):
                     if save_year_to_history(st.session_state.df):
@@ -815,20 +881,20 @@ def main_app():
                     st.warning("Ingen historisk data tillgänglig. "
                                "Använd 'Arkivera Årets Data' för att spara nuvarande data.")
 
-            with risk_matrix:
+            with risk_matrix, monitor_tab("Riskmatris"):
                 display_risk_overview(st.session_state.df, st.session_state.risks, context="analysis")
 
-            with risk_analysis:
+            with risk_analysis, monitor_tab("Riskanalys"):
                 from Risk_Assessment import create_risk_analysis
 
                 create_risk_analysis(st.session_state.risks)
 
-        with main_tab3:
+        with main_tab3, monitor_tab("Buggar"):
             bug_tracking_tab()
 
         # Only show admin panel if user is admin
         if st.session_state.user_role == 'admin':
-            with main_tab4:
+            with main_tab4, monitor_tab("Admin"):
                 admin_panel()
 
     st.divider()
@@ -850,21 +916,30 @@ def main_app():
 
 def main():
     """Main entry point of the application"""
-
-    # Add custom styling
-    st.markdown("""
-    <style>
-        /* Your existing styles */
-    </style>
-    """, unsafe_allow_html=True)
-
-    # Show only login page if not authenticated
-    if not st.session_state.authenticated:
-        show_login_page()
-        return
-
-    # Show main application if authenticated
-    main_app()
+    with track_rerun():
+        # Add custom styling
+        st.markdown("""
+        <style>
+            /* Your existing styles */
+        </style>
+        """, unsafe_allow_html=True)
+
+        # Index och migreringar (körs en gång per process)
+        bootstrap_database()
+        # Spela upp skrivningar som blev kvar i journalen vid ett avbrott
+        start_replay()
+
+        # Återställ inloggningen från session-cookien efter omladdning/återanslutning
+        restore_session()
+
+        # Show only login page if not authenticated
+        if not st.session_state.authenticated:
+            with monitor_tab("Inloggning"):
+                show_login_page()
+            return
+
+        # Show main application if authenticated
+        main_app()
 
 if __name__ == "__main__":
     main()
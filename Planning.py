@@ -1,9 +1,12 @@
 import streamlit as st
 import pandas as pd
-from Data import validate_dates, convert_rental_info, WEATHER_CONDITIONS, current_time
+from Data import (validate_dates, convert_rental_info, WEATHER_CONDITIONS, current_time, new_row_id,
+                  enforce_schema, set_plan_value, bump_data_version)
 from datetime import datetime
 import pytz
 from database import get_database
+from pymongo import DeleteMany, InsertOne
+from write_journal import journaled_bulk_write
 from custom_logging import log_action
 import os
 
@@ -45,6 +48,7 @@ def add_goal(dataframe, goal_name, goal_description, goal_dates):
         return dataframe, False
 
     new_goal = pd.DataFrame({
+        'Row_Id': [new_row_id()],
         'Type': ['Goal'],
         'Goal_Name': [goal_name],
         'Goal_Description': [goal_description if goal_description else "No data"],
@@ -69,7 +73,7 @@ def add_goal(dataframe, goal_name, goal_description, goal_dates):
         'Task_Other_Needs': ["No data"]
     })
 
-    return pd.concat([dataframe, new_goal], ignore_index=True), True
+    return enforce_schema(pd.concat([dataframe, new_goal], ignore_index=True)), True
 
 
 def add_task(dataframe, goal_name, task_data):
@@ -117,6 +121,7 @@ def add_task(dataframe, goal_name, task_data):
         tech_needs_str = ','.join(tech_needs)
 
     new_task = pd.DataFrame({
+        'Row_Id': [new_row_id()],
         'Type': ['Task'],
         'Goal_Name': [goal_name],
         'Goal_Description': [goal_row['Goal_Description']],
@@ -141,7 +146,7 @@ def add_task(dataframe, goal_name, task_data):
         'Task_Completed': [False],
     })
 
-    return pd.concat([dataframe, new_task], ignore_index=True), True
+    return enforce_schema(pd.concat([dataframe, new_task], ignore_index=True)), True
 
 
 def update_dataframe(df, edited_data):
@@ -155,19 +160,19 @@ def update_dataframe(df, edited_data):
             mask = (df['Type'] == 'Goal') & (df['Goal_Name'] == goal_name)
 
             if 'name' in data:
-                df.loc[mask, 'Goal_Name'] = data['name']
+                set_plan_value(df, mask, 'Goal_Name', data['name'])
             if 'description' in data:
-                df.loc[mask, 'Goal_Description'] = data['description']
+                set_plan_value(df, mask, 'Goal_Description', data['description'])
             if 'dates' in data:
                 # Handle both tuple and list date formats
                 dates = data['dates']
                 if isinstance(dates, (tuple, list)) and len(dates) >= 2:
-                    df.loc[mask, 'Goal_Start_Date'] = dates[0]
-                    df.loc[mask, 'Goal_End_Date'] = dates[1]
+                    set_plan_value(df, mask, 'Goal_Start_Date', dates[0])
+                    set_plan_value(df, mask, 'Goal_End_Date', dates[1])
                 else:
                     # Handle single date or invalid date format
-                    df.loc[mask, 'Goal_Start_Date'] = dates
-                    df.loc[mask, 'Goal_End_Date'] = dates
+                    set_plan_value(df, mask, 'Goal_Start_Date', dates)
+                    set_plan_value(df, mask, 'Goal_End_Date', dates)
 
         elif key.startswith('task_'):
             # Extract goal name and task name from the key
@@ -177,41 +182,41 @@ def update_dataframe(df, edited_data):
             # Update task fields
             for field, value in data.items():
                 if field == 'name':
-                    df.loc[mask, 'Task_Name'] = value
+                    set_plan_value(df, mask, 'Task_Name', value)
                 elif field == 'description':
-                    df.loc[mask, 'Task_Description'] = value
+                    set_plan_value(df, mask, 'Task_Description', value)
                 elif field == 'dates':
                     if isinstance(value, (tuple, list)) and len(value) >= 2:
-                        df.loc[mask, 'Task_Start_Date'] = value[0]
-                        df.loc[mask, 'Task_End_Date'] = value[1]
+                        set_plan_value(df, mask, 'Task_Start_Date', value[0])
+                        set_plan_value(df, mask, 'Task_End_Date', value[1])
                 elif field == 'est_time':
-                    df.loc[mask, 'Task_Estimated_Time'] = value
+                    set_plan_value(df, mask, 'Task_Estimated_Time', value)
                 elif field == 'est_cost':
-                    df.loc[mask, 'Task_Estimated_Cost'] = value
+                    set_plan_value(df, mask, 'Task_Estimated_Cost', value)
                 elif field == 'tech_needs':
                     if not value:  # If tech_needs is empty
-                        df.loc[mask, 'Task_Technical_Needs'] = "Inget - Inga Redskap Behövs"
+                        set_plan_value(df, mask, 'Task_Technical_Needs', "Inget - Inga Redskap Behövs")
                     else:
                         # Filter out "Inget - Inga Redskap Behövs" if it exists when other tools are selected
                         tech_needs = [need for need in value if need != "Inget - Inga Redskap Behövs"]
-                        df.loc[mask, 'Task_Technical_Needs'] = ','.join(tech_needs)
+                        set_plan_value(df, mask, 'Task_Technical_Needs', ','.join(tech_needs))
                 elif field == 'weather':
-                    df.loc[mask, 'Task_Weather_Conditions'] = ','.join(value) if value else "No data"
+                    set_plan_value(df, mask, 'Task_Weather_Conditions', ','.join(value) if value else "No data")
                 elif field == 'personnel':
-                    df.loc[mask, 'Task_Personnel_Count'] = value
+                    set_plan_value(df, mask, 'Task_Personnel_Count', value)
                 elif field == 'rental_item':
-                    df.loc[mask, 'Task_Rental_Item'] = value if value else "No data"
-                    df.loc[mask, 'Task_Needs_Rental'] = bool(value and value != "No data")
+                    set_plan_value(df, mask, 'Task_Rental_Item', value if value else "No data")
+                    set_plan_value(df, mask, 'Task_Needs_Rental', bool(value and value != "No data"))
                 elif field == 'rental_type':
-                    df.loc[mask, 'Task_Rental_Type'] = value
+                    set_plan_value(df, mask, 'Task_Rental_Type', value)
                 elif field == 'rental_duration':
-                    df.loc[mask, 'Task_Rental_Duration'] = value
+                    set_plan_value(df, mask, 'Task_Rental_Duration', value)
                 elif field == 'rental_cost_unit':
-                    df.loc[mask, 'Task_Rental_Cost_Per_Unit'] = value
+                    set_plan_value(df, mask, 'Task_Rental_Cost_Per_Unit', value)
                 elif field == 'total_rental_cost':
-                    df.loc[mask, 'Task_Total_Rental_Cost'] = value
+                    set_plan_value(df, mask, 'Task_Total_Rental_Cost', value)
                 elif field == 'other_needs':
-                    df.loc[mask, 'Task_Other_Needs'] = value if value else "No data"
+                    set_plan_value(df, mask, 'Task_Other_Needs', value if value else "No data")
 
     return df
 
@@ -277,14 +282,13 @@ def load_bugs():
 
 def save_bugs(bugs_df):
     try:
-        db = get_database()
         # Convert DataFrame to records
         records = bugs_df.to_dict('records')
         
-        # Clear existing bugs and insert new ones
-        db.bugs.delete_many({})
-        if records:
-            db.bugs.insert_many(records)
+        # Clear existing bugs and insert new ones (journaled if the database is unreachable)
+        operations = [DeleteMany({})] + [InsertOne(record) for record in records]
+        if journaled_bulk_write('bugs', operations, f"Buggar: {len(records)} st") is not None:
+            bump_data_version(get_database())
     except Exception as e:
         print(f"Error saving bugs to MongoDB: {e}")
 
@@ -467,88 +467,80 @@ def risk_assessment_app(df):
         display_risk_overview(df, st.session_state.risks, context="risk_app")
 
 
-def create_risk_analysis(risks):
-    """Create analysis graphs for risks"""
+def build_risk_figures(risks):
+    """Riskanalysens diagram utan Streamlit (används av create_risk_analysis och report.py).
+    Returnerar ett dictionary med severity, goals, matrix och timeline, tomt om det saknas risker."""
     if not risks:
-        st.info("Inga risker att analysera ännu.")
-        return
+        return {}
 
     # Convert risks to DataFrame for easier analysis
     risk_df = pd.DataFrame(risks)
 
-    col1, col2 = st.columns([1, 2])
+    # Risk severity distribution
+    severity_counts = risk_df['severity_label'].value_counts()
+    color_map = {
+        'Låg': '#00FF00',  # Green
+        'Medel': '#FFFF00',  # Yellow
+        'Medelhög': '#FFA500',  # Orange
+        'Hög': '#FF0000'  # Red
+    }
+    colors = [color_map[severity] for severity in severity_counts.index]
+
+    fig_severity = go.Figure(data=[
+        go.Bar(
+            x=severity_counts.index,
+            y=severity_counts.values,
+            marker_color=colors,  # List of colors
+            text=severity_counts.values,
+            textposition='auto',
+        )
+    ])
 
-    with col1:
-        # Risk severity distribution
-        severity_counts = risk_df['severity_label'].value_counts()
-        color_map = {
-            'Låg': '#00FF00',  # Green
-            'Medel': '#FFFF00',  # Yellow
-            'Medelhög': '#FFA500',  # Orange
-            'Hög': '#FF0000'  # Red
-        }
-        colors = [color_map[severity] for severity in severity_counts.index]
-
-        fig_severity = go.Figure(data=[
-            go.Bar(
-                x=severity_counts.index,
-                y=severity_counts.values,
-                marker_color=colors,  # List of colors
-                text=severity_counts.values,
-                textposition='auto',
-            )
-        ])
+    fig_severity.update_layout(
+        title="Fördelning av Riskallvarlighet",
+        xaxis_title="Allvarlighetsgrad",
+        yaxis_title="Antal",
+        showlegend=False
+    )
 
-        fig_severity.update_layout(
-            title="Fördelning av Riskallvarlighet",
-            xaxis_title="Allvarlighetsgrad",
-            yaxis_title="Antal",
-            showlegend=False
-        )
+    # Risks per goal - Bar chart with range slider
+    goal_counts = risk_df['goal'].value_counts()
+    fig_goals = go.Figure()
 
-        st.plotly_chart(fig_severity, use_container_width=True)
+    # Add the bar chart
+    fig_goals.add_trace(go.Bar(
+        x=goal_counts.index,
+        y=goal_counts.values,
+        text=goal_counts.values,  # Add text labels
+        textposition='auto',      # Automatically position labels
+    ))
 
-    with col2:
-        # Risks per goal - Bar chart with range slider
-        goal_counts = risk_df['goal'].value_counts()
-        fig_goals = go.Figure()
-        
-        # Add the bar chart
-        fig_goals.add_trace(go.Bar(
-            x=goal_counts.index,
-            y=goal_counts.values,
-            text=goal_counts.values,  # Add text labels
-            textposition='auto',      # Automatically position labels
-        ))
-        
-        fig_goals.update_layout(
-            title="Risker per Mål",
-            xaxis_title="Mål",
-            yaxis_title="Antal Risker",
-            showlegend=False,
-            # Add range slider
-            xaxis=dict(
-                rangeslider=dict(visible=True),
-                type='category',  # This ensures proper spacing for categorical data
-                tickangle=-45    # Rotate labels
-            ),
-            # Adjust margins to accommodate rotated labels
-            margin=dict(b=100),
-            # Add buttons for zoom options
-            updatemenus=[dict(
-                type="buttons",
-                showactive=False,
-                # buttons=[
-                #     dict(label="Reset View",
-                #          method="relayout",
-                #          args=[{"xaxis.range": [None, None]}])
-                # ],
-                x=0.05,  # Position of reset button
-                y=1.15   # Position of reset button
-            )]
-        )
-        
-        st.plotly_chart(fig_goals, use_container_width=True)
+    fig_goals.update_layout(
+        title="Risker per Mål",
+        xaxis_title="Mål",
+        yaxis_title="Antal Risker",
+        showlegend=False,
+        # Add range slider
+        xaxis=dict(
+            rangeslider=dict(visible=True),
+            type='category',  # This ensures proper spacing for categorical data
+            tickangle=-45    # Rotate labels
+        ),
+        # Adjust margins to accommodate rotated labels
+        margin=dict(b=100),
+        # Add buttons for zoom options
+        updatemenus=[dict(
+            type="buttons",
+            showactive=False,
+            # buttons=[
+            #     dict(label="Reset View",
+            #          method="relayout",
+            #          args=[{"xaxis.range": [None, None]}])
+            # ],
+            x=0.05,  # Position of reset button
+            y=1.15   # Position of reset button
+        )]
+    )
 
     # Risk Matrix Heatmap showing number of risks at each position
     data = [
@@ -594,10 +586,50 @@ def create_risk_analysis(risks):
         height=400
     )
 
-    st.plotly_chart(fig_matrix, use_container_width=True)
+    # Timeline of risk actions
+    risk_df['action_date'] = pd.to_datetime(risk_df['action_date'])
+    timeline_data = risk_df.sort_values('action_date')
 
-    # Summary statistics
-    st.subheader("Sammanfattning")
+    fig_timeline = go.Figure(data=[
+        go.Scatter(
+            x=timeline_data['action_date'],
+            y=timeline_data['severity'],
+            mode='markers',
+            marker=dict(
+                size=12,
+                color=timeline_data['severity'],
+                colorscale=[
+                    [0, "green"], [0.16, "green"],
+                    [0.16, "yellow"], [0.40, "yellow"],
+                    [0.40, "orange"], [0.60, "orange"],
+                    [0.60, "red"], [1.0, "red"]
+                ],
+                showscale=True,
+                colorbar=dict(title="Allvarlighet")
+            ),
+            text=timeline_data.apply(
+                lambda x: f"Mål: {x['goal']}<br>Risk: {x['name']}<br>Allvarlighet: {x['severity']}",
+                axis=1
+            ),
+            hoverinfo='text'
+        )
+    ])
+
+    fig_timeline.update_layout(
+        title="Tidslinje för Riskåtgärder",
+        xaxis_title="Datum för åtgärd",
+        yaxis_title="Allvarlighet",
+        height=400
+    )
+
+    return {"severity": fig_severity, "goals": fig_goals, "matrix": fig_matrix, "timeline": fig_timeline}
+
+
+def summarize_risks(risks):
+    """Nyckeltalen i riskanalysens sammanfattning (tomt om det saknas risker)"""
+    if not risks:
+        return {}
+    risk_df = pd.DataFrame(risks)
 
     # Calculate most dangerous goal and task
     goal_risks = risk_df.groupby('goal').agg({
@@ -612,24 +644,61 @@ def create_risk_analysis(risks):
     task_risks.columns = ['goal', 'task', 'avg_severity', 'risk_count']
     most_dangerous_task = task_risks.loc[task_risks['avg_severity'].idxmax()]
 
+    return {
+        "total": len(risks),
+        "avg_severity": float(risk_df['severity'].mean()),
+        "max_severity": float(risk_df['severity'].max()),
+        "high_risks": int((risk_df['severity_label'] == 'Hög').sum()),
+        "most_dangerous_goal": {"goal": most_dangerous_goal['goal'],
+                                "avg_severity": float(most_dangerous_goal['avg_severity']),
+                                "risk_count": int(most_dangerous_goal['risk_count'])},
+        "most_dangerous_task": {"task": most_dangerous_task['task'],
+                                "avg_severity": float(most_dangerous_task['avg_severity']),
+                                "risk_count": int(most_dangerous_task['risk_count'])},
+    }
+
+
+def create_risk_analysis(risks):
+    """Create analysis graphs for risks"""
+    if not risks:
+        st.info("Inga risker att analysera ännu.")
+        return
+
+    figures = build_risk_figures(risks)
+
+    col1, col2 = st.columns([1, 2])
+
+    with col1:
+        st.plotly_chart(figures["severity"], use_container_width=True)
+
+    with col2:
+        st.plotly_chart(figures["goals"], use_container_width=True)
+
+    st.plotly_chart(figures["matrix"], use_container_width=True)
+
+    # Summary statistics
+    st.subheader("Sammanfattning")
+    summary = summarize_risks(risks)
+    most_dangerous_goal = summary["most_dangerous_goal"]
+    most_dangerous_task = summary["most_dangerous_task"]
+
     # Display metrics in two rows
     col1, col2, col3, col4 = st.columns(4)
 
     with col1:
-        st.metric("Totalt antal risker", len(risks))
+        st.metric("Totalt antal risker", summary["total"])
     with col2:
         st.metric(
             "Genomsnittlig allvarlighet",
-            f"{risk_df['severity'].mean():.1f}"
+            f"{summary['avg_severity']:.1f}"
         )
     with col3:
         st.metric(
             "Högsta allvarlighet",
-            f"{risk_df['severity'].max():.0f}"
+            f"{summary['max_severity']:.0f}"
         )
     with col4:
-        high_risks = len(risk_df[risk_df['severity_label'] == 'Hög'])
-        st.metric("Antal höga risker", high_risks)
+        st.metric("Antal höga risker", summary["high_risks"])
 
     # Second row of metrics
     col5, col6 = st.columns(2)
@@ -648,40 +717,4 @@ def create_risk_analysis(risks):
             f"Medelvärde: {most_dangerous_task['avg_severity']:.1f} ({most_dangerous_task['risk_count']} risker)"
         )
 
-    # Timeline of risk actions
-    risk_df['action_date'] = pd.to_datetime(risk_df['action_date'])
-    timeline_data = risk_df.sort_values('action_date')
-
-    fig_timeline = go.Figure(data=[
-        go.Scatter(
-            x=timeline_data['action_date'],
-            y=timeline_data['severity'],
-            mode='markers',
-            marker=dict(
-                size=12,
-                color=timeline_data['severity'],
-                colorscale=[
-                    [0, "green"], [0.16, "green"],
-                    [0.16, "yellow"], [0.40, "yellow"],
-                    [0.40, "orange"], [0.60, "orange"],
-                    [0.60, "red"], [1.0, "red"]
-                ],
-                showscale=True,
-                colorbar=dict(title="Allvarlighet")
-            ),
-            text=timeline_data.apply(
-                lambda x: f"Mål: {x['goal']}<br>Risk: {x['name']}<br>Allvarlighet: {x['severity']}",
-                axis=1
-            ),
-            hoverinfo='text'
-        )
-    ])
-
-    fig_timeline.update_layout(
-        title="Tidslinje för Riskåtgärder",
-        xaxis_title="Datum för åtgärd",
-        yaxis_title="Allvarlighet",
-        height=400
-    )
-
-    st.plotly_chart(fig_timeline, use_container_width=True)
+    st.plotly_chart(figures["timeline"], use_container_width=True)
@@ -0,0 +1,89 @@
+"""
+Cache för analysdiagram.
+
+Diagrammen i Analys-fliken byggs om vid varje körning av skriptet, även när bara
+en orelaterad widget har ändrats. cached_figures() nycklar resultatet på
+diagramfunktionen, dess argument och en billig innehållshash av planen, och
+sparar figurerna i en LRU-cache som delas av alla sessioner i processen.
+
+Figurerna i cachen delas mellan körningar och sessioner: de får visas men ska
+inte ändras av anroparen.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# Max antal cachade resultat (ett per diagramfunktion och planinnehåll)
+ANALYTICS_CACHE_SIZE = 64
+
+_cache = OrderedDict()
+_stats = {}
+_lock = threading.Lock()
+
+
+def content_key(df):
+    """Hash av planens innehåll (värden, kolumner och typer), oberoende av radindex"""
+    if df is None or df.empty:
+        return "empty"
+    digest = hashlib.sha1(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    digest.update(repr(list(zip(df.columns, df.dtypes.astype(str)))).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _builder_name(builder):
+    return f"{builder.__module__}.{builder.__qualname__}"
+
+
+def cached_figures(builder, df, *args, key=None, **kwargs):
+    """
+    Returnera builder(df, *args, **kwargs) från cachen om planen är oförändrad, annars bygg och spara.
+    Används även för mellanresultat som flera diagram delar (t.ex. Analysis.get_task_facts).
+
+    :param builder: Diagramfunktion, t.ex. Analysis.create_cost_analysis.
+    :param df: Planen som diagrammen byggs från.
+    :param key: Färdig innehållsnyckel (content_key eller dataversionen) i stället för att hasha df.
+    :param kwargs: Skickas vidare till builder men ingår inte i nyckeln, så de får inte
+                   ändra resultatet (t.ex. plan_key, se Analysis.get_task_facts).
+    """
+    name = _builder_name(builder)
+    cache_key = (name, key if key is not None else content_key(df), args)
+
+    with _lock:
+        stats = _stats.setdefault(name, {'hits': 0, 'misses': 0})
+        if cache_key in _cache:
+            _cache.move_to_end(cache_key)
+            stats['hits'] += 1
+            return _cache[cache_key]
+        stats['misses'] += 1
+
+    result = builder(df, *args, **kwargs)
+
+    with _lock:
+        _cache[cache_key] = result
+        _cache.move_to_end(cache_key)
+        while len(_cache) > ANALYTICS_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+def clear_analytics_cache():
+    """Töm cachen och nollställ räknarna"""
+    with _lock:
+        _cache.clear()
+        _stats.clear()
+
+
+def get_analytics_cache_stats():
+    """Träffar och missar per diagramfunktion, plus antal cachade resultat"""
+    with _lock:
+        per_builder = {name: dict(stats) for name, stats in _stats.items()}
+        entries = len(_cache)
+    return {
+        'entries': entries,
+        'max_entries': ANALYTICS_CACHE_SIZE,
+        'hits': sum(stats['hits'] for stats in per_builder.values()),
+        'misses': sum(stats['misses'] for stats in per_builder.values()),
+        'builders': per_builder,
+    }
@@ -0,0 +1,176 @@
+"""
+Summeringar av planen som räknas ut i databasen.
+
+Kostnads-, arbetstids- och slutförandediagrammen behöver bara summor per mål och
+per månad samt antal klara mål/uppgifter. plan_rollup_pipeline() räknar ut summorna
+per mål och antalen med $match/$group/$facet i en enda aggregering, och summorna per
+månad läses färdiga från samlingen plan_rollups (se plan_rollups.py), så att bara
+några få rader skickas tillbaka i stället för hela planen. get_plan_rollups() cachar resultatet
+per dataversion och returnerar None när sessionens plan inte motsvarar databasen
+(degraderat läge, skrivningar i journalen eller en nyare version); då används
+faktatabellen i Analysis som vanligt.
+"""
+import threading
+
+import pandas as pd
+
+from plan_rollups import MEASURES, read_rollups
+
+# Värden som räknas som "klar" (äldre data kan ha sparat flaggan som text)
+_TRUE_VALUES = [True, 'True', 'true']
+
+_SUMS = {
+    'Task_Estimated_Cost': {'$sum': '$Task_Estimated_Cost'},
+    'Task_Total_Rental_Cost': {'$sum': '$Task_Total_Rental_Cost'},
+    'Task_Estimated_Time': {'$sum': '$Task_Estimated_Time'},
+    'Personnel_Hours': {'$sum': {'$multiply': ['$Task_Estimated_Time', '$Task_Personnel_Count']}},
+    'Tasks': {'$sum': 1},
+}
+
+PER_GOAL_COLUMNS = ['Goal_Name', 'Task_Estimated_Cost', 'Task_Total_Rental_Cost', 'Task_Estimated_Time',
+                    'Task_Personnel_Count', 'Personnel_Hours', 'Tasks', 'Completed', 'Övriga Kostnader']
+PER_MONTH_COLUMNS = ['Month', 'Task_Estimated_Cost', 'Task_Total_Rental_Cost', 'Task_Estimated_Time',
+                     'Personnel_Hours', 'Tasks']
+
+
+def _completed(field):
+    return {'$sum': {'$cond': [{'$in': [f'${field}', _TRUE_VALUES]}, 1, 0]}}
+
+
+def plan_rollup_pipeline(match=None):
+    """
+    Aggregeringen bakom get_plan_rollups: ett dokument med fälten per_goal,
+    goal_status och task_status.
+
+    :param match: Extra filter på planen (t.ex. {'Goal_Name': {'$in': [...]}}).
+    """
+    match = dict(match or {})
+    match.setdefault('Type', {'$in': ['Goal', 'Task']})
+    return [
+        {'$match': match},
+        {'$facet': {
+            'per_goal': [
+                {'$match': {'Type': 'Task'}},
+                {'$group': dict(_SUMS, _id='$Goal_Name',
+                                Task_Personnel_Count={'$max': '$Task_Personnel_Count'},
+                                Completed=_completed('Task_Completed'))},
+                {'$sort': {'_id': 1}},
+            ],
+            'goal_status': [
+                {'$match': {'Type': 'Goal'}},
+                {'$group': {'_id': None, 'total': {'$sum': 1}, 'completed': _completed('Goal_Completed')}},
+            ],
+            'task_status': [
+                {'$match': {'Type': 'Task'}},
+                {'$group': {'_id': None, 'total': {'$sum': 1}, 'completed': _completed('Task_Completed')}},
+            ],
+        }},
+    ]
+
+
+class PlanRollups:
+    """
+    Resultatet av query_plan_rollups: per_goal och per_month som DataFrames med samma
+    kolumner som faktatabellen i Analysis, plus antal mål/uppgifter och hur många
+    som är klara. Jämförs och hashas på dataversionen, så att objektet kan ingå i
+    nyckeln till analytics_cache.
+    """
+
+    def __init__(self, version, per_goal, per_month, goal_status, task_status):
+        self.version = version
+        self.per_goal = per_goal
+        self.per_month = per_month
+        self.goal_status = goal_status
+        self.task_status = task_status
+
+    def __eq__(self, other):
+        return isinstance(other, PlanRollups) and self.version == other.version
+
+    def __hash__(self):
+        return hash(('PlanRollups', self.version))
+
+    def __repr__(self):
+        return f"PlanRollups(version={self.version}, goals={len(self.per_goal)}, months={len(self.per_month)})"
+
+
+def _status(rows):
+    row = rows[0] if rows else {}
+    return {'total': int(row.get('total', 0)), 'completed': int(row.get('completed', 0))}
+
+
+def _frame(rows, key_column, columns):
+    frame = pd.DataFrame(rows).rename(columns={'_id': key_column}) if rows else pd.DataFrame(columns=columns)
+    # Uppgifter utan mål eller startdatum räknas inte, precis som i groupby på faktatabellen
+    frame = frame[frame[key_column].notna() & (frame[key_column] != '')]
+    numeric = [column for column in columns if column != key_column and column in frame]
+    frame[numeric] = frame[numeric].apply(pd.to_numeric, errors='coerce').fillna(0)
+    return frame.reset_index(drop=True)
+
+
+def per_month_from_rollups(rollups):
+    """Summor per startmånad från plan_rollups (uppgifter utan startdatum räknas inte)"""
+    per_month = (rollups[rollups['month'] != ''].groupby('month', as_index=False)[MEASURES].sum()
+                 .rename(columns={'month': 'Month'}))
+    return per_month.sort_values('Month').reset_index(drop=True).reindex(columns=PER_MONTH_COLUMNS)
+
+
+def query_plan_rollups(db=None, match=None, version=None):
+    """
+    Kör aggregeringen och läs månadssummorna (två anrop till databasen) och packa upp resultatet.
+
+    :return: PlanRollups
+    """
+    if db is None:
+        from database import get_database
+        db = get_database()
+
+    result = next(iter(db.goals.aggregate(plan_rollup_pipeline(match))), {})
+    per_goal = _frame(result.get('per_goal', []), 'Goal_Name', PER_GOAL_COLUMNS)
+    if not per_goal.empty:
+        per_goal['Övriga Kostnader'] = per_goal['Task_Estimated_Cost'] - per_goal['Task_Total_Rental_Cost']
+    per_goal = per_goal.reindex(columns=PER_GOAL_COLUMNS, fill_value=0)
+    per_month = per_month_from_rollups(read_rollups(db))
+
+    return PlanRollups(version, per_goal, per_month,
+                       _status(result.get('goal_status', [])), _status(result.get('task_status', [])))
+
+
+_rollup_cache = {'version': None, 'rollups': None}
+_rollup_lock = threading.Lock()
+
+
+def get_plan_rollups():
+    """
+    Summeringarna för den plan sessionen har laddat, räknade i databasen och
+    cachade per dataversion (delas av alla sessioner i processen).
+
+    :return: PlanRollups, eller None om summeringarna inte kan hämtas eller inte
+             skulle motsvara sessionens plan.
+    """
+    from Data import _session_store, get_data_version, _report_connection_error
+    from database import get_database, is_degraded
+    from write_journal import pending_count
+
+    session_version = _session_store().get('data_version')
+    if session_version is None or is_degraded() or pending_count():
+        return None
+
+    with _rollup_lock:
+        if _rollup_cache['version'] == session_version:
+            return _rollup_cache['rollups']
+
+    try:
+        db = get_database()
+        if get_data_version(db) != session_version:
+            # Sessionens plan är inaktuell och laddas om vid nästa körning
+            return None
+        rollups = query_plan_rollups(db, version=session_version)
+        # Spara bara om ingen skrivning hann emellan aggregeringen
+        if get_data_version(db) == session_version:
+            with _rollup_lock:
+                _rollup_cache.update({'version': session_version, 'rollups': rollups})
+        return rollups
+    except Exception as e:
+        _report_connection_error(e)
+        print(f"Error querying plan rollups: {e}")
+        return None
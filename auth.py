@@ -1,10 +1,23 @@
 import streamlit as st
 from database import get_database
 import bcrypt
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime, timedelta
-from Data import current_time
+from Data import utc_now
+from config import get_bcrypt_rounds, get_password_hash_workers, get_session_secret, get_session_hours
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import base64
+import hashlib
+import hmac
+import json
 import pytz
 import os
+import secrets
+import threading
+import time
 from custom_logging import log_action
 
 
@@ -16,14 +29,255 @@ def init_auth():
         st.session_state.user_role = None
 
 
+# bcrypt körs i en begränsad trådpool, vilket begränsar hur många hashningar som använder
+# CPU samtidigt (bcrypt släpper GIL, så andra sessioner fortsätter under tiden). Det frigör
+# inte skripttråden: den som loggar in väntar på resultatet. Är kön full avvisas anropet
+# direkt med TimeoutError, så att skripttrådar inte också blir stående och väntar på en plats.
+_hash_pool = ThreadPoolExecutor(max_workers=get_password_hash_workers(), thread_name_prefix="bcrypt")
+# Max antal hashningar som får köras eller vänta i kö innan nya inloggningar avvisas
+_hash_slots = threading.BoundedSemaphore(get_password_hash_workers() * 8)
+
+# Senaste inloggningarnas svarstider för Admin-panelen
+_login_metrics = deque(maxlen=1000)
+_login_metrics_lock = threading.Lock()
+
+
+def _run_hashing(func, *args):
+    """
+    Run a bcrypt call on the worker pool and wait for the result (the calling thread blocks).
+    Raises TimeoutError at once if the queue is full.
+    """
+    if not _hash_slots.acquire(blocking=False):
+        raise TimeoutError("Too many concurrent password checks")
+    try:
+        return _hash_pool.submit(func, *args).result()
+    finally:
+        _hash_slots.release()
+
+
+def _as_bytes(value):
+    return value.encode('utf-8') if isinstance(value, str) else bytes(value)
+
+
+def hash_rounds(hashed_password):
+    """Cost factor stored in a bcrypt hash ($2b$<rounds>$...)"""
+    try:
+        return int(_as_bytes(hashed_password).split(b'$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
 def hash_password(password):
-    """Hash a password using bcrypt"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    """Hash a password using bcrypt with the configured cost factor"""
+    salt = bcrypt.gensalt(rounds=get_bcrypt_rounds())
+    return _run_hashing(bcrypt.hashpw, password.encode('utf-8'), salt)
 
 
 def verify_password(password, hashed_password):
     """Verify a password against its hash"""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+    return _run_hashing(bcrypt.checkpw, password.encode('utf-8'), _as_bytes(hashed_password))
+
+
+def _record_login(started, verify_ms, success, rehashed=False):
+    with _login_metrics_lock:
+        _login_metrics.append({
+            'timestamp': time.time(),
+            'total_ms': (time.perf_counter() - started) * 1000,
+            'verify_ms': verify_ms,
+            'success': success,
+            'rehashed': rehashed,
+        })
+
+
+def get_login_metrics():
+    """Summary of recent logins: count, failures, rehashes and p50/p95 latency in ms"""
+    with _login_metrics_lock:
+        samples = list(_login_metrics)
+    if not samples:
+        return {'logins': 0, 'failed': 0, 'rehashed': 0,
+                'total_p50_ms': None, 'total_p95_ms': None, 'verify_p50_ms': None, 'verify_p95_ms': None}
+    df = pd.DataFrame(samples)
+    return {
+        'logins': len(df),
+        'failed': int((~df['success']).sum()),
+        'rehashed': int(df['rehashed'].sum()),
+        'total_p50_ms': round(float(df['total_ms'].quantile(0.5)), 1),
+        'total_p95_ms': round(float(df['total_ms'].quantile(0.95)), 1),
+        'verify_p50_ms': round(float(df['verify_ms'].quantile(0.5)), 1),
+        'verify_p95_ms': round(float(df['verify_ms'].quantile(0.95)), 1),
+    }
+
+
+# Inloggningar överlever omladdning och återanslutning med en signerad session-token
+# i en cookie (SameSite=Strict, Secure över https), aldrig i URL:en där den skulle hamna i
+# historik, bokmärken, delade länkar och Referer. Token innehåller sessionens id och
+# utgångstid, signerade med HMAC tillsammans med webbläsarens User-Agent så att en kopierad
+# token inte fungerar från en annan klient; sessionen själv ligger i 'sessions' (TTL-index
+# på expires_at) så att den kan återkallas.
+SESSION_COOKIE = "planner_session"
+# Äldre versioner lade token i URL:en; den tas bort och används inte
+LEGACY_SESSION_QUERY_PARAM = "session"
+# Hur ofta en inloggad session kontrollerar att den inte har återkallats
+SESSION_RECHECK_SECONDS = 60
+
+_session_secret_value = None
+
+
+def _session_secret():
+    """Signing key from config, or a generated one shared through db.meta"""
+    global _session_secret_value
+    if _session_secret_value is None:
+        secret = get_session_secret()
+        if not secret:
+            document = get_database().meta.find_one_and_update(
+                {'_id': 'session_secret'},
+                {'$setOnInsert': {'value': secrets.token_hex(32)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            secret = document['value']
+        _session_secret_value = secret.encode('utf-8')
+    return _session_secret_value
+
+
+def _sign(payload):
+    digest = hmac.new(_session_secret(), payload.encode('utf-8'), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode('ascii').rstrip('=')
+
+
+def client_fingerprint():
+    """Short hash of the browser's User-Agent, part of the signed session token"""
+    try:
+        agent = st.context.headers.get('User-Agent') or ''
+    except Exception:
+        agent = ''
+    return hashlib.sha256(agent.encode('utf-8')).hexdigest()[:16]
+
+
+def create_session_token(username, role, client=None):
+    """Store a new session and return its signed token, bound to the client"""
+    client = client_fingerprint() if client is None else client
+    session_id = secrets.token_urlsafe(16)
+    expires_at = utc_now() + timedelta(hours=get_session_hours())
+    get_database().sessions.insert_one({
+        '_id': session_id,
+        'username': username,
+        'role': role,
+        'client': client,
+        'created_at': utc_now(),
+        'expires_at': expires_at,
+    })
+    payload = f"{session_id}.{int(expires_at.timestamp())}"
+    return f"{payload}.{_sign(f'{payload}.{client}')}", session_id
+
+
+def parse_session_token(token, client=None):
+    """Session id from a token signed for this client that has not expired, otherwise None"""
+    client = client_fingerprint() if client is None else client
+    try:
+        session_id, expires, signature = token.split('.')
+        if not hmac.compare_digest(signature, _sign(f"{session_id}.{expires}.{client}")):
+            return None
+        if int(expires) < time.time():
+            return None
+        return session_id
+    except (AttributeError, ValueError):
+        return None
+
+
+def _queue_session_cookie(token, max_age):
+    # Skrivs av _write_session_cookie i nästa körning, eftersom login/logout följs av st.rerun()
+    st.session_state.session_cookie = (token, max_age)
+
+
+def _write_session_cookie():
+    """Set or clear the session cookie in the browser if a change is pending"""
+    pending = st.session_state.pop('session_cookie', None)
+    if pending is None:
+        return
+    import streamlit.components.v1 as components
+    token, max_age = pending
+    cookie = json.dumps(f"{SESSION_COOKIE}={token}; Path=/; Max-Age={int(max_age)}; SameSite=Strict")
+    components.html(
+        "<script>"
+        "var secure = window.parent.location.protocol === 'https:' ? '; Secure' : '';"
+        f"window.parent.document.cookie = {cookie} + secure;"
+        "</script>",
+        height=0,
+    )
+
+
+def _clear_session_state():
+    token = st.session_state.get('session_token')
+    st.session_state.authenticated = False
+    st.session_state.user_role = None
+    for key in ('username', 'session_id', 'session_checked_at', 'session_token'):
+        st.session_state.pop(key, None)
+    # Cookien som skickades när anslutningen öppnades ska inte logga in sessionen igen
+    if token:
+        st.session_state.rejected_session_token = token
+    _queue_session_cookie('', 0)
+
+
+def restore_session():
+    """
+    Restore identity and role from the session cookie after a refresh or reconnect
+    (one lookup on sessions._id). Logged-in sessions re-check at most every
+    SESSION_RECHECK_SECONDS that their session has not been revoked.
+    """
+    init_auth()
+    try:
+        if LEGACY_SESSION_QUERY_PARAM in st.query_params:
+            del st.query_params[LEGACY_SESSION_QUERY_PARAM]
+
+        if st.session_state.authenticated:
+            session_id = st.session_state.get('session_id')
+            checked_at = st.session_state.get('session_checked_at', 0)
+            if session_id and time.time() - checked_at > SESSION_RECHECK_SECONDS:
+                if get_database().sessions.find_one({'_id': session_id}, {'_id': 1}) is None:
+                    _clear_session_state()
+                    return False
+                st.session_state.session_checked_at = time.time()
+            return True
+
+        token = st.context.cookies.get(SESSION_COOKIE)
+        if not token or token == st.session_state.get('rejected_session_token'):
+            return False
+        session_id = parse_session_token(token)
+        session = get_database().sessions.find_one({'_id': session_id}) if session_id else None
+        if session is None:
+            st.session_state.session_token = token
+            _clear_session_state()
+            return False
+
+        st.session_state.authenticated = True
+        st.session_state.user_role = session['role']
+        st.session_state.username = session['username']
+        st.session_state.session_id = session_id
+        st.session_state.session_token = token
+        st.session_state.session_checked_at = time.time()
+        return True
+    except Exception as e:
+        print(f"Error restoring session: {e}")
+        return st.session_state.authenticated
+    finally:
+        _write_session_cookie()
+
+
+def list_sessions():
+    """Active sessions, newest first"""
+    return list(get_database().sessions.find({'expires_at': {'$gt': utc_now()}})
+                .sort('created_at', -1))
+
+
+def revoke_sessions(session_id=None, username=None):
+    """Revoke one session, all sessions of a user, or every session when neither is given"""
+    query = {}
+    if session_id:
+        query['_id'] = session_id
+    if username:
+        query['username'] = username
+    return get_database().sessions.delete_many(query).deleted_count
 
 
 def create_user(username, password, role='user'):
@@ -34,51 +288,98 @@ def create_user(username, password, role='user'):
     if db.users.find_one({'username': username}):
         return False, "Username already exists"
 
+    try:
+        hashed_password = hash_password(password)
+    except TimeoutError:
+        return False, "Server busy, please try again"
+
     # Create new user
     user = {
         'username': username,
-        'password': hash_password(password),
+        'password': hashed_password,
         'role': role,
-        'created_at': current_time(),
+        'created_at': utc_now(),
         'last_login': None
     }
 
     try:
         db.users.insert_one(user)
         return True, "User created successfully"
+    except DuplicateKeyError:
+        # Unikt index på username fångar samtidiga registreringar
+        return False, "Username already exists"
     except Exception as e:
         return False, f"Error creating user: {str(e)}"
 
 
 def login(username, password):
-    """Authenticate a user"""
+    """
+    Authenticate a user.
+
+    Raises TimeoutError when the password check could not start because too many are
+    queued; that is not a failed attempt and is neither logged nor counted as one.
+    """
+    started = time.perf_counter()
     db = get_database()
     user = db.users.find_one({'username': username})
 
-    if user and verify_password(password, user['password']):
-        # Update last login
+    verify_started = time.perf_counter()
+    try:
+        valid = bool(user) and verify_password(password, user['password'])
+    except TimeoutError as e:
+        print(f"Login for {username} not checked: {e}")
+        raise
+    verify_ms = (time.perf_counter() - verify_started) * 1000
+
+    if valid:
+        update = {'last_login': utc_now()}
+        # Uppgradera hashen när kostnadsfaktorn har ändrats sedan lösenordet sparades
+        rehashed = hash_rounds(user['password']) != get_bcrypt_rounds()
+        if rehashed:
+            try:
+                update['password'] = hash_password(password)
+            except TimeoutError:
+                # Görs vid nästa inloggning
+                rehashed = False
 
+        # Update last login
         db.users.update_one(
             {'username': username},
-            {'$set': {'last_login': current_time()}}
+            {'$set': update}
         )
 
         st.session_state.authenticated = True
         st.session_state.user_role = user['role']
         st.session_state.username = username
+        try:
+            token, session_id = create_session_token(username, user['role'])
+            st.session_state.session_id = session_id
+            st.session_state.session_token = token
+            st.session_state.session_checked_at = time.time()
+            st.session_state.pop('rejected_session_token', None)
+            _queue_session_cookie(token, get_session_hours() * 3600)
+        except Exception as e:
+            # Inloggningen fungerar ändå, men överlever inte en omladdning
+            print(f"Error creating session token: {e}")
+        _record_login(started, verify_ms, True, rehashed)
         log_action("Login", f"{st.session_state.username} loggade in", "Login Screen")
         return True
-    log_action("Login", f"Misslyckat loginförsök av {username}", "Login Screen")
+    _record_login(started, verify_ms, False)
+    log_action("Login", f"Misslyckat loginförsök av {username}", "Login Screen", username=username)
     return False
 
 
 def logout():
     """Log out the current user"""
-    st.session_state.authenticated = False
-    st.session_state.user_role = None
+    session_id = st.session_state.get('session_id')
+    if session_id:
+        try:
+            revoke_sessions(session_id=session_id)
+        except Exception as e:
+            print(f"Error revoking session: {e}")
     if 'username' in st.session_state:
         log_action("Logout", f"{st.session_state.username} loggade ut", " ")
-        del st.session_state.username
+    _clear_session_state()
 
 
 def show_login_page():
@@ -109,11 +410,16 @@ def show_login_page():
             submitted = st.form_submit_button("Logga in")
 
             if submitted:
-                if login(username, password):
-                    st.success("Inloggning lyckades!")
-                    st.rerun()
+                try:
+                    logged_in = login(username, password)
+                except TimeoutError:
+                    st.warning("Servern är upptagen just nu, försök igen om en stund")
                 else:
-                    st.error("Felaktigt användarnamn eller lösenord")
+                    if logged_in:
+                        st.success("Inloggning lyckades!")
+                        st.rerun()
+                    else:
+                        st.error("Felaktigt användarnamn eller lösenord")
 
         # Add version info at the bottom
         st.markdown("---")
@@ -0,0 +1,201 @@
+"""
+Komplexitetspoäng för uppgifter.
+
+score_tasks() räknar ut alla faktorer med NumPy över de typade kolumnerna och
+ändrar aldrig den tabell som skickas in, så samma funktion kan poängsätta planen,
+historiken eller en enskild batch. Vikterna kommer från en viktprofil
+(WEIGHT_PROFILES, vald i config) och faktorerna normaliseras antingen med min-max
+eller robust mot percentiler så att enstaka extremvärden inte trycker ihop resten.
+Poängen kan sparas i samlingen 'complexity_scores' med save_complexity_scores().
+"""
+import numpy as np
+import pandas as pd
+
+from config import get_complexity_settings
+from Data import utc_now, ROW_ID_COLUMN
+
+# Faktor -> kolumn som normaliseras
+NUMERIC_FACTORS = {
+    'time_factor': 'Task_Estimated_Time',
+    'personnel_factor': 'Task_Personnel_Count',
+    'cost_factor': 'Task_Estimated_Cost',
+    'rental_factor': 'Task_Total_Rental_Cost',
+    'tools_factor': 'tools_count',
+}
+
+WEIGHT_PROFILES = {
+    # Vikterna som calculate_complexity alltid har använt
+    'standard': {
+        'time_factor': 0.25,
+        'personnel_factor': 0.20,
+        'cost_factor': 0.15,
+        'rental_factor': 0.15,
+        'weather_factor': 0.1,
+        'tools_factor': 0.15,
+    },
+    # Arbetsinsats väger tyngst, kostnader mindre
+    'arbete': {
+        'time_factor': 0.35,
+        'personnel_factor': 0.30,
+        'cost_factor': 0.05,
+        'rental_factor': 0.05,
+        'weather_factor': 0.10,
+        'tools_factor': 0.15,
+    },
+    # Ekonomi väger tyngst
+    'ekonomi': {
+        'time_factor': 0.15,
+        'personnel_factor': 0.10,
+        'cost_factor': 0.35,
+        'rental_factor': 0.25,
+        'weather_factor': 0.05,
+        'tools_factor': 0.10,
+    },
+}
+
+SCORES_COLLECTION = "complexity_scores"
+
+
+def resolve_profile(settings=None):
+    """Vikter och normalisering enligt config (profil + eventuella överskrivna vikter)"""
+    settings = settings or get_complexity_settings()
+    weights = dict(WEIGHT_PROFILES.get(settings['profile'], WEIGHT_PROFILES['standard']))
+    weights.update({factor: weight for factor, weight in settings.get('weights', {}).items() if factor in weights})
+    return {
+        'name': settings['profile'] if settings['profile'] in WEIGHT_PROFILES else 'standard',
+        'weights': weights,
+        'normalization': settings.get('normalization', 'minmax'),
+        'lower_percentile': settings.get('lower_percentile', 5),
+        'upper_percentile': settings.get('upper_percentile', 95),
+    }
+
+
+def list_counts(series):
+    """Antal kommaseparerade värden per rad som i den gamla calculate_complexity: 'No data'
+    ger 0, allt annat (även tom sträng och saknat värde) len(str(x).split(',')).
+    Kategorikolumner räknas en gång per kategori och slås upp med koderna."""
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype(object).where(series.notna(), None).astype('category')
+    categories = pd.Series(series.cat.categories, dtype=object)
+    per_category = np.where(categories == 'No data', 0, categories.str.count(',').to_numpy() + 1).astype(int)
+    codes = series.cat.codes.to_numpy()
+    # Saknat värde (kod -1): str(x) ger 'nan'/'None', alltså ett värde
+    if not len(per_category):
+        return np.ones(len(codes), dtype=int)
+    return np.where(codes >= 0, per_category[np.maximum(codes, 0)], 1)
+
+
+def normalize(values, method='minmax', lower_percentile=5, upper_percentile=95):
+    """Skala till 0-1. Som tidigare ger saknade värden NaN (och därmed ingen poäng),
+    och en konstant kolumn ger 1 för alla rader. Gränserna räknas utan saknade värden."""
+    values = np.asarray(values, dtype='float64')
+    present = values[~np.isnan(values)]
+    if not len(present):
+        return np.full_like(values, np.nan)
+    if method == 'percentile':
+        low, high = np.percentile(present, [lower_percentile, upper_percentile])
+    else:
+        low, high = present.min(), present.max()
+    if high == low:
+        return np.ones_like(values)
+    return np.clip((values - low) / (high - low), 0.0, 1.0)
+
+
+def score_tasks(tasks, profile=None):
+    """
+    Poängsätt en batch uppgifter utan att ändra den.
+
+    Med min-max ger det samma poäng som den gamla calculate_complexity: en uppgift
+    som saknar tid, personal, kostnad eller hyreskostnad får ingen poäng (NaN),
+    'No data' som väder räknas som medelsvårt (0.5) och som redskap som 0 redskap.
+
+    :param tasks: DataFrame med uppgiftskolumnerna (typade enligt PLAN_SCHEMA). Antalet
+                  redskap och väderkrav räknas från Task_Technical_Needs/Task_Weather_Conditions
+                  (tools_count/weather_count används bara om de kolumnerna saknas).
+    :param profile: Resultat från resolve_profile(); standard är profilen i config.
+    :return: DataFrame med samma index: en kolumn per faktor och Complexity_Score (1-10).
+    """
+    profile = profile or resolve_profile()
+    method = profile['normalization']
+    percentiles = (profile['lower_percentile'], profile['upper_percentile'])
+
+    def column(name):
+        if name in tasks:
+            return pd.to_numeric(tasks[name], errors='coerce').astype('float64').to_numpy()
+        return np.zeros(len(tasks))
+
+    tools_count = list_counts(tasks['Task_Technical_Needs']) if 'Task_Technical_Needs' in tasks \
+        else tasks['tools_count'].to_numpy()
+    weather_count = list_counts(tasks['Task_Weather_Conditions']) if 'Task_Weather_Conditions' in tasks \
+        else tasks['weather_count'].to_numpy()
+
+    factors = {}
+    for factor, source in NUMERIC_FACTORS.items():
+        values = tools_count if source == 'tools_count' else column(source)
+        factors[factor] = normalize(values, method, *percentiles)
+    # Väder: 'No data' räknas som medelsvårt, annars en fjärdedel per väderkrav
+    factors['weather_factor'] = np.where(weather_count == 0, 0.5, weather_count / 4)
+
+    total = np.zeros(len(tasks))
+    for factor, weight in profile['weights'].items():
+        total += factors[factor] * weight
+
+    scores = pd.DataFrame(factors, index=tasks.index)
+    # Normalisera till en 1-10 skala för enklare tolkning
+    scores['Complexity_Score'] = total * 9 + 1
+    return scores
+
+
+def save_complexity_scores(db, tasks, scores, source="plan", profile=None):
+    """
+    Spara poängen i complexity_scores, en post per uppgift och källa (plan/history).
+
+    :return: Antal sparade poster.
+    """
+    from pymongo import DeleteMany, InsertOne
+
+    profile = profile or resolve_profile()
+    computed_at = utc_now()
+    row_ids = tasks[ROW_ID_COLUMN].astype(object).to_numpy()
+    years = tasks['Archive_Year'].to_numpy() if 'Archive_Year' in tasks else [None] * len(tasks)
+    factor_columns = [column for column in scores.columns if column != 'Complexity_Score']
+
+    # Ersätt alla poäng för källan i en ordnad bulk_write
+    operations = [DeleteMany({'source': source})]
+    for row_id, year, record in zip(row_ids, years, scores.to_dict('records')):
+        if row_id is None or pd.isna(row_id):
+            continue
+        document = {'source': source, ROW_ID_COLUMN: row_id}
+        if year is not None and not pd.isna(year):
+            document['Archive_Year'] = int(year)
+        document.update(score=float(record['Complexity_Score']),
+                        factors={factor: float(record[factor]) for factor in factor_columns},
+                        profile=profile['name'],
+                        computed_at=computed_at)
+        operations.append(InsertOne(document))
+    db[SCORES_COLLECTION].bulk_write(operations, ordered=True)
+    return len(operations) - 1
+
+
+def recompute_complexity_scores(db=None):
+    """Poängsätt hela planen och historiken och spara resultatet. Returnerar antal per källa."""
+    from Data import enforce_schema
+    if db is None:
+        from database import get_database
+        db = get_database()
+
+    profile = resolve_profile()
+    counts = {}
+    # Läs planen direkt från databasen: load_data() skulle skriva över sessionens
+    # snapshot och dataversion utan att ladda om st.session_state.df
+    plan = list(db.goals.find({}, {'_id': 0}))
+    history = list(db.history.find({}, {'_id': 0}))
+    sources = {'plan': enforce_schema(pd.DataFrame(plan)) if plan else None,
+               'history': enforce_schema(pd.DataFrame(history)) if history else None}
+    for source, dataframe in sources.items():
+        if dataframe is None:
+            counts[source] = 0
+            continue
+        tasks = dataframe[dataframe['Type'] == 'Task']
+        counts[source] = save_complexity_scores(db, tasks, score_tasks(tasks, profile), source, profile)
+    return counts
@@ -1,12 +1,166 @@
+import os
 import streamlit as st
 
+def _secret(section, key, default=None):
+    """Read an optional value from Streamlit secrets without failing when it is missing"""
+    try:
+        return st.secrets[section][key]
+    except Exception:
+        return default
+
 def get_mongodb_config():
-    """Get MongoDB configuration from Streamlit secrets"""
+    """
+    Get MongoDB configuration from Streamlit secrets.
+    uri and db_name are required; everything else in [mongodb] is optional tuning:
+    max_pool_size, min_pool_size, compressors, server_selection_timeout_ms,
+    connect_timeout_ms, socket_timeout_ms, write_concern, read_concern,
+    read_preference, health_check_interval (seconds), override_dns, dns_servers.
+    """
     try:
         return {
             'uri': st.secrets.mongodb.uri,
-            'db_name': st.secrets.mongodb.db_name
+            'db_name': st.secrets.mongodb.db_name,
+            'max_pool_size': int(_secret('mongodb', 'max_pool_size', 50)),
+            'min_pool_size': int(_secret('mongodb', 'min_pool_size', 0)),
+            'compressors': _secret('mongodb', 'compressors', 'zlib'),
+            'server_selection_timeout_ms': int(_secret('mongodb', 'server_selection_timeout_ms', 3000)),
+            'connect_timeout_ms': int(_secret('mongodb', 'connect_timeout_ms', 5000)),
+            'socket_timeout_ms': int(_secret('mongodb', 'socket_timeout_ms', 20000)),
+            'write_concern': _secret('mongodb', 'write_concern', 'majority'),
+            'read_concern': _secret('mongodb', 'read_concern', 'local'),
+            'read_preference': _secret('mongodb', 'read_preference', 'primaryPreferred'),
+            'health_check_interval': float(_secret('mongodb', 'health_check_interval', 30)),
+            'override_dns': bool(_secret('mongodb', 'override_dns', False)),
+            'dns_servers': list(_secret('mongodb', 'dns_servers', ['8.8.8.8', '8.8.4.4'])),
         }
     except Exception as e:
         st.error(f"Failed to load MongoDB configuration: {str(e)}")
-        raise 
\ No newline at end of file
+        raise
+
+
+def get_storage_config():
+    """
+    Get the storage backend configuration.
+    Environment variables override Streamlit secrets so offline runs need no secrets file:
+    PLANNER_STORAGE_BACKEND = mongodb (default) | sqlite | memory
+    PLANNER_SQLITE_PATH     = path to the SQLite file used by the sqlite backend
+    """
+    return {
+        'backend': os.environ.get('PLANNER_STORAGE_BACKEND')
+                   or _secret('storage', 'backend', 'mongodb'),
+        'sqlite_path': os.environ.get('PLANNER_SQLITE_PATH')
+                       or _secret('storage', 'sqlite_path', 'planner_local.sqlite3'),
+        'db_name': os.environ.get('PLANNER_DB_NAME')
+                   or _secret('storage', 'db_name', 'planner'),
+    }
+
+def get_log_retention_days():
+    """
+    How many days audit logs are kept before the TTL index removes them.
+    PLANNER_LOG_RETENTION_DAYS or st.secrets.logging.retention_days; 0 keeps logs forever.
+    """
+    value = os.environ.get('PLANNER_LOG_RETENTION_DAYS') or _secret('logging', 'retention_days', 365)
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return 365
+
+def get_db_monitoring_enabled():
+    """
+    Whether MongoDB commands are recorded for the Admin "DB-prestanda" tab.
+    PLANNER_DB_MONITORING or st.secrets.monitoring.enabled; on by default.
+    """
+    value = os.environ.get('PLANNER_DB_MONITORING') or _secret('monitoring', 'enabled', True)
+    return str(value).strip().lower() not in ('0', 'false', 'no', 'off')
+
+def get_db_monitoring_bytes():
+    """
+    Whether the DB monitor also measures request and reply sizes in bytes. This BSON-encodes
+    every command and reply a second time on the calling thread, so it is off by default.
+    PLANNER_DB_MONITORING_BYTES or st.secrets.monitoring.measure_bytes.
+    """
+    value = os.environ.get('PLANNER_DB_MONITORING_BYTES') or _secret('monitoring', 'measure_bytes', False)
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+def get_journal_path():
+    """
+    Path of the local SQLite journal that holds writes made while the database is unreachable.
+    PLANNER_JOURNAL_PATH or st.secrets.storage.journal_path.
+    """
+    return (os.environ.get('PLANNER_JOURNAL_PATH')
+            or _secret('storage', 'journal_path', 'planner_journal.sqlite3'))
+
+def get_bcrypt_rounds():
+    """
+    bcrypt cost factor for new and upgraded password hashes.
+    PLANNER_BCRYPT_ROUNDS or st.secrets.auth.bcrypt_rounds; bcrypt accepts 4-31.
+    """
+    value = os.environ.get('PLANNER_BCRYPT_ROUNDS') or _secret('auth', 'bcrypt_rounds', 12)
+    try:
+        return min(max(int(value), 4), 31)
+    except (TypeError, ValueError):
+        return 12
+
+def get_password_hash_workers():
+    """Number of threads that run bcrypt, which bounds how many logins hash at the same time"""
+    value = os.environ.get('PLANNER_HASH_WORKERS') or _secret('auth', 'hash_workers', 2)
+    try:
+        return max(int(value), 1)
+    except (TypeError, ValueError):
+        return 2
+
+def get_session_secret():
+    """
+    Secret used to sign session tokens: PLANNER_SESSION_SECRET or st.secrets.auth.session_secret.
+    Returns None when not configured; auth then keeps a generated secret in the database.
+    """
+    return os.environ.get('PLANNER_SESSION_SECRET') or _secret('auth', 'session_secret')
+
+def get_session_hours():
+    """How long a login stays valid across refreshes and reconnects (st.secrets.auth.session_hours)"""
+    value = os.environ.get('PLANNER_SESSION_HOURS') or _secret('auth', 'session_hours', 12)
+    try:
+        return max(float(value), 0.1)
+    except (TypeError, ValueError):
+        return 12.0
+
+def get_complexity_settings():
+    """
+    Complexity scoring settings from st.secrets [complexity]:
+    profile (a name in complexity.WEIGHT_PROFILES, or PLANNER_COMPLEXITY_PROFILE),
+    normalization ('minmax' or 'percentile'), lower_percentile/upper_percentile,
+    and an optional [complexity.weights] table overriding single factor weights.
+    """
+    try:
+        weights = dict(st.secrets['complexity']['weights'])
+    except Exception:
+        weights = {}
+    return {
+        'profile': os.environ.get('PLANNER_COMPLEXITY_PROFILE') or _secret('complexity', 'profile', 'standard'),
+        'normalization': _secret('complexity', 'normalization', 'minmax'),
+        'lower_percentile': float(_secret('complexity', 'lower_percentile', 5)),
+        'upper_percentile': float(_secret('complexity', 'upper_percentile', 95)),
+        'weights': {factor: float(weight) for factor, weight in weights.items()},
+    }
+
+def get_task_chart_settings():
+    """
+    Per-task bar charts (st.secrets [charts]): above threshold tasks
+    (PLANNER_TASK_CHART_THRESHOLD) the charts switch to mode, one of 'top_n'
+    (the top_n largest tasks plus one bar for the rest), 'histogram' (binned
+    server-side into bins buckets) or 'webgl' (one Scattergl point per task).
+    """
+    def number(value, default):
+        try:
+            return max(int(value), 1)
+        except (TypeError, ValueError):
+            return default
+
+    mode = _secret('charts', 'mode', 'top_n')
+    return {
+        'threshold': number(os.environ.get('PLANNER_TASK_CHART_THRESHOLD')
+                            or _secret('charts', 'threshold', 500), 500),
+        'mode': mode if mode in ('top_n', 'histogram', 'webgl') else 'top_n',
+        'top_n': number(_secret('charts', 'top_n', 30), 30),
+        'bins': number(_secret('charts', 'bins', 40), 40),
+    }
@@ -1,74 +1,210 @@
 from datetime import datetime
-from Data import current_time
+from Data import utc_now, parse_legacy_timestamp, to_document_value, ROW_ID_COLUMN
+from config import get_log_retention_days
+import atexit
+import pymongo
 import pytz
+import queue
+import threading
+import time
 import streamlit as st
 import pandas as pd
-import os
+from pymongo.errors import BulkWriteError
+
+# Loggar skrivs i bakgrunden i batchar: vid LOG_BATCH_SIZE poster eller efter
+# LOG_FLUSH_INTERVAL sekunder, och när processen avslutas.
+LOG_BATCH_SIZE = 50
+LOG_FLUSH_INTERVAL = 2.0
+# Max antal poster som hålls kvar för nya försök om databasen inte svarar
+LOG_MAX_PENDING = 5000
+# Felkod för dubblett: posten finns redan (skrevs vid ett tidigare försök)
+DUPLICATE_KEY_ERROR = 11000
 
 
 def initialize_logs_collection():
     """
     Kontrollerar om samlingen 'logs' existerar och skapar den om den saknas.
+    Index, TTL och migrering av gamla tidsstämplar sköts av migrations.bootstrap_database.
     """
     try:
         from database import get_database
+        from migrations import bootstrap_database
         db = get_database()
 
         # Kontrollera om samlingen existerar
         if "logs" not in db.list_collection_names():
             print("Logs collection does not exist. Creating it now.")
             db.create_collection("logs")
-            # Eventuellt kan du sätta en indexering här för bättre prestanda.
-            db.logs.create_index([("timestamp", pymongo.ASCENDING)])
             print("Logs collection created successfully.")
+
+        bootstrap_database(db)
     except Exception as e:
         print(f"Error initializing logs collection: {e}")
 
 
-def log_action(action, description, location):
+def ensure_log_retention(db):
     """
-    Loggar en användarhandling och sparar den i databasen.
-
-    :param action: Typ av handling (t.ex. "Bug Rapporterad", "Status Uppdaterad").
-    :param description: Detaljerad beskrivning av handlingen.
-    :param location: Var handlingen inträffade (kan vara en modul eller funktion).
+    Skapar TTL-index på timestamp enligt get_log_retention_days().
+    Ändras lagringstiden byggs indexet om; 0 dagar ger ett vanligt index utan utgång.
     """
+    retention_days = get_log_retention_days()
+    expire_after = retention_days * 24 * 60 * 60 if retention_days else None
 
-    try:
-        print("Trying to save logs")
-        logs_df = load_logs()  # Ladda befintliga loggar
-        from database import get_database  # Import inuti funktionen för att undvika cirkulära importer
-        db = get_database()
+    current = db.logs.index_information().get("timestamp_1")
+    if current is not None and current.get("expireAfterSeconds") != expire_after:
+        db.logs.drop_index("timestamp_1")
+        print(f"Rebuilding logs timestamp index (retention {retention_days} days)")
 
-        # Kontrollera och initiera samlingen 'logs' om den saknas
+    if expire_after:
+        db.logs.create_index([("timestamp", pymongo.ASCENDING)], expireAfterSeconds=expire_after)
+    else:
+        db.logs.create_index([("timestamp", pymongo.ASCENDING)])
+
+
+def migrate_string_timestamps(db):
+    """
+    Konverterar tidsstämplar sparade som text ("Datum: ... Tid: ...", Stockholmstid)
+    till riktiga UTC-datum i logs och users. Kan köras flera gånger.
+    """
+    targets = [("logs", "timestamp"), ("users", "created_at"), ("users", "last_login")]
+    migrated = 0
+    for collection, field in targets:
+        updates = []
+        for document in db[collection].find({field: {"$type": "string"}}, {field: 1}):
+            parsed = parse_legacy_timestamp(document[field])
+            if parsed is not None:
+                updates.append(pymongo.UpdateOne({"_id": document["_id"]}, {"$set": {field: parsed}}))
+        if updates:
+            db[collection].bulk_write(updates, ordered=False)
+            migrated += len(updates)
+    if migrated:
+        print(f"Migrated {migrated} string timestamps to UTC datetimes")
+    return migrated
+
+
+class _LogWriter:
+    """Bakgrundstråd som tömmer loggkön till databasen med insert_many."""
+
+    _STOP = object()
+
+    def __init__(self, batch_size=LOG_BATCH_SIZE, flush_interval=LOG_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def enqueue(self, entry):
+        self._ensure_started()
+        self._queue.put(entry)
+
+    def flush(self, timeout=10):
+        """Block until everything queued so far has been written (used by scripts and shutdown)"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def shutdown(self, timeout=10):
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+
+    def _write(self, batch):
+        if not batch:
+            return batch
+        try:
+            from database import get_database  # Import inuti funktionen för att undvika cirkulära importer
+            db = get_database()
+            db.logs.insert_many(batch, ordered=False)
+            print(f"Saved {len(batch)} log entries")
+            return []
+        except BulkWriteError as e:
+            # insert_many har gett posterna ett _id, så de som redan skrevs vid ett tidigare
+            # försök ger dubblettfel och räknas som sparade. Bara övriga fel försöks igen.
+            failed = [error['index'] for error in e.details.get('writeErrors', [])
+                      if error.get('code') != DUPLICATE_KEY_ERROR]
+            saved = len(batch) - len(failed)
+            if saved:
+                print(f"Saved {saved} log entries")
+            if failed:
+                print(f"Error saving {len(failed)} log entries to MongoDB: {e}")
+            return [batch[index] for index in failed][-LOG_MAX_PENDING:]
+        except Exception as e:
+            print(f"Error saving logs to MongoDB: {e}")
+            # Behåll posterna till nästa försök, men låt inte kön växa obegränsat
+            return batch[-LOG_MAX_PENDING:]
+
+    def _run(self):
         initialize_logs_collection()
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+
+            if item is self._STOP:
+                self._write(batch)
+                return
+            if isinstance(item, threading.Event):
+                batch = self._write(batch)
+                item.set()
+                continue
+            if item is not None:
+                batch.append(item)
+
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                batch = self._write(batch)
+                deadline = time.monotonic() + self.flush_interval
+
+
+_log_writer = _LogWriter()
+atexit.register(_log_writer.shutdown)
+
 
-        # Kontrollera att databasen och loggen är korrekt konfigurerade
-        if not hasattr(db, "logs"):
-            raise AttributeError("Database object does not have a 'logs' attribute")
+def flush_logs(timeout=10):
+    """Vänta tills alla köade loggar har skrivits till databasen."""
+    _log_writer.flush(timeout)
 
+
+def log_action(action, description, location, username=None, changes=None):
+    """
+    Loggar en användarhandling. Posten läggs i en kö och skrivs till databasen
+    av en bakgrundstråd, så anroparen väntar aldrig på databasen.
+
+    :param action: Typ av handling (t.ex. "Bug Rapporterad", "Status Uppdaterad").
+    :param description: Detaljerad beskrivning av handlingen.
+    :param location: Var handlingen inträffade (kan vara en modul eller funktion).
+    :param username: Användaren som utförde handlingen, standard är den inloggade användaren.
+    :param changes: Lista med fältändringar när posten är ett changeset.
+    """
+    try:
+        if username is None:
+            username = st.session_state.get('username')
         log_entry = {
             'action': action,
             'description': description,
             'location': location,
-            'timestamp': current_time()
+            'username': username,
+            'timestamp': utc_now()
         }
-
-        # Lägg till loggen i databasen
-
-        log_print_success = (f"Log saved successfully: {log_entry}")
-        lps = str.encode(log_print_success)
-
-        db.logs.insert_one(log_entry)
-        print(f"Log saved successfully: {log_entry}")
-        os.write(1, lps)
+        if changes is not None:
+            log_entry['changes'] = changes
+        _log_writer.enqueue(log_entry)
     except Exception as e:
-
-        log_print_fail = (f"Error saving data to MongoDB: {e}")
-        lpf = str.encode(log_print_fail)
-
-        print(f"Error saving data to MongoDB: {e}")
-        os.write(1, lpf)
+        print(f"Error queueing log entry: {e}")
 
 
 def load_logs():
@@ -95,83 +231,124 @@ def load_logs():
         return pd.DataFrame(columns=['action', 'description', 'location', 'timestamp'])
 
 
-def get_logs_by_action():
-    """
-    Använder aggregation pipeline för att gruppera loggar efter action.
-    Returnerar en ordbok där nycklarna är actions och värdena är listor av loggar.
+# Kända actions, används som filterval i Admin-panelens loggvy
+LOG_ACTIONS = [
+    "add_goal", "add_task", "add_risk", "add_tool",
+    "remove_tool", "complete_task", "complete_goal",
+    "bug_report", "bug_fixed", "bug_unfixed", "save_history",
+    "update", "import_data", "clear_all_data", "clear_specific_data",
+    "Login", "Logout", "revoke_sessions", "retry_journal_entry", "discard_journal_entry",
+]
+
+
+def query_logs(actions=None, username=None, location=None, start=None, end=None,
+               cursor=None, page_size=50):
     """
-    actions = [
-        "add_goal", "add_task", "add_risk", "add_tool",
-        "remove_tool", "complete_task", "complete_goal",
-        "bug_report", "bug_fixed", "bug_unfixed", "save_history",
-        "Login", "Logout",
-    ]
+    Hämtar en sida loggar, nyast först, filtrerat på action, användare, plats och tidsfönster.
+
+    Antal per action räknas på servern med $facet. Sidorna hämtas med cursor-baserad
+    paginering på (timestamp, _id) som använder indexet (action, timestamp).
 
+    :param cursor: next_cursor från föregående sida, None för första sidan.
+    :return: dict med 'logs', 'counts' (action -> antal), 'total' och 'next_cursor'.
+    """
+    result = {'logs': [], 'counts': {}, 'total': 0, 'next_cursor': None}
     try:
         from database import get_database
         db = get_database()
-        logs_collection = db.logs
-
-        # Updated pipeline to exclude _id field from the results
-        pipeline = [
-            {"$match": {"action": {"$in": actions}}},
-            {"$project": {"_id": 0}},  # Exclude _id field
-            {"$group": {
-                "_id": "$action",
-                "logs": {"$push": "$$ROOT"}
-            }}
-        ]
-
-        # Kör aggregation och skapa en ordbok
-        logs_by_action = {}
-        for group in logs_collection.aggregate(pipeline):
-            logs_by_action[group["_id"]] = group["logs"]
 
-        st.write(f"Totalt {len(logs_by_action)} actions grupperades.")
-
-        success = f"Hämtar loggar!"
-        os.write(1, success.encode())
-
-        for action, logs in logs_by_action.items():
-            st.write(f"Action: {action} - Antal loggar: {len(logs)}")
+        match = {}
+        if actions:
+            match['action'] = {'$in': list(actions)}
+        if username:
+            match['username'] = username
+        if location:
+            match['location'] = location
+        if start or end:
+            match['timestamp'] = {}
+            if start:
+                match['timestamp']['$gte'] = start
+            if end:
+                match['timestamp']['$lt'] = end
+
+        # Antal per action och totalt, utan att skicka själva loggarna
+        facets = next(db.logs.aggregate([
+            {'$match': match},
+            {'$facet': {
+                'by_action': [{'$group': {'_id': '$action', 'count': {'$sum': 1}}},
+                              {'$sort': {'count': -1}}],
+                'total': [{'$count': 'count'}],
+            }}
+        ]), {'by_action': [], 'total': []})
+        result['counts'] = {group['_id']: group['count'] for group in facets['by_action']}
+        result['total'] = facets['total'][0]['count'] if facets['total'] else 0
+
+        page_filter = match
+        if cursor:
+            page_filter = {'$and': [match, {'$or': [
+                {'timestamp': {'$lt': cursor['timestamp']}},
+                {'timestamp': cursor['timestamp'], '_id': {'$lt': cursor['_id']}},
+            ]}]}
+
+        logs = list(db.logs.find(page_filter)
+                    .sort([('timestamp', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)])
+                    .limit(page_size + 1))
+        if len(logs) > page_size:
+            logs = logs[:page_size]
+            result['next_cursor'] = {'timestamp': logs[-1]['timestamp'], '_id': logs[-1]['_id']}
+
+        for log in logs:
+            log.pop('_id', None)
+        result['logs'] = logs
+        return result
+    except Exception as e:
+        print(f"Error querying logs: {e}")
+        return result
 
-        return logs_by_action
 
-    except Exception as e:
-        error_h = f"Error fetching logs by action:\n {e}"
-        os.write(1, error_h.encode())
-        print(f"Error fetching logs by action:\n {e}")
-        return {}
+def compare_and_log_changes(df, edited_df):
+    """
+    Jämför planen före och efter en redigering i ett enda svep över hela tabellen
+    och loggar alla ändringar som ett changeset-dokument (användare, tid, lista av fältändringar).
 
+    :param df: Planen innan ändringarna.
+    :param edited_df: Planen efter update_dataframe.
+    :return: Lista med ändringar.
+    """
+    before = df.set_index(ROW_ID_COLUMN)
+    after = edited_df.set_index(ROW_ID_COLUMN)
+    rows = before.index.intersection(after.index)
+    columns = [column for column in after.columns if column in before.columns]
+
+    old = before.loc[rows, columns].astype(object)
+    new = after.loc[rows, columns].astype(object)
+    old_missing = old.isna().to_numpy()
+    new_missing = new.isna().to_numpy()
+    old_values = old.where(~old_missing, None).to_numpy()
+    new_values = new.where(~new_missing, None).to_numpy()
+
+    # Ändrad = olika värden, där två saknade värden räknas som lika
+    changed = (old_values != new_values) & ~(old_missing & new_missing)
+    row_positions, column_positions = changed.nonzero()
 
-def compare_and_log_changes(df, edited_data):
     changes_made = []
-
-    # Iterera över alla redigerade data
-    for index, new_data in edited_data.items():
-        # Hämta det gamla värdet från df (du kan använda indexet för att hitta motsvarande rad)
-        old_data = df.loc[index] if index in df.index else None
-
-        # Jämför varje kolumn (värde) för att se om något ändrats
-        for column in new_data:
-            old_value = old_data[column] if old_data is not None else None
-            new_value = new_data[column]
-
-            if old_value != new_value:
-                changes_made.append({
-                    "index": index,
-                    "column": column,
-                    "old_value": old_value,
-                    "new_value": new_value
-                })
-
-    # Logga ändringarna om några finns
+    for row, column in zip(row_positions, column_positions):
+        changes_made.append({
+            'row_id': rows[row],
+            'type': to_document_value(after.at[rows[row], 'Type']),
+            'goal': to_document_value(after.at[rows[row], 'Goal_Name']),
+            'task': to_document_value(after.at[rows[row], 'Task_Name']) or None,
+            'column': columns[column],
+            'old_value': to_document_value(old_values[row, column]),
+            'new_value': to_document_value(new_values[row, column]),
+        })
+
+    # Logga alla ändringar som ett enda dokument
     if changes_made:
-        for change in changes_made:
-            log_action("update",
-                       (f"{st.session_state.username} ändrade uppgiften {change['column']} \n"
-                        f"för rad {change['index']} \n"
-                        f"från {change['old_value']} \n"
-                        f"till {change['new_value']}\n"),
-                       "Planering/Redigera Mål och Uppgifter")
+        username = st.session_state.get('username')
+        changed_rows = len(set(row_positions))
+        log_action("update",
+                   f"{username} sparade {len(changes_made)} ändringar i {changed_rows} mål/uppgifter",
+                   "Planering/Redigera Mål och Uppgifter",
+                   changes=changes_made)
     return changes_made
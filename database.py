@@ -1,84 +1,186 @@
 from pymongo import MongoClient
 import streamlit as st
-import sys
+import pandas as pd
+import threading
+import time
 import dns.resolver
-from config import get_mongodb_config
+from config import get_mongodb_config, get_storage_config, get_db_monitoring_enabled
 from custom_logging import log_action
+from Data import bump_data_version, invalidate_technical_needs_cache
 
-@st.cache_resource(ttl=3600)  # Cache for 1 hour
-def get_database():
-    """Get MongoDB database connection with caching"""
+
+class _HealthMonitor:
+    """
+    Pingar databasen i en bakgrundstråd och cachar resultatet, så att sidor kan
+    fråga is_degraded() utan att själva vänta på nätverket.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._db = None
+        self.interval = 30.0
+        self.state = {'healthy': None, 'checked_at': None, 'latency_ms': None, 'error': None}
+
+    def watch(self, db, interval=30.0):
+        """Start (or retarget) background health checks against db"""
+        with self._lock:
+            self._db = db
+            self.interval = interval
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-health", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def check_now(self):
+        """Run one health check in the calling thread and return the new state"""
+        db = self._db
+        if db is None:
+            return self.snapshot()
+        started = time.perf_counter()
+        try:
+            db.command('ping')
+            state = {'healthy': True, 'error': None}
+        except Exception as e:
+            state = {'healthy': False, 'error': f"{type(e).__name__}: {e}"}
+        state['latency_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        state['checked_at'] = time.time()
+        with self._lock:
+            was_healthy = self.state['healthy']
+            self.state = state
+        if was_healthy is not False and not state['healthy']:
+            print(f"Database health check failed: {state['error']}")
+        elif was_healthy is False and state['healthy']:
+            print("Database connection restored")
+        return dict(state)
+
+    def report_failure(self, error):
+        """Mark the connection degraded right away after a failed operation and recheck soon"""
+        with self._lock:
+            self.state = dict(self.state, healthy=False, error=f"{type(error).__name__}: {error}",
+                              checked_at=time.time())
+        self._wake.set()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.state)
+
+    def _run(self):
+        while True:
+            self.check_now()
+            # Kontrollera oftare medan anslutningen är nere
+            interval = self.interval if self.state['healthy'] else min(self.interval, 5.0)
+            self._wake.wait(interval)
+            self._wake.clear()
+
+
+_health = _HealthMonitor()
+
+
+def is_degraded():
+    """True when the latest background health check failed; never blocks"""
+    return _health.snapshot()['healthy'] is False
+
+
+def get_connection_health():
+    """Cached health state: healthy (None until the first check), checked_at, latency_ms, error"""
+    return _health.snapshot()
+
+
+def report_database_error(error):
+    """Let callers that hit a connection error flag degraded mode without waiting for the next check"""
+    _health.report_failure(error)
+
+
+def _connect_mongodb(storage_config):
+    """
+    Storage backend: live MongoDB reached through st.secrets.
+    The client connects lazily (connect=False); reachability is tracked by the
+    background health monitor instead of a blocking server_info() call.
+    """
     try:
-        print("\n=== Starting MongoDB Connection Process ===")
-        print(f"Python version: {sys.version}")
-        
-        # Get MongoDB configuration
         mongodb_config = get_mongodb_config()
-        MONGODB_URI = mongodb_config['uri']
-        DB_NAME = mongodb_config['db_name']
-        
-        # Mask URI for logging
-        masked_uri = MONGODB_URI.replace(MONGODB_URI.split('@')[0], '***')
-        print(f"MongoDB URI (masked): {masked_uri}")
-        print(f"Target database: {DB_NAME}")
-        
-        # Configure DNS resolver
-        print("\nConfiguring DNS resolver...")
-        dns.resolver.default_resolver = dns.resolver.Resolver(configure=False)
-        dns.resolver.default_resolver.nameservers = ['8.8.8.8', '8.8.4.4']  # Google DNS
-        print("✓ DNS resolver configured")
-        
-        print("\nStep 1: Creating MongoDB client...")
+
+        if mongodb_config['override_dns']:
+            # Opt-in: vissa nätverk kan inte slå upp mongodb+srv-poster med systemets resolver
+            dns.resolver.default_resolver = dns.resolver.Resolver(configure=False)
+            dns.resolver.default_resolver.nameservers = mongodb_config['dns_servers']
+
+        # Mätning av varje kommando för Admin-fliken "DB-prestanda"
+        event_listeners = []
+        if get_db_monitoring_enabled():
+            from db_monitor import monitor
+            event_listeners.append(monitor)
+
         client = MongoClient(
-            MONGODB_URI,
-            directConnection=False,
-            connect=True,
-            serverSelectionTimeoutMS=30000,
-            connectTimeoutMS=30000,
-            socketTimeoutMS=30000
+            mongodb_config['uri'],
+            connect=False,
+            event_listeners=event_listeners,
+            appname="PlannerTool",
+            maxPoolSize=mongodb_config['max_pool_size'],
+            minPoolSize=mongodb_config['min_pool_size'],
+            compressors=mongodb_config['compressors'],
+            serverSelectionTimeoutMS=mongodb_config['server_selection_timeout_ms'],
+            connectTimeoutMS=mongodb_config['connect_timeout_ms'],
+            socketTimeoutMS=mongodb_config['socket_timeout_ms'],
+            w=mongodb_config['write_concern'],
+            readConcernLevel=mongodb_config['read_concern'],
+            readPreference=mongodb_config['read_preference'],
+            retryWrites=True,
+            retryReads=True
         )
-        print("✓ Client created successfully")
-        
-        print("\nStep 2: Testing connection...")
-        client.server_info()
-        print("✓ Connection test successful")
-        
-        print("\nStep 3: Accessing database...")
-        db = client[DB_NAME]
-        print(f"✓ Database '{DB_NAME}' accessed")
-        
-        print("\n=== MongoDB Connection Successful ===\n")
-        
+        db = client[mongodb_config['db_name']]
+        _health.watch(db, mongodb_config['health_check_interval'])
+        print(f"MongoDB client configured for database '{mongodb_config['db_name']}'")
         return db
-        
+
     except Exception as e:
-        print("\n!!! MongoDB Connection Error !!!")
-        print(f"Error type: {type(e).__name__}")
-        print(f"Error message: {str(e)}")
-        print(f"Error details: {repr(e)}")
-        
-        # Try different DNS resolution methods
-        try:
-            print("\nTrying alternative DNS resolution methods:")
-            hostname = MONGODB_URI.split('@')[1].split('/')[0]
-            
-            print("\n1. Using dns.resolver:")
-            resolver = dns.resolver.Resolver()
-            resolver.nameservers = ['8.8.8.8', '8.8.4.4']
-            answers = resolver.resolve(hostname, 'A')
-            print(f"DNS Resolution successful: {[rdata.address for rdata in answers]}")
-            
-            print("\n2. Using socket.getaddrinfo:")
-            import socket
-            addrinfo = socket.getaddrinfo(hostname, 27017)
-            print(f"Address info: {addrinfo}")
-            
-        except Exception as dns_error:
-            print(f"Alternative DNS resolution failed: {str(dns_error)}")
-        
-        st.error(f"Failed to connect to MongoDB: {str(e)}")
+        print(f"MongoDB configuration error: {type(e).__name__}: {e}")
+        st.error(f"Failed to configure MongoDB: {str(e)}")
         raise
 
+
+def _connect_sqlite(storage_config):
+    """Storage backend: embedded engine persisted to a local SQLite file"""
+    from local_database import open_local_database
+    print(f"Using local SQLite storage: {storage_config['sqlite_path']}")
+    db = open_local_database(storage_config['sqlite_path'], storage_config['db_name'])
+    _health.watch(db)
+    return db
+
+
+def _connect_memory(storage_config):
+    """Storage backend: embedded engine kept in process memory only"""
+    from local_database import open_local_database
+    print("Using in-memory storage")
+    db = open_local_database(None, storage_config['db_name'])
+    _health.watch(db)
+    return db
+
+
+# Every backend takes the storage config and returns an object with the pymongo
+# Database interface the app uses (db.<collection>.find/insert_many/delete_many/
+# update_one/bulk_write/aggregate/...).
+STORAGE_BACKENDS = {
+    'mongodb': _connect_mongodb,
+    'sqlite': _connect_sqlite,
+    'memory': _connect_memory,
+}
+
+
+@st.cache_resource  # One client per process; the driver's pool handles reconnects
+def get_database():
+    """
+    Get a database handle from the configured storage backend, with caching.
+    Never blocks on the network: check is_degraded() before optional database work.
+    """
+    storage_config = get_storage_config()
+    backend = storage_config['backend']
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown storage backend '{backend}', expected one of: {', '.join(STORAGE_BACKENDS)}")
+    return STORAGE_BACKENDS[backend](storage_config)
+
 def dataframe_to_dict(df):
     """Convert DataFrame to list of dictionaries with proper date handling"""
     print("\n=== Converting DataFrame to Dict ===")
@@ -133,10 +235,12 @@ def clear_all_collections():
     """Clear all collections in the database"""
     try:
         db = get_database()
-        collections = ["goals", 'tasks', "technical_needs", "bugs", "history", "risks"]  # Add risks
+        collections = ["goals", 'tasks', "technical_needs", "bugs", "history", "risks", "plan_rollups"]  # Add risks
         for collection in collections:
             db[collection].delete_many({})
             log_action("clear_all_data", f"{st.session_state.username} Rensade all samlad data!", "Admin Panel")
+        bump_data_version(db, plan_changed=True)
+        invalidate_technical_needs_cache()
         return True
     except Exception as e:
         print(f"Error clearing collections: {str(e)}")
@@ -146,5 +250,11 @@ def clear_specific_collection(collection_name):
     """Clear a specific collection in the database"""
     db = get_database()
     result = db[collection_name].delete_many({})
+    if collection_name == 'goals':
+        # Månadssummorna följer planen
+        db.plan_rollups.delete_many({})
+    bump_data_version(db, plan_changed=(collection_name == 'goals'))
+    if collection_name == 'technical_needs':
+        invalidate_technical_needs_cache()
     log_action("clear_specific_data", f"{st.session_state.username} Rensade all data relaterat till{collection_name}!", "Admin Panel")
     return result.deleted_count
\ No newline at end of file
@@ -0,0 +1,223 @@
+"""
+Mätning av databasanrop per sida.
+
+CommandMonitor registreras som pymongo CommandListener på MongoClient och
+sparar varje kommando (namn, samling, tid, antal dokument) i en ringbuffert
+tillsammans med funktionen som gjorde anropet och aktuell flik. Storleken i
+bytes mäts bara om monitoring.measure_bytes är på, eftersom det kodar om varje
+kommando och svar till BSON på den anropande tråden och då påverkar tiderna.
+Main markerar varje körning med track_rerun() och varje flik med monitor_tab(),
+så att databastiden kan jämföras med den totala tiden för fliken.
+Resultatet visas i Admin-panelens flik "DB-prestanda".
+"""
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+import bson
+from pymongo import monitoring
+
+from config import get_db_monitoring_bytes
+
+# Antal kommandon respektive flik-/körningsmätningar som sparas
+MAX_COMMANDS = 5000
+MAX_SPANS = 2000
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Moduler som aldrig räknas som anropare
+_SKIP_MODULES = {"db_monitor", "database", "local_database"}
+
+_context = contextvars.ContextVar("db_monitor_context", default={"rerun": None, "tab": None})
+
+
+def _caller():
+    """Närmaste funktion i appens egna moduler som ledde till databasanropet"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_APP_DIR):
+            module = os.path.splitext(os.path.basename(filename))[0]
+            if module not in _SKIP_MODULES:
+                return f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return "okänd"
+
+
+def _documents_returned(reply):
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    if "n" in reply:
+        return reply["n"]
+    return 0
+
+
+def _size(document):
+    try:
+        return len(bson.encode(document))
+    except Exception:
+        return 0
+
+
+class CommandMonitor(monitoring.CommandListener):
+    """Samlar in pymongo-kommandon i en trådsäker ringbuffert"""
+
+    def __init__(self, max_commands=MAX_COMMANDS, max_spans=MAX_SPANS, measure_bytes=False):
+        self.measure_bytes = measure_bytes
+        self._lock = threading.Lock()
+        self._pending = {}
+        self.commands = deque(maxlen=max_commands)
+        self.spans = deque(maxlen=max_spans)
+
+    # CommandListener
+    def started(self, event):
+        context = _context.get()
+        command = event.command
+        collection = command.get(event.command_name)
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = {
+                "command": event.command_name,
+                "collection": collection if isinstance(collection, str) else None,
+                "caller": _caller(),
+                "tab": context["tab"] or "Start",
+                "rerun": context["rerun"],
+                "thread": threading.current_thread().name,
+                "request_bytes": _size(command) if self.measure_bytes else None,
+            }
+
+    def succeeded(self, event):
+        self._finish(event, "ok", event.reply)
+
+    def failed(self, event):
+        self._finish(event, "failed", {})
+
+    def _finish(self, event, status, reply):
+        with self._lock:
+            record = self._pending.pop((event.connection_id, event.request_id), None)
+        if record is None:
+            return
+        record.update({
+            "status": status,
+            "timestamp": time.time(),
+            "duration_ms": event.duration_micros / 1000,
+            "documents": _documents_returned(reply),
+            "reply_bytes": _size(reply) if self.measure_bytes else None,
+        })
+        with self._lock:
+            self.commands.append(record)
+
+    # Flikar och körningar
+    def add_span(self, kind, name, rerun, started, duration_ms):
+        with self._lock:
+            self.spans.append({"kind": kind, "name": name, "rerun": rerun,
+                               "timestamp": started, "duration_ms": duration_ms})
+
+    def clear(self):
+        with self._lock:
+            self.commands.clear()
+            self.spans.clear()
+
+    def trace(self):
+        """Kopia av allt insamlat, för visning och nedladdning"""
+        with self._lock:
+            return {"commands": [dict(record) for record in self.commands],
+                    "spans": [dict(span) for span in self.spans]}
+
+
+monitor = CommandMonitor(measure_bytes=get_db_monitoring_bytes())
+
+
+@contextmanager
+def track_rerun():
+    """Markera en körning av skriptet; alla databasanrop inuti får samma rerun-id"""
+    rerun = uuid.uuid4().hex[:8]
+    token = _context.set({"rerun": rerun, "tab": None})
+    started = time.time()
+    try:
+        yield rerun
+    finally:
+        monitor.add_span("rerun", "Hela sidan", rerun, started, (time.time() - started) * 1000)
+        _context.reset(token)
+
+
+@contextmanager
+def monitor_tab(name):
+    """Markera en flik; nästlade flikar får namn som 'Analys/Gantt-schema'"""
+    context = _context.get()
+    tab = f"{context['tab']}/{name}" if context["tab"] else name
+    token = _context.set({"rerun": context["rerun"], "tab": tab})
+    started = time.time()
+    try:
+        yield
+    finally:
+        monitor.add_span("tab", tab, context["rerun"], started, (time.time() - started) * 1000)
+        _context.reset(token)
+
+
+def summarize(trace=None):
+    """
+    Sammanställ mätningarna med pandas.
+
+    :return: dict med DataFrames: per_tab (databastid mot total tid per flik),
+             per_call (per anropare och kommando) och reruns (per körning).
+    """
+    import pandas as pd
+
+    trace = trace or monitor.trace()
+    commands = pd.DataFrame(trace["commands"])
+    spans = pd.DataFrame(trace["spans"])
+    if commands.empty:
+        commands = pd.DataFrame(columns=["command", "collection", "caller", "tab", "rerun",
+                                         "duration_ms", "documents", "reply_bytes"])
+
+    def p50(series):
+        return series.quantile(0.5)
+
+    def p95(series):
+        return series.quantile(0.95)
+
+    def total_bytes(series):
+        # Tomt (NaN) när storleken inte mäts, i stället för 0
+        return series.sum(min_count=1)
+
+    per_call = (commands.groupby(["caller", "command", "collection"], dropna=False)
+                .agg(calls=("duration_ms", "size"), p50_ms=("duration_ms", p50),
+                     p95_ms=("duration_ms", p95), total_ms=("duration_ms", "sum"),
+                     documents=("documents", "sum"), reply_bytes=("reply_bytes", total_bytes))
+                .reset_index().sort_values("total_ms", ascending=False))
+
+    # Databastid per flik och körning, jämförd med flikens totala tid
+    db_per_tab = (commands.groupby(["tab", "rerun"])["duration_ms"]
+                  .agg(["sum", "size"]).rename(columns={"sum": "db_ms", "size": "calls"}).reset_index())
+    if not spans.empty:
+        tab_spans = spans[spans["kind"] == "tab"].rename(columns={"name": "tab", "duration_ms": "total_ms"})
+        per_rerun_tab = tab_spans[["tab", "rerun", "total_ms"]].merge(db_per_tab, on=["tab", "rerun"], how="outer")
+    else:
+        per_rerun_tab = db_per_tab.assign(total_ms=float("nan"))
+    per_rerun_tab[["db_ms", "calls"]] = per_rerun_tab[["db_ms", "calls"]].fillna(0)
+    per_tab = (per_rerun_tab.groupby("tab")
+               .agg(reruns=("rerun", "nunique"), calls=("calls", "sum"),
+                    db_p50_ms=("db_ms", p50), db_p95_ms=("db_ms", p95),
+                    total_p50_ms=("total_ms", p50), total_p95_ms=("total_ms", p95))
+               .reset_index())
+    per_tab["db_share"] = (per_tab["db_p50_ms"] / per_tab["total_p50_ms"]).round(2)
+
+    reruns = (commands.groupby("rerun")["duration_ms"].agg(["sum", "size"])
+              .rename(columns={"sum": "db_ms", "size": "calls"}).reset_index())
+    if not spans.empty:
+        rerun_spans = spans[spans["kind"] == "rerun"][["rerun", "timestamp", "duration_ms"]]
+        reruns = rerun_spans.rename(columns={"duration_ms": "total_ms"}).merge(reruns, on="rerun", how="left")
+        reruns = reruns.sort_values("timestamp", ascending=False)
+
+    return {"per_tab": per_tab, "per_call": per_call, "reruns": reruns}
+
+
+def trace_json():
+    """Hela spårningen som JSON för nedladdning"""
+    return json.dumps(monitor.trace(), default=str, indent=2)
@@ -1,10 +1,14 @@
 from auth import create_user
 from database import get_database
+from migrations import bootstrap_database
 import streamlit as st
 
 def initialize_app():
     """Initialize the application with required setup"""
     db = get_database()
+
+    # Index och schemamigreringar
+    bootstrap_database(db)
     
     # Create admin collection if it doesn't exist
     if 'users' not in db.list_collection_names():
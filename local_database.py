@@ -0,0 +1,993 @@
+"""
+Lokal, inbäddad databasmotor för körning utan nätverk (benchmarks, lasttester, CI).
+
+Motorn efterliknar den delmängd av pymongo:s Database/Collection-API som
+applikationen använder: find/find_one, insert_one/insert_many, update_one/update_many,
+replace_one, delete_one/delete_many, bulk_write, count_documents, distinct,
+find_one_and_update, aggregate och create_index.
+
+Alla dokument hålls i minnet. Med en sökväg speglas varje skrivning till en
+SQLite-fil (en tabell per samling, plus indexdefinitionerna) så att datan och
+unika index överlever omstarter. Unika index hålls som uppslagstabeller, så
+insert/upsert och likhetsfrågor på _id eller ett unikt fält slipper gå igenom
+hela samlingen.
+"""
+import copy
+import datetime
+import functools
+import re
+import sqlite3
+import threading
+
+from bson import ObjectId, json_util
+from pymongo import (DeleteMany, DeleteOne, InsertOne, ReplaceOne, ReturnDocument,
+                     UpdateMany, UpdateOne)
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.results import (BulkWriteResult, DeleteResult, InsertManyResult,
+                             InsertOneResult, UpdateResult)
+
+_MISSING = object()
+
+# SQLite-tabell med indexdefinitionerna (inte en samling)
+_INDEX_TABLE = "__local_indexes__"
+
+# En instans per sökväg, så att st.cache_resource kan återskapa anslutningen utan att tappa data
+_open_databases = {}
+_open_databases_lock = threading.Lock()
+
+
+def open_local_database(path=None, name="planner"):
+    """Return the shared LocalDatabase for a SQLite path (None = memory only)"""
+    key = (path, name)
+    with _open_databases_lock:
+        if key not in _open_databases:
+            _open_databases[key] = LocalDatabase(path=path, name=name)
+        return _open_databases[key]
+
+
+# --- Fält och jämförelser -------------------------------------------------
+
+def _bson_normalize(value):
+    """Store values the way MongoDB returns them: datetimes as naive UTC with millisecond precision"""
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    if isinstance(value, dict):
+        return {key: _bson_normalize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_bson_normalize(item) for item in value]
+    return value
+
+
+def _get_path(document, path):
+    value = document
+    for part in path.split('.'):
+        if isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        elif isinstance(value, list) and part.isdigit():
+            index = int(part)
+            value = value[index] if index < len(value) else _MISSING
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+def _set_path(document, path, value):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+
+def _unset_path(document, path):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(parts[-1], None)
+
+
+# Sorteringsordning mellan typer, ungefär som MongoDB
+def _type_rank(value):
+    if value is None or value is _MISSING:
+        return 0
+    if isinstance(value, bool):
+        return 5
+    if isinstance(value, (int, float)):
+        return 1
+    if isinstance(value, str):
+        return 2
+    if isinstance(value, dict):
+        return 3
+    if isinstance(value, list):
+        return 4
+    if isinstance(value, ObjectId):
+        return 6
+    return 7
+
+
+def _compare(a, b):
+    rank_a, rank_b = _type_rank(a), _type_rank(b)
+    if rank_a != rank_b:
+        return -1 if rank_a < rank_b else 1
+    if rank_a == 0:
+        return 0
+    try:
+        if a < b:
+            return -1
+        if a > b:
+            return 1
+        return 0
+    except TypeError:
+        return 0
+
+
+def _values_equal(a, b):
+    if a is _MISSING:
+        a = None
+    if b is _MISSING:
+        b = None
+    if isinstance(a, bool) != isinstance(b, bool) and a is not None and b is not None:
+        return False
+    return a == b
+
+
+def _unique_value(value):
+    """Hashable form of a field value for unique-index lookups, equal exactly when _values_equal is"""
+    if value is _MISSING:
+        value = None
+    if isinstance(value, (dict, list)):
+        return ('document', json_util.dumps(value, sort_keys=True))
+    return (isinstance(value, bool), value)
+
+
+def _plain_value(condition):
+    """True for an equality condition that can be looked up directly (not an operator, pattern or null)"""
+    if condition is None or isinstance(condition, (dict, list, re.Pattern)):
+        return False
+    return True
+
+
+# --- Filtrering -----------------------------------------------------------
+
+def _match_operator(value, operator, argument):
+    argument = _bson_normalize(argument)
+    candidates = value if isinstance(value, list) else [value]
+
+    if operator == '$eq':
+        return _values_equal(value, argument) or any(_values_equal(v, argument) for v in candidates)
+    if operator == '$ne':
+        return not _match_operator(value, '$eq', argument)
+    if operator == '$in':
+        return any(_match_operator(value, '$eq', item) for item in argument)
+    if operator == '$nin':
+        return not _match_operator(value, '$in', argument)
+    if operator == '$exists':
+        return (value is not _MISSING) == bool(argument)
+    if operator in ('$gt', '$gte', '$lt', '$lte'):
+        for candidate in candidates:
+            if candidate is _MISSING or candidate is None or argument is None:
+                continue
+            if _type_rank(candidate) != _type_rank(argument):
+                continue
+            result = _compare(candidate, argument)
+            if ((operator == '$gt' and result > 0) or (operator == '$gte' and result >= 0)
+                    or (operator == '$lt' and result < 0) or (operator == '$lte' and result <= 0)):
+                return True
+        return False
+    if operator == '$regex':
+        return any(isinstance(v, str) and re.search(argument, v) for v in candidates)
+    if operator == '$type':
+        type_names = {'string': str, 'date': datetime.datetime, 'bool': bool,
+                      'objectId': ObjectId, 'double': float, 'int': int}
+        expected = type_names.get(argument)
+        return expected is not None and isinstance(value, expected)
+    if operator == '$not':
+        return not _match_condition(value, argument)
+    if operator == '$size':
+        return isinstance(value, list) and len(value) == argument
+    raise NotImplementedError(f"Query operator {operator} is not supported by the local engine")
+
+
+def _match_condition(value, condition):
+    if isinstance(condition, dict) and condition and all(k.startswith('$') for k in condition):
+        options = condition.get('$options', '')
+        for operator, argument in condition.items():
+            if operator == '$options':
+                continue
+            if operator == '$regex' and options:
+                flags = re.IGNORECASE if 'i' in options else 0
+                argument = re.compile(argument, flags)
+            if not _match_operator(value, operator, argument):
+                return False
+        return True
+    if isinstance(condition, re.Pattern):
+        return _match_operator(value, '$regex', condition)
+    return _match_operator(value, '$eq', condition)
+
+
+def matches(document, query):
+    """True if the document satisfies a MongoDB-style filter"""
+    for key, condition in (query or {}).items():
+        if key == '$and':
+            if not all(matches(document, sub) for sub in condition):
+                return False
+        elif key == '$or':
+            if not any(matches(document, sub) for sub in condition):
+                return False
+        elif key == '$nor':
+            if any(matches(document, sub) for sub in condition):
+                return False
+        elif key == '$expr':
+            if not _evaluate(condition, document):
+                return False
+        elif not _match_condition(_get_path(document, key), condition):
+            return False
+    return True
+
+
+# --- Projektion och sortering --------------------------------------------
+
+def _project(document, projection):
+    if not projection:
+        return document
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+
+    include_id = projection.get('_id', 1)
+    fields = {k: v for k, v in projection.items() if k != '_id'}
+    inclusive = any(v for v in fields.values() if not isinstance(v, dict)) or any(
+        isinstance(v, (dict, str)) for v in fields.values())
+
+    if inclusive:
+        result = {}
+        for field, spec in fields.items():
+            if isinstance(spec, (dict, str)) and not isinstance(spec, bool):
+                result[field] = _evaluate(spec, document)
+            elif spec:
+                value = _get_path(document, field)
+                if value is not _MISSING:
+                    _set_path(result, field, value)
+        if include_id and '_id' in document:
+            result['_id'] = document['_id']
+        return result
+
+    result = copy.copy(document)
+    for field in fields:
+        _unset_path(result, field)
+    if not include_id:
+        result.pop('_id', None)
+    return result
+
+
+def _normalize_sort(key_or_list, direction=None):
+    if key_or_list is None:
+        return []
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return list(key_or_list)
+
+
+def _sort_documents(documents, sort_spec):
+    def compare(a, b):
+        for field, direction in sort_spec:
+            result = _compare(_get_path(a, field), _get_path(b, field))
+            if result:
+                return result * (1 if direction >= 0 else -1)
+        return 0
+    return sorted(documents, key=functools.cmp_to_key(compare))
+
+
+# --- Aggregeringsuttryck --------------------------------------------------
+
+def _evaluate(expression, document, variables=None):
+    if isinstance(expression, str):
+        if expression.startswith('$$'):
+            name, _, rest = expression[2:].partition('.')
+            base = document if name in ('ROOT', 'CURRENT') else (variables or {}).get(name)
+            if rest:
+                value = _get_path(base, rest) if isinstance(base, dict) else _MISSING
+                return None if value is _MISSING else value
+            return base
+        if expression.startswith('$'):
+            value = _get_path(document, expression[1:])
+            return None if value is _MISSING else value
+        return expression
+    if isinstance(expression, list):
+        return [_evaluate(item, document, variables) for item in expression]
+    if not isinstance(expression, dict):
+        return expression
+    if len(expression) != 1 or not next(iter(expression)).startswith('$'):
+        return {key: _evaluate(value, document, variables) for key, value in expression.items()}
+
+    operator, argument = next(iter(expression.items()))
+    if operator == '$literal':
+        return argument
+
+    def args():
+        values = argument if isinstance(argument, list) else [argument]
+        return [_evaluate(value, document, variables) for value in values]
+
+    if operator == '$cond':
+        if isinstance(argument, dict):
+            condition, then, otherwise = argument['if'], argument['then'], argument['else']
+        else:
+            condition, then, otherwise = argument
+        branch = then if _evaluate(condition, document, variables) else otherwise
+        return _evaluate(branch, document, variables)
+    if operator == '$ifNull':
+        for value in args():
+            if value is not None:
+                return value
+        return None
+    if operator in ('$sum', '$add'):
+        values = args()
+        if len(values) == 1 and isinstance(values[0], list):
+            values = values[0]
+        return sum(v for v in values if isinstance(v, (int, float)) and not isinstance(v, bool))
+    if operator == '$subtract':
+        a, b = args()
+        return None if a is None or b is None else a - b
+    if operator == '$multiply':
+        result = 1
+        for value in args():
+            if value is None:
+                return None
+            result *= value
+        return result
+    if operator == '$divide':
+        a, b = args()
+        return None if a is None or not b else a / b
+    if operator in ('$eq', '$ne', '$gt', '$gte', '$lt', '$lte'):
+        a, b = args()
+        result = _compare(a, b)
+        return {'$eq': result == 0 and _values_equal(a, b), '$ne': not _values_equal(a, b),
+                '$gt': result > 0, '$gte': result >= 0, '$lt': result < 0, '$lte': result <= 0}[operator]
+    if operator == '$and':
+        return all(args())
+    if operator == '$or':
+        return any(args())
+    if operator == '$not':
+        return not args()[0]
+    if operator == '$in':
+        value, values = args()
+        return value in (values or [])
+    if operator in ('$substr', '$substrCP', '$substrBytes'):
+        value, start, length = args()
+        if value is None:
+            return ''
+        value = value.isoformat() if hasattr(value, 'isoformat') else str(value)
+        return value[start:start + length] if length >= 0 else value[start:]
+    if operator == '$toString':
+        value = args()[0]
+        return None if value is None else str(value)
+    if operator == '$size':
+        value = args()[0]
+        return len(value) if isinstance(value, list) else 0
+    if operator == '$split':
+        value, delimiter = args()
+        return value.split(delimiter) if isinstance(value, str) else None
+    if operator == '$dateToString':
+        value = _evaluate(argument['date'], document, variables)
+        if value is None:
+            return None
+        fmt = argument.get('format', '%Y-%m-%dT%H:%M:%S.%LZ').replace('%L', '000')
+        return value.strftime(fmt)
+    raise NotImplementedError(f"Expression operator {operator} is not supported by the local engine")
+
+
+def _accumulate(operator, values):
+    numeric = [v for v in values if isinstance(v, (int, float)) and not isinstance(v, bool)]
+    if operator == '$sum':
+        return sum(numeric)
+    if operator == '$avg':
+        return sum(numeric) / len(numeric) if numeric else None
+    if operator == '$min':
+        present = [v for v in values if v is not None]
+        return min(present, key=functools.cmp_to_key(_compare)) if present else None
+    if operator == '$max':
+        present = [v for v in values if v is not None]
+        return max(present, key=functools.cmp_to_key(_compare)) if present else None
+    if operator == '$push':
+        return list(values)
+    if operator == '$addToSet':
+        result = []
+        for value in values:
+            if value not in result:
+                result.append(value)
+        return result
+    if operator == '$first':
+        return values[0] if values else None
+    if operator == '$last':
+        return values[-1] if values else None
+    raise NotImplementedError(f"Accumulator {operator} is not supported by the local engine")
+
+
+def _group(documents, spec):
+    groups = {}
+    order = []
+    for document in documents:
+        key = _evaluate(spec['_id'], document)
+        hashable = json_util.dumps(key, sort_keys=True) if isinstance(key, (dict, list)) else key
+        if hashable not in groups:
+            groups[hashable] = (key, [])
+            order.append(hashable)
+        groups[hashable][1].append(document)
+
+    results = []
+    for hashable in order:
+        key, members = groups[hashable]
+        result = {'_id': key}
+        for field, accumulator in spec.items():
+            if field == '_id':
+                continue
+            operator, expression = next(iter(accumulator.items()))
+            values = [_evaluate(expression, member) for member in members]
+            result[field] = _accumulate(operator, values)
+        results.append(result)
+    return results
+
+
+def run_pipeline(documents, pipeline):
+    """Run an aggregation pipeline over in-memory documents"""
+    for stage in pipeline:
+        name, spec = next(iter(stage.items()))
+        if name == '$match':
+            documents = [d for d in documents if matches(d, spec)]
+        elif name == '$project':
+            documents = [_project(d, spec) for d in documents]
+        elif name in ('$addFields', '$set'):
+            updated = []
+            for document in documents:
+                document = copy.copy(document)
+                for field, expression in spec.items():
+                    _set_path(document, field, _evaluate(expression, document))
+                updated.append(document)
+            documents = updated
+        elif name == '$unset':
+            fields = [spec] if isinstance(spec, str) else spec
+            documents = [_project(d, {field: 0 for field in fields}) for d in documents]
+        elif name == '$group':
+            documents = _group(documents, spec)
+        elif name == '$sort':
+            documents = _sort_documents(documents, _normalize_sort(spec))
+        elif name == '$limit':
+            documents = documents[:spec]
+        elif name == '$skip':
+            documents = documents[spec:]
+        elif name == '$count':
+            documents = [{spec: len(documents)}] if documents else []
+        elif name == '$unwind':
+            path = spec if isinstance(spec, str) else spec['path']
+            field = path[1:]
+            unwound = []
+            for document in documents:
+                value = _get_path(document, field)
+                if isinstance(value, list):
+                    for item in value:
+                        copied = copy.copy(document)
+                        _set_path(copied, field, item)
+                        unwound.append(copied)
+                elif value is not _MISSING and value is not None:
+                    unwound.append(document)
+            documents = unwound
+        elif name == '$facet':
+            documents = [{field: run_pipeline(list(documents), sub_pipeline)
+                          for field, sub_pipeline in spec.items()}]
+        elif name == '$replaceRoot':
+            documents = [_evaluate(spec['newRoot'], d) for d in documents]
+        else:
+            raise NotImplementedError(f"Pipeline stage {name} is not supported by the local engine")
+    return documents
+
+
+# --- Uppdateringar --------------------------------------------------------
+
+def _apply_update(document, update, inserting=False):
+    if not any(key.startswith('$') for key in update):
+        replacement = copy.deepcopy(update)
+        if '_id' in document:
+            replacement['_id'] = document['_id']
+        document.clear()
+        document.update(replacement)
+        return
+
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            if operator == '$set':
+                _set_path(document, path, copy.deepcopy(value))
+            elif operator == '$setOnInsert':
+                if inserting:
+                    _set_path(document, path, copy.deepcopy(value))
+            elif operator == '$unset':
+                _unset_path(document, path)
+            elif operator == '$inc':
+                current = _get_path(document, path)
+                _set_path(document, path, (0 if current in (_MISSING, None) else current) + value)
+            elif operator == '$max':
+                current = _get_path(document, path)
+                if current is _MISSING or _compare(value, current) > 0:
+                    _set_path(document, path, value)
+            elif operator == '$min':
+                current = _get_path(document, path)
+                if current is _MISSING or _compare(value, current) < 0:
+                    _set_path(document, path, value)
+            elif operator == '$push':
+                current = _get_path(document, path)
+                items = value['$each'] if isinstance(value, dict) and '$each' in value else [value]
+                _set_path(document, path, (current if isinstance(current, list) else []) + list(items))
+            elif operator == '$pull':
+                current = _get_path(document, path)
+                if isinstance(current, list):
+                    _set_path(document, path, [item for item in current if not _values_equal(item, value)])
+            else:
+                raise NotImplementedError(f"Update operator {operator} is not supported by the local engine")
+
+
+def _upsert_seed(query):
+    seed = {}
+    for key, condition in (query or {}).items():
+        if key.startswith('$'):
+            continue
+        if isinstance(condition, dict) and any(k.startswith('$') for k in condition):
+            if '$eq' in condition:
+                _set_path(seed, key, condition['$eq'])
+            continue
+        _set_path(seed, key, copy.deepcopy(condition))
+    return seed
+
+
+def _bulk_op_document(request):
+    """Operationen i samma form som servern rapporterar den i writeErrors['op']."""
+    if isinstance(request, InsertOne):
+        return request._doc
+    if isinstance(request, (DeleteOne, DeleteMany)):
+        return {'q': request._filter, 'limit': 0 if isinstance(request, DeleteMany) else 1}
+    return {'q': request._filter, 'u': request._doc, 'multi': isinstance(request, UpdateMany),
+            'upsert': bool(request._upsert)}
+
+
+# --- Markör, samling och databas ------------------------------------------
+
+
+class LocalCursor:
+    """Minimal stand-in for pymongo's Cursor"""
+
+    def __init__(self, collection, query, projection):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def _documents(self):
+        documents = self._collection._matching(self._query)
+        if self._sort:
+            documents = _sort_documents(documents, self._sort)
+        documents = documents[self._skip:]
+        if self._limit:
+            documents = documents[:self._limit]
+        return [copy.deepcopy(_project(d, self._projection)) for d in documents]
+
+    def __iter__(self):
+        return iter(self._documents())
+
+    def to_list(self, length=None):
+        documents = self._documents()
+        return documents[:length] if length else documents
+
+
+class LocalCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self._documents = {}
+        self._indexes = {'_id_': {'key': [('_id', 1)], 'unique': True}}
+        # Unika index (utom _id_) som {indexnamn: {fältvärden: dokumentnyckel}}
+        self._unique = {}
+
+    # Intern hjälp
+    def _candidates(self, query):
+        """Documents that can match the query: looked up on _id or a unique field when possible"""
+        query = query or {}
+        if _plain_value(query.get('_id')):
+            document = self._documents.get(self._key(query['_id']))
+            return [document] if document is not None else []
+        for name, lookup in self._unique.items():
+            index = self._indexes[name]
+            fields = [field for field, _ in index['key']]
+            if index.get('partialFilterExpression') is None and all(_plain_value(query.get(f)) for f in fields):
+                key = lookup.get(tuple(_unique_value(query[f]) for f in fields))
+                return [self._documents[key]] if key is not None else []
+        return list(self._documents.values())
+
+    def _matching(self, query):
+        with self.database._lock:
+            return [d for d in self._candidates(query) if matches(d, query)]
+
+    def _key(self, document_id):
+        return json_util.dumps(document_id)
+
+    @staticmethod
+    def _index_covers(index, document):
+        """Sparse och partiella index gäller bara dokument som har fälten / matchar filtret"""
+        if index.get('sparse') and all(_get_path(document, field) is _MISSING for field, _ in index['key']):
+            return False
+        partial = index.get('partialFilterExpression')
+        return partial is None or matches(document, partial)
+
+    def _unique_entries(self, document):
+        """(indexnamn, fältvärden) för de unika index som omfattar dokumentet"""
+        entries = []
+        for name in self._unique:
+            index = self._indexes[name]
+            if self._index_covers(index, document):
+                entries.append((name, tuple(_unique_value(_get_path(document, field))
+                                            for field, _ in index['key'])))
+        return entries
+
+    def _check_unique(self, document, ignore_key=None):
+        for name, values in self._unique_entries(document):
+            existing = self._unique[name].get(values)
+            if existing is not None and existing != ignore_key:
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {name}")
+
+    def _unindex(self, key):
+        document = self._documents.get(key)
+        if document is None:
+            return
+        for name, values in self._unique_entries(document):
+            if self._unique[name].get(values) == key:
+                del self._unique[name][values]
+
+    def _build_unique(self, name):
+        """Fill the lookup table for a unique index from the stored documents"""
+        lookup = {}
+        self._unique[name] = lookup
+        index = self._indexes[name]
+        for key, document in self._documents.items():
+            if not self._index_covers(index, document):
+                continue
+            values = tuple(_unique_value(_get_path(document, field)) for field, _ in index['key'])
+            if values in lookup:
+                del self._unique[name]
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {name}")
+            lookup[values] = key
+
+    def _store(self, document, previous_key=None):
+        document = _bson_normalize(document)
+        key = self._key(document['_id'])
+        if previous_key is None and key in self._documents:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_")
+        self._check_unique(document, ignore_key=previous_key or key)
+        self._unindex(previous_key or key)
+        self._documents[key] = document
+        for name, values in self._unique_entries(document):
+            self._unique[name][values] = key
+        self.database._persist(self.name, key, document)
+
+    # Läsning
+    def find(self, filter=None, projection=None, sort=None, limit=0, skip=0, **kwargs):
+        cursor = LocalCursor(self, filter or {}, projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    def find_one(self, filter=None, projection=None, sort=None, **kwargs):
+        for document in self.find(filter, projection, sort=sort, limit=1):
+            return document
+        return None
+
+    def count_documents(self, filter=None, **kwargs):
+        return len(self._matching(filter or {}))
+
+    def estimated_document_count(self, **kwargs):
+        return len(self._documents)
+
+    def distinct(self, key, filter=None):
+        values = []
+        for document in self._matching(filter or {}):
+            value = _get_path(document, key)
+            for item in (value if isinstance(value, list) else [value]):
+                if item is not _MISSING and item not in values:
+                    values.append(item)
+        return values
+
+    def aggregate(self, pipeline, **kwargs):
+        documents = [copy.deepcopy(d) for d in self._matching({})]
+        return iter(run_pipeline(documents, pipeline))
+
+    # Skrivning
+    def insert_one(self, document, **kwargs):
+        with self.database._lock:
+            if '_id' not in document:
+                document['_id'] = ObjectId()
+            self._store(copy.deepcopy(document))
+        return InsertOneResult(document['_id'], True)
+
+    def insert_many(self, documents, ordered=True, **kwargs):
+        # Som pymongo: dubbletter rapporteras som BulkWriteError, och med ordered=False
+        # skrivs resten av dokumenten ändå
+        inserted = []
+        errors = []
+        for index, document in enumerate(documents):
+            try:
+                inserted.append(self.insert_one(document).inserted_id)
+            except DuplicateKeyError as e:
+                errors.append({'index': index, 'code': 11000, 'errmsg': str(e), 'op': document})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'writeConcernErrors': [], 'nInserted': len(inserted),
+                                  'nUpserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0,
+                                  'upserted': []})
+        return InsertManyResult(inserted, True)
+
+    def _update(self, filter, update, upsert, many):
+        with self.database._lock:
+            targets = self._matching(filter)
+            if not many:
+                targets = targets[:1]
+            modified = 0
+            for document in targets:
+                key = self._key(document['_id'])
+                updated = copy.deepcopy(document)
+                _apply_update(updated, update)
+                if updated != document:
+                    self._store(updated, previous_key=key)
+                    modified += 1
+            raw = {'n': len(targets), 'nModified': modified, 'ok': 1.0}
+            if not targets and upsert:
+                document = _upsert_seed(filter)
+                _apply_update(document, update, inserting=True)
+                document.setdefault('_id', ObjectId())
+                self._store(document)
+                raw.update({'n': 1, 'upserted': document['_id']})
+            return UpdateResult(raw, True)
+
+    def update_one(self, filter, update, upsert=False, **kwargs):
+        return self._update(filter, update, upsert, many=False)
+
+    def update_many(self, filter, update, upsert=False, **kwargs):
+        return self._update(filter, update, upsert, many=True)
+
+    def replace_one(self, filter, replacement, upsert=False, **kwargs):
+        return self._update(filter, replacement, upsert, many=False)
+
+    def find_one_and_update(self, filter, update, projection=None, upsert=False,
+                            return_document=ReturnDocument.BEFORE, **kwargs):
+        with self.database._lock:
+            before = self.find_one(filter)
+            result = self._update(filter, update, upsert, many=False)
+            if return_document == ReturnDocument.AFTER:
+                document_id = before['_id'] if before else result.upserted_id
+                return self.find_one({'_id': document_id}, projection)
+            return _project(before, projection) if before else None
+
+    def _delete(self, filter, many):
+        with self.database._lock:
+            targets = self._matching(filter)
+            if not many:
+                targets = targets[:1]
+            for document in targets:
+                key = self._key(document['_id'])
+                self._unindex(key)
+                del self._documents[key]
+                self.database._unpersist(self.name, key)
+            return DeleteResult({'n': len(targets), 'ok': 1.0}, True)
+
+    def delete_one(self, filter, **kwargs):
+        return self._delete(filter, many=False)
+
+    def delete_many(self, filter, **kwargs):
+        return self._delete(filter, many=True)
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        # Som pymongo: fel per operation samlas i writeErrors och rapporteras som
+        # BulkWriteError efteråt; med ordered=True stannar körningen vid första felet
+        counts = {'nInserted': 0, 'nUpserted': 0, 'nMatched': 0, 'nModified': 0,
+                  'nRemoved': 0, 'upserted': [], 'writeErrors': [], 'writeConcernErrors': []}
+        with self.database._lock:
+            for index, request in enumerate(requests):
+                try:
+                    self._bulk_operation(index, request, counts)
+                except DuplicateKeyError as e:
+                    counts['writeErrors'].append({'index': index, 'code': 11000, 'errmsg': str(e),
+                                                  'op': _bulk_op_document(request)})
+                    if ordered:
+                        break
+        if counts['writeErrors']:
+            raise BulkWriteError(counts)
+        return BulkWriteResult(counts, True)
+
+    def _bulk_operation(self, index, request, counts):
+        if isinstance(request, InsertOne):
+            self.insert_one(request._doc)
+            counts['nInserted'] += 1
+            return
+        if isinstance(request, (DeleteOne, DeleteMany)):
+            result = self._delete(request._filter, many=isinstance(request, DeleteMany))
+            counts['nRemoved'] += result.deleted_count
+            return
+        if isinstance(request, (ReplaceOne, UpdateOne, UpdateMany)):
+            result = self._update(request._filter, request._doc, request._upsert,
+                                  many=isinstance(request, UpdateMany))
+            if result.upserted_id is not None:
+                counts['nUpserted'] += 1
+                counts['upserted'].append({'index': index, '_id': result.upserted_id})
+            else:
+                counts['nMatched'] += result.matched_count
+                counts['nModified'] += result.modified_count
+            return
+        raise NotImplementedError(f"Bulk operation {type(request).__name__} is not supported")
+
+    # Index
+    def create_index(self, keys, **kwargs):
+        keys = _normalize_sort(keys, 1)
+        name = kwargs.get('name') or '_'.join(f"{field}_{direction}" for field, direction in keys)
+        with self.database._lock:
+            index = {'key': keys}
+            index.update({k: v for k, v in kwargs.items() if k != 'name'})
+            previous = self._indexes.get(name)
+            self._indexes[name] = index
+            if index.get('unique'):
+                try:
+                    self._build_unique(name)
+                except DuplicateKeyError:
+                    self._restore_index(name, previous)
+                    raise
+            else:
+                self._unique.pop(name, None)
+            self.database._persist_index(self.name, name, index)
+        return name
+
+    def _restore_index(self, name, previous):
+        if previous is None:
+            self._indexes.pop(name, None)
+        else:
+            self._indexes[name] = previous
+            if previous.get('unique'):
+                self._build_unique(name)
+
+    def create_indexes(self, indexes, **kwargs):
+        return [self.create_index(index.document['key'], **{k: v for k, v in index.document.items()
+                                                              if k != 'key'}) for index in indexes]
+
+    def index_information(self):
+        return copy.deepcopy(self._indexes)
+
+    def drop_index(self, name, **kwargs):
+        with self.database._lock:
+            self._indexes.pop(name, None)
+            self._unique.pop(name, None)
+            self.database._unpersist_index(self.name, name)
+
+    def drop(self):
+        self.delete_many({})
+
+
+class LocalDatabase:
+    """In-process database with optional SQLite persistence"""
+
+    def __init__(self, path=None, name="planner"):
+        self.name = name
+        self.path = path
+        self._lock = threading.RLock()
+        self._collections = {}
+        self._connection = None
+        if path:
+            self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._load_from_disk()
+
+    def _table(self, collection_name):
+        return '"' + collection_name.replace('"', '""') + '"'
+
+    def _load_from_disk(self):
+        self._connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {self._table(_INDEX_TABLE)} "
+            "(collection TEXT, name TEXT, spec TEXT, PRIMARY KEY (collection, name))")
+        tables = self._connection.execute(
+            "SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+        for (table_name,) in tables:
+            if table_name == _INDEX_TABLE:
+                continue
+            collection = self[table_name]
+            for key, payload in self._connection.execute(f"SELECT id, doc FROM {self._table(table_name)}"):
+                collection._documents[key] = json_util.loads(payload)
+
+        # Index läses efter dokumenten, så att de unika uppslagstabellerna byggs från datan
+        for collection_name, name, spec in self._connection.execute(
+                f"SELECT collection, name, spec FROM {self._table(_INDEX_TABLE)}").fetchall():
+            collection = self[collection_name]
+            index = json_util.loads(spec)
+            index['key'] = [tuple(pair) for pair in index['key']]
+            collection._indexes[name] = index
+            if index.get('unique'):
+                collection._build_unique(name)
+
+    def _ensure_table(self, collection_name):
+        if self._connection is not None:
+            self._connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._table(collection_name)} (id TEXT PRIMARY KEY, doc TEXT)")
+
+    def _persist(self, collection_name, key, document):
+        if self._connection is not None:
+            self._connection.execute(
+                f"INSERT OR REPLACE INTO {self._table(collection_name)} (id, doc) VALUES (?, ?)",
+                (key, json_util.dumps(document)))
+
+    def _unpersist(self, collection_name, key):
+        if self._connection is not None:
+            self._connection.execute(f"DELETE FROM {self._table(collection_name)} WHERE id = ?", (key,))
+
+    def _persist_index(self, collection_name, name, index):
+        if self._connection is not None:
+            self._connection.execute(
+                f"INSERT OR REPLACE INTO {self._table(_INDEX_TABLE)} (collection, name, spec) VALUES (?, ?, ?)",
+                (collection_name, name, json_util.dumps(index)))
+
+    def _unpersist_index(self, collection_name, name=None):
+        if self._connection is not None:
+            if name is None:
+                self._connection.execute(f"DELETE FROM {self._table(_INDEX_TABLE)} WHERE collection = ?",
+                                         (collection_name,))
+            else:
+                self._connection.execute(
+                    f"DELETE FROM {self._table(_INDEX_TABLE)} WHERE collection = ? AND name = ?",
+                    (collection_name, name))
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = LocalCollection(self, name)
+                self._ensure_table(name)
+            return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name, **kwargs):
+        return self[name]
+
+    def list_collection_names(self, **kwargs):
+        return list(self._collections.keys())
+
+    def create_collection(self, name, **kwargs):
+        return self[name]
+
+    def drop_collection(self, name):
+        with self._lock:
+            collection = self._collections.pop(name, None)
+            if collection is not None and self._connection is not None:
+                self._connection.execute(f"DROP TABLE IF EXISTS {self._table(name)}")
+                self._unpersist_index(name)
+
+    def command(self, command, *args, **kwargs):
+        if command in ('ping', {'ping': 1}):
+            return {'ok': 1.0}
+        raise NotImplementedError(f"Command {command} is not supported by the local engine")
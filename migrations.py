@@ -0,0 +1,180 @@
+"""
+Index och schemamigreringar för databasen.
+
+bootstrap_database() körs vid uppstart (initialize_app, Main och loggtråden) och
+kan köras hur många gånger som helst: index skapas bara när de saknas eller har
+ändrats, och migreringar som redan finns i samlingen 'schema_migrations' hoppas över.
+Nya index läggs till i INDEXES och nya migreringar sist i MIGRATIONS.
+"""
+import threading
+
+import pymongo
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from Data import utc_now, bump_data_version, ROW_ID_COLUMN
+
+MIGRATIONS_COLLECTION = "schema_migrations"
+
+# Index per samling: (nycklar, namn, extra alternativ)
+INDEXES = {
+    "users": [
+        ([("username", pymongo.ASCENDING)], "username_unique", {"unique": True}),
+        ([("role", pymongo.ASCENDING)], "role_1", {}),
+    ],
+    "goals": [
+        ([(ROW_ID_COLUMN, pymongo.ASCENDING)], "row_id_unique",
+         {"unique": True, "partialFilterExpression": {ROW_ID_COLUMN: {"$type": "string"}}}),
+        ([("Type", pymongo.ASCENDING), ("Goal_Name", pymongo.ASCENDING), ("Task_Name", pymongo.ASCENDING)],
+         "type_goal_task", {}),
+    ],
+    "risks": [
+        ([("goal", pymongo.ASCENDING), ("task", pymongo.ASCENDING)], "goal_task", {}),
+    ],
+    "bugs": [
+        ([("status", pymongo.ASCENDING)], "status_1", {}),
+    ],
+    "history": [
+        ([("Archive_Year", pymongo.ASCENDING)], "archive_year", {}),
+    ],
+    "complexity_scores": [
+        ([("source", pymongo.ASCENDING), (ROW_ID_COLUMN, pymongo.ASCENDING)], "source_row_id", {}),
+    ],
+    "sessions": [
+        # Sessioner tas bort av TTL-indexet när de gått ut
+        ([("expires_at", pymongo.ASCENDING)], "expires_at_ttl", {"expireAfterSeconds": 0}),
+        ([("username", pymongo.ASCENDING)], "username_1", {}),
+    ],
+    "logs": [
+        ([("action", pymongo.ASCENDING), ("timestamp", pymongo.DESCENDING)], "action_timestamp", {}),
+        ([("username", pymongo.ASCENDING), ("timestamp", pymongo.DESCENDING)], "username_timestamp", {}),
+    ],
+}
+
+# Index som tidigare skapades automatiskt med standardnamn och nu har ersatts
+_REPLACED_INDEXES = {
+    "logs": ["action_1_timestamp_-1", "username_1_timestamp_-1"],
+}
+
+
+def _index_matches(existing, keys, options):
+    """Jämför ett befintligt index (från index_information) med deklarationen"""
+    if [tuple(key) for key in existing.get("key", [])] != [tuple(key) for key in keys]:
+        return False
+    return all(existing.get(option) == value for option, value in options.items())
+
+
+def ensure_indexes(db):
+    """
+    Skapar alla index i INDEXES. Ett index med samma namn men andra nycklar eller
+    alternativ byggs om. Misslyckade index (t.ex. dubbletter i users) skrivs ut
+    och hoppas över så att appen ändå startar.
+
+    :return: Antal index som skapades eller byggdes om.
+    """
+    created = 0
+    for collection, indexes in INDEXES.items():
+        existing = db[collection].index_information()
+        for name in _REPLACED_INDEXES.get(collection, []):
+            if name in existing:
+                db[collection].drop_index(name)
+        for keys, name, options in indexes:
+            current = existing.get(name)
+            if current is not None and _index_matches(current, keys, options):
+                continue
+            try:
+                if current is not None:
+                    print(f"Rebuilding index {collection}.{name}")
+                    db[collection].drop_index(name)
+                db[collection].create_index(keys, name=name, **options)
+                created += 1
+            except (DuplicateKeyError, OperationFailure) as e:
+                print(f"Could not create index {collection}.{name}: {e}")
+
+    # Lagringstiden för loggar styrs av konfigurationen (TTL-index på timestamp)
+    from custom_logging import ensure_log_retention
+    ensure_log_retention(db)
+    return created
+
+
+def backfill_goal_row_ids(db):
+    """Ge alla mål/uppgifter som sparades innan Row_Id fanns ett stabilt id"""
+    from Data import _backfill_row_ids
+    missing = list(db.goals.find({"$or": [{ROW_ID_COLUMN: {"$exists": False}},
+                                          {ROW_ID_COLUMN: None}, {ROW_ID_COLUMN: ""}]}))
+    _backfill_row_ids(db, missing)
+    if missing:
+        bump_data_version(db, plan_changed=True)
+    return len(missing)
+
+
+def migrate_log_timestamps(db):
+    """Konvertera tidsstämplar sparade som text till UTC-datum"""
+    from custom_logging import migrate_string_timestamps
+    return migrate_string_timestamps(db)
+
+
+def build_plan_rollups(db):
+    """Bygg månadssummorna i plan_rollups för planer sparade innan samlingen fanns"""
+    from plan_rollups import rebuild_plan_rollups
+    return rebuild_plan_rollups(db)
+
+
+# Körs i ordning, en gång per databas. Byt aldrig namn på en redan körd migrering.
+MIGRATIONS = [
+    ("0001_goal_row_ids", backfill_goal_row_ids),
+    ("0002_utc_timestamps", migrate_log_timestamps),
+    ("0003_plan_rollups", build_plan_rollups),
+]
+
+
+def apply_migrations(db):
+    """
+    Kör migreringar som inte finns i schema_migrations och registrerar dem.
+
+    :return: Lista med namnen på migreringarna som kördes.
+    """
+    applied = {document["_id"] for document in db[MIGRATIONS_COLLECTION].find({}, {"_id": 1})}
+    ran = []
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+        print(f"Running migration {name}")
+        result = migration(db)
+        db[MIGRATIONS_COLLECTION].update_one(
+            {"_id": name},
+            {"$set": {"applied_at": utc_now(), "result": result}},
+            upsert=True
+        )
+        ran.append(name)
+    return ran
+
+
+_bootstrap_lock = threading.Lock()
+_bootstrapped = set()
+
+
+def bootstrap_database(db=None):
+    """
+    Kör migreringar och skapar index. Görs en gång per databas och process;
+    senare anrop returnerar direkt.
+
+    :return: True om databasen är uppsatt.
+    """
+    from database import get_database, is_degraded
+    if db is None:
+        db = get_database()
+    if is_degraded():
+        # Försök igen vid nästa anrop när anslutningen är tillbaka
+        return False
+
+    with _bootstrap_lock:
+        if id(db) in _bootstrapped:
+            return True
+        try:
+            apply_migrations(db)
+            ensure_indexes(db)
+            _bootstrapped.add(id(db))
+            return True
+        except Exception as e:
+            print(f"Error bootstrapping database: {e}")
+            return False
@@ -0,0 +1,199 @@
+"""
+Materialiserade summor av planen per månad och mål.
+
+Samlingen 'plan_rollups' har ett dokument per (startmånad, mål) med uppskattad
+kostnad, hyreskostnad, timmar, personaltimmar och antal uppgifter. Den hålls
+aktuell av save_data: för varje (månad, mål) som en ändrad rad hörde till före
+eller efter ändringen räknas summan om från planen och skrivs med $set, så att
+operationerna tål att spelas upp igen från write_journal. Alla ändringar från
+add_task, update_dataframe och redigeringarna i planeringen går den vägen.
+
+Summorna räknas från sessionens plan, så de kan glida isär om en session sparar
+ovanpå rader som en annan session redan har ändrat. verify_plan_rollups() jämför samlingen
+med planen och rebuild_plan_rollups() bygger om den:
+
+    python plan_rollups.py verify
+    python plan_rollups.py rebuild
+"""
+import argparse
+import json
+import sys
+
+import numpy as np
+import pandas as pd
+
+from Data import ROW_ID_COLUMN
+
+ROLLUPS_COLLECTION = "plan_rollups"
+
+MEASURES = ['Task_Estimated_Cost', 'Task_Total_Rental_Cost', 'Task_Estimated_Time', 'Personnel_Hours', 'Tasks']
+KEYS = ['month', 'goal']
+
+# Avvikelser mindre än så här räknas som avrundning i flyttalssummorna
+_TOLERANCE = 1e-6
+
+
+def rollup_id(month, goal):
+    """Dokument-id för en månad och ett mål (tom sträng när startdatum eller mål saknas)"""
+    return json.dumps([month, goal], ensure_ascii=False)
+
+
+def contributions(df):
+    """
+    Varje uppgifts bidrag till summorna, indexerat på Row_Id.
+
+    :param df: Planen typad enligt PLAN_SCHEMA.
+    :return: DataFrame med month, goal och MEASURES, en rad per uppgift.
+    """
+    tasks = df[df['Type'] == 'Task']
+    hours = tasks['Task_Estimated_Time'].astype('float64')
+    result = pd.DataFrame({
+        'month': tasks['Task_Start_Date'].dt.strftime('%Y-%m').fillna(''),
+        'goal': tasks['Goal_Name'].astype(object).fillna(''),
+        'Task_Estimated_Cost': tasks['Task_Estimated_Cost'].astype('float64').fillna(0),
+        'Task_Total_Rental_Cost': tasks['Task_Total_Rental_Cost'].astype('float64').fillna(0),
+        'Task_Estimated_Time': hours.fillna(0),
+        'Personnel_Hours': (hours * tasks['Task_Personnel_Count'].astype('float64')).fillna(0),
+        'Tasks': 1,
+    })
+    result.index = tasks[ROW_ID_COLUMN].astype(object).to_numpy()
+    return result
+
+
+def _stored(measure, value):
+    # Antal uppgifter sparas som heltal, summorna som flyttal
+    return int(round(value)) if measure == 'Tasks' else float(value)
+
+
+def _totals(rows):
+    return rows.groupby(KEYS)[MEASURES].sum()
+
+
+def _rollup_fields(month, goal, values):
+    fields = {'month': month, 'goal': goal}
+    fields.update({measure: _stored(measure, values[measure]) for measure in MEASURES})
+    return fields
+
+
+def affected_keys(old, new, row_ids):
+    """
+    (månad, mål) som de ändrade raderna hörde till före eller efter ändringen.
+
+    :param old: contributions() för planen som den såg ut vid senaste laddning/sparning.
+    :param new: contributions() för planen som sparas.
+    :param row_ids: Row_Id för rader som lagts till, ändrats eller tagits bort.
+    """
+    row_ids = list(row_ids)
+    rows = pd.concat([old[old.index.isin(row_ids)], new[new.index.isin(row_ids)]])
+    return set(zip(rows['month'], rows['goal']))
+
+
+def rollup_operations(new, keys):
+    """
+    Omräknade summor för de påverkade månaderna/målen. Varje dokument skrivs med $set
+    (eller tas bort när inga uppgifter finns kvar), så operationerna kan köras om.
+
+    :param new: contributions() för planen som sparas.
+    :param keys: (månad, mål) att räkna om, se affected_keys().
+    :return: Lista med pymongo-operationer (tom om inga nycklar påverkas).
+    """
+    from pymongo import UpdateOne, DeleteOne
+
+    keys = sorted(keys)
+    if not keys:
+        return []
+    in_keys = pd.MultiIndex.from_arrays([new['month'], new['goal']]).isin(keys)
+    totals = _totals(new[in_keys])
+
+    operations = []
+    for month, goal in keys:
+        if (month, goal) in totals.index:
+            operations.append(UpdateOne({'_id': rollup_id(month, goal)},
+                                        {'$set': _rollup_fields(month, goal, totals.loc[(month, goal)])},
+                                        upsert=True))
+        else:
+            # Månaden/målet har inga uppgifter kvar
+            operations.append(DeleteOne({'_id': rollup_id(month, goal)}))
+    return operations
+
+
+def expected_rollups(df):
+    """Summorna räknade direkt från planen, i samma form som read_rollups()"""
+    return _totals(contributions(df)).reset_index()
+
+
+def read_rollups(db=None):
+    """Samlingen plan_rollups som DataFrame (month, goal, MEASURES)"""
+    if db is None:
+        from database import get_database
+        db = get_database()
+    documents = list(db[ROLLUPS_COLLECTION].find({}, {'_id': 0}))
+    frame = pd.DataFrame(documents, columns=KEYS + MEASURES)
+    frame[MEASURES] = frame[MEASURES].apply(pd.to_numeric, errors='coerce').fillna(0)
+    return frame
+
+
+def _load_plan(db):
+    from Data import enforce_schema, create_empty_dataframe
+    documents = list(db.goals.find({}, {'_id': 0}))
+    return enforce_schema(pd.DataFrame(documents)) if documents else create_empty_dataframe()
+
+
+def verify_plan_rollups(db=None):
+    """
+    Jämför plan_rollups med summorna räknade från goals.
+
+    :return: DataFrame med avvikande (month, goal) och kolumnerna <mått>_stored/<mått>_expected;
+             tom om samlingen stämmer.
+    """
+    if db is None:
+        from database import get_database
+        db = get_database()
+    stored = read_rollups(db).set_index(KEYS)
+    expected = expected_rollups(_load_plan(db)).set_index(KEYS)
+    index = stored.index.union(expected.index)
+    stored = stored.groupby(level=KEYS).sum().reindex(index, fill_value=0)
+    expected = expected.reindex(index, fill_value=0)
+
+    mismatched = ~np.isclose(stored.to_numpy(dtype='float64'), expected.to_numpy(dtype='float64'),
+                             rtol=1e-9, atol=_TOLERANCE).all(axis=1)
+    report = stored[mismatched].add_suffix('_stored').join(expected[mismatched].add_suffix('_expected'))
+    return report.reset_index()
+
+
+def rebuild_plan_rollups(db=None):
+    """Bygg om plan_rollups från goals. Returnerar antal dokument."""
+    from pymongo import DeleteMany, InsertOne
+    if db is None:
+        from database import get_database
+        db = get_database()
+
+    totals = expected_rollups(_load_plan(db))
+    operations = [DeleteMany({})]
+    for record in totals.to_dict('records'):
+        document = {'_id': rollup_id(record['month'], record['goal'])}
+        document.update(_rollup_fields(record['month'], record['goal'], record))
+        operations.append(InsertOne(document))
+    db[ROLLUPS_COLLECTION].bulk_write(operations, ordered=True)
+    return len(operations) - 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Kontrollera eller bygg om plan_rollups från planen.")
+    parser.add_argument("command", choices=["verify", "rebuild"])
+    args = parser.parse_args(argv)
+
+    if args.command == "rebuild":
+        print(f"Rebuilt {ROLLUPS_COLLECTION}: {rebuild_plan_rollups()} documents")
+        return 0
+    mismatches = verify_plan_rollups()
+    if mismatches.empty:
+        print(f"{ROLLUPS_COLLECTION} matches the plan")
+        return 0
+    print(f"{len(mismatches)} rollups differ from the plan:")
+    print(mismatches.to_string(index=False))
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
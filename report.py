@@ -0,0 +1,229 @@
+"""
+Rapport med alla analysdiagram utan att öppna appen.
+
+Laddar planen, historiken och riskerna en gång, bygger alla diagram från Analysis,
+History och Risk_Assessment parallellt i en processpool och skriver resultatet
+till en mapp med:
+- report.html: en fristående sida (plotly.js ingår) med alla diagram
+- figures.json: diagrammen som Plotly-JSON, nycklade på namn
+- manifest.json: när rapporten skapades, dataversion, antal rader och byggtider
+
+Exempel (t.ex. som nattligt schemalagt jobb):
+    python report.py --output reports/2024-06-01 --format both --workers 4
+"""
+import argparse
+import html
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+# Data som varje arbetsprocess får en gång vid start (se _init_worker)
+_sources = {}
+
+
+def _init_worker(sources):
+    _sources.update(sources)
+
+
+def _figures_from(name, result):
+    """Platta till ett byggresultat (figur, lista eller dictionary) till (namn, figur)-par"""
+    if result is None:
+        return []
+    if isinstance(result, dict):
+        return [pair for key, value in result.items() for pair in _figures_from(f"{name}/{key}", value)]
+    if isinstance(result, (list, tuple)):
+        return [pair for index, value in enumerate(result, 1) for pair in _figures_from(f"{name}/{index}", value)]
+    return [(name, result)]
+
+
+def _run_job(job):
+    """Bygg ett diagram i en arbetsprocess och returnera det som JSON"""
+    section, name, builder_path, source, args = job
+    module_name, function_name = builder_path.rsplit(".", 1)
+    builder = getattr(importlib.import_module(module_name), function_name)
+    started = time.perf_counter()
+    if source in ("plan", "history"):
+        # Nyckeln räknades en gång i load_sources, så faktatabellen hittas utan att hasha igen
+        result = builder(_sources[source], *args, plan_key=_sources[f"{source}_key"])
+    elif source:
+        result = builder(_sources[source], *args)
+    else:
+        result = builder(*args)
+    figures = [(figure_name, figure.to_json()) for figure_name, figure in _figures_from(name, result)]
+    return section, figures, (time.perf_counter() - started) * 1000
+
+
+def load_sources(years=None):
+    """Läs planen, historiken och riskerna en gång (alla diagram byggs från dessa)"""
+    from Data import load_data, load_risk_data, get_data_version
+    from History import load_historical_data
+    from analytics_cache import content_key
+
+    plan = load_data()
+    history = load_historical_data()
+    if years and not history.empty:
+        history = history[history['Archive_Year'].isin(years)]
+    return {
+        "plan": plan,
+        "plan_key": content_key(plan),
+        "history": history,
+        "history_key": content_key(history),
+        "risks": load_risk_data(),
+        "data_version": get_data_version(),
+    }
+
+
+def build_jobs(sources):
+    """Ett jobb per oberoende diagram: (sektion, namn, funktion, datakälla, extra argument)"""
+    from Analysis import build_gantt_specs
+
+    jobs = [
+        ("Analys", "cost", "Analysis.create_cost_analysis", "plan", ()),
+        ("Analys", "gantt_overview", "Analysis.create_gantt_overview", "plan", ()),
+        ("Analys", "work_hours", "Analysis.analyze_work_hours", "plan", ()),
+        ("Analys", "technical_needs", "Analysis.create_technical_needs_analysis", "plan", ()),
+        ("Analys", "weather", "Analysis.create_weather_summary", "plan", ()),
+        ("Analys", "completion", "Analysis.create_completion_analysis", "plan", ()),
+        ("Risk", "risk_matrix", "Analysis.create_risk_matrix", None, ()),
+    ]
+    # En tidslinje per mål, så att stora planer fördelas över processerna
+    for goal_name in build_gantt_specs(sources["plan"], sources["plan_key"])["goals"]:
+        jobs.append(("Gantt", f"gantt/{goal_name}", "Analysis.create_goal_gantt", "plan", (goal_name,)))
+    if not sources["history"].empty:
+        jobs.append(("Historik", "history_cost", "History.build_cost_comparison", "history", ()))
+        jobs.append(("Historik", "history_resources", "History.build_resource_comparison", "history", ()))
+    if sources["risks"]:
+        jobs.append(("Risk", "risk_analysis", "Risk_Assessment.build_risk_figures", "risks", ()))
+    return jobs
+
+
+def render_figures(sources, jobs, workers=None):
+    """
+    Bygg alla jobb i en processpool (spawn, så att databastrådar och anslutningar
+    inte ärvs av arbetsprocesserna).
+
+    :return: (figurer i jobbens ordning som {namn: (sektion, json)}, byggtider per jobb i ms)
+    """
+    data = {key: sources[key] for key in ("plan", "plan_key", "history", "history_key", "risks")}
+    results = {}
+    timings = {}
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(data,)) as pool:
+        futures = {pool.submit(_run_job, job): job for job in jobs}
+        for future in as_completed(futures):
+            section, name = futures[future][:2]
+            try:
+                section, figures, elapsed_ms = future.result()
+                results[name] = (section, figures)
+                timings[name] = round(elapsed_ms, 1)
+            except Exception as e:
+                print(f"Error building {name}: {e}")
+                timings[name] = None
+
+    ordered = {}
+    for section, name, *_ in jobs:
+        for figure_name, figure_json in results.get(name, (section, []))[1]:
+            ordered[figure_name] = (section, figure_json)
+    return ordered, timings
+
+
+def write_html(path, figures, title):
+    """En fristående HTML-sida: plotly.js en gång, sedan alla diagram grupperade per sektion"""
+    from plotly.offline import get_plotlyjs
+
+    parts = [
+        "<!DOCTYPE html>",
+        f"<html><head><meta charset='utf-8'><title>{html.escape(title)}</title>",
+        f"<script type='text/javascript'>{get_plotlyjs()}</script>",
+        "<style>body{font-family:sans-serif;margin:2em;} .figure{margin-bottom:2em;}</style>",
+        f"</head><body><h1>{html.escape(title)}</h1>",
+    ]
+    current_section = None
+    for index, (name, (section, figure_json)) in enumerate(figures.items()):
+        if section != current_section:
+            parts.append(f"<h2>{html.escape(section)}</h2>")
+            current_section = section
+        div_id = f"figure-{index}"
+        # Namn från planen får inte kunna avsluta script-taggen
+        safe_json = figure_json.replace("</", "<\\/")
+        parts.append(f"<div class='figure' id='{div_id}' title='{html.escape(name)}'></div>")
+        parts.append(
+            f"<script>(function (figure) {{ Plotly.newPlot('{div_id}', figure.data, figure.layout, "
+            f"{{responsive: true}}); }})({safe_json});</script>"
+        )
+    parts.append("</body></html>")
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("\n".join(parts))
+
+
+def write_bundle(output, figures, manifest, output_format="both"):
+    """Skriv report.html och/eller figures.json samt manifest.json i output"""
+    os.makedirs(output, exist_ok=True)
+    written = []
+    if output_format in ("html", "both"):
+        path = os.path.join(output, "report.html")
+        write_html(path, figures, manifest["title"])
+        written.append(path)
+    if output_format in ("json", "both"):
+        path = os.path.join(output, "figures.json")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("{" + ",".join(f"{json.dumps(name)}: {figure_json}"
+                                      for name, (_, figure_json) in figures.items()) + "}")
+        written.append(path)
+    path = os.path.join(output, "manifest.json")
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2, default=str)
+    written.append(path)
+    return written
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Skapa en rapport med alla analys-, historik- och riskdiagram.")
+    parser.add_argument("--output", default=os.path.join("reports", datetime.now().strftime("%Y-%m-%d")),
+                        help="Mapp som rapporten skrivs till (standard: reports/<dagens datum>)")
+    parser.add_argument("--format", choices=["html", "json", "both"], default="both", dest="output_format",
+                        help="Vad som skrivs: fristående HTML, Plotly-JSON eller båda")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Antal processer som bygger diagram (standard: antal kärnor)")
+    parser.add_argument("--years", type=int, nargs="*",
+                        help="Arkivår att ta med i historikjämförelsen (standard: alla)")
+    parser.add_argument("--title", default="Planeringsrapport", help="Rubrik i rapporten")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    started = time.perf_counter()
+
+    sources = load_sources(args.years)
+    jobs = build_jobs(sources)
+    print(f"Building {len(jobs)} figure jobs from {len(sources['plan'])} plan rows")
+    figures, timings = render_figures(sources, jobs, args.workers)
+
+    from Risk_Assessment import summarize_risks
+    manifest = {
+        "title": args.title,
+        "generated_at": datetime.now().astimezone().isoformat(),
+        "data_version": sources["data_version"],
+        "plan_rows": len(sources["plan"]),
+        "history_rows": len(sources["history"]),
+        "risks": len(sources["risks"]),
+        "risk_summary": summarize_risks(sources["risks"]),
+        "figures": list(figures),
+        "build_ms": timings,
+        "failed": [name for name, elapsed in timings.items() if elapsed is None],
+        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    for path in write_bundle(args.output, figures, manifest, args.output_format):
+        print(f"Wrote {path}")
+    return 1 if manifest["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
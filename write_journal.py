@@ -0,0 +1,311 @@
+"""
+Lokal journal för skrivningar som inte når databasen.
+
+save_data, save_risk_data och save_bugs skickar sina ändringar som bulk-operationer
+via journaled_bulk_write(). Går databasen inte att nå (eller ligger äldre skrivningar
+redan i kö) sparas operationerna i en SQLite-fil i stället, och en bakgrundstråd
+spelar upp dem mot databasen i samma ordning när anslutningen är tillbaka.
+Varje post spelas upp som en ordnad bulk_write från början, så operationerna måste
+tåla att köras om (upserts, deletes och "töm och fyll på" inom samma post).
+
+En post som fortfarande misslyckas efter MAX_ATTEMPTS försök markeras 'failed' och
+stoppar uppspelningen: senare poster väntar bakom den och nya skrivningar läggs i kö,
+så att ordningen behålls. Admin-panelen visar posten och kan försöka igen
+(retry_entry) eller kasta den (discard_entry).
+"""
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from bson import json_util
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.errors import ConnectionFailure
+
+from config import get_journal_path
+
+# Sekunder mellan försök att spela upp journalen
+REPLAY_INTERVAL = 5.0
+# Antal misslyckade uppspelningar (av andra skäl än anslutningen) innan en post ges upp
+MAX_ATTEMPTS = 5
+
+_OPERATION_TYPES = {cls.__name__: cls for cls in
+                    (InsertOne, ReplaceOne, UpdateOne, UpdateMany, DeleteOne, DeleteMany)}
+
+_journal_lock = threading.Lock()
+
+
+def encode_operations(operations):
+    """Serialisera pymongo-operationer till JSON (bson json_util för ObjectId och datum)"""
+    encoded = []
+    for operation in operations:
+        entry = {'type': type(operation).__name__}
+        if isinstance(operation, InsertOne):
+            entry['document'] = operation._doc
+        else:
+            entry['filter'] = operation._filter
+            if not isinstance(operation, (DeleteOne, DeleteMany)):
+                entry['document'] = operation._doc
+                entry['upsert'] = bool(operation._upsert)
+        encoded.append(entry)
+    return json_util.dumps(encoded)
+
+
+def decode_operations(text):
+    """Återskapa pymongo-operationer från encode_operations"""
+    operations = []
+    for entry in json_util.loads(text):
+        operation_type = _OPERATION_TYPES[entry['type']]
+        if operation_type is InsertOne:
+            operations.append(InsertOne(entry['document']))
+        elif operation_type in (DeleteOne, DeleteMany):
+            operations.append(operation_type(entry['filter']))
+        else:
+            operations.append(operation_type(entry['filter'], entry['document'], upsert=entry['upsert']))
+    return operations
+
+
+# Antal poster per status i journalfilen. Läses en gång per process och hålls sedan
+# aktuellt av append, replay_pending, retry_entry och discard_entry, så att
+# pending_count() (som anropas vid varje körning och före varje skrivning) inte
+# behöver öppna SQLite-filen.
+_counts = None
+
+
+def _connect():
+    return sqlite3.connect(get_journal_path(), timeout=10)
+
+
+def _initialize(connection):
+    """Skapa tabellen och läs räknarna första gången journalen öppnas i processen"""
+    global _counts
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS journal ("
+        " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " collection TEXT NOT NULL,"
+        " operations TEXT NOT NULL,"
+        " description TEXT,"
+        " created_at REAL NOT NULL,"
+        " status TEXT NOT NULL DEFAULT 'pending',"
+        " attempts INTEGER NOT NULL DEFAULT 0,"
+        " last_error TEXT)"
+    )
+    counts = {'pending': 0, 'failed': 0}
+    counts.update(connection.execute("SELECT status, COUNT(*) FROM journal GROUP BY status").fetchall())
+    _counts = counts
+
+
+def _adjust(pending=0, failed=0):
+    # Anropas inom _journal(), dvs. med _journal_lock
+    _counts['pending'] += pending
+    _counts['failed'] += failed
+
+
+@contextmanager
+def _journal():
+    """Öppna journalen i en transaktion; anslutningen stängs efteråt"""
+    with _journal_lock:
+        connection = _connect()
+        try:
+            with connection:
+                if _counts is None:
+                    _initialize(connection)
+                yield connection
+        finally:
+            connection.close()
+
+
+def append(collection, operations, description=""):
+    """Lägg till en post sist i journalen och väck uppspelningen"""
+    with _journal() as connection:
+        connection.execute(
+            "INSERT INTO journal (collection, operations, description, created_at) VALUES (?, ?, ?, ?)",
+            (collection, encode_operations(operations), description, time.time())
+        )
+        _adjust(pending=1)
+    print(f"Journaled {len(operations)} operations on '{collection}': {description}")
+    _replayer.wake()
+
+
+def _counted():
+    if _counts is None:
+        with _journal():
+            pass
+    return _counts
+
+
+def pending_count():
+    """Antal skrivningar som väntar på att nå databasen (även poster som har gett upp och blockerar kön)"""
+    try:
+        counts = _counted()
+        return counts['pending'] + counts['failed']
+    except Exception as e:
+        print(f"Error reading write journal: {e}")
+        return 0
+
+
+def failed_count():
+    """Antal poster som har gett upp och måste hanteras i Admin-panelen innan kön kan spelas upp"""
+    try:
+        return _counted()['failed']
+    except Exception as e:
+        print(f"Error reading write journal: {e}")
+        return 0
+
+
+def retry_entry(seq):
+    """Sätt en misslyckad post som väntande igen och väck uppspelningen"""
+    with _journal() as connection:
+        updated = connection.execute(
+            "UPDATE journal SET status = 'pending', attempts = 0 WHERE seq = ? AND status = 'failed'", (seq,)
+        ).rowcount
+        _adjust(pending=updated, failed=-updated)
+    _replayer.wake()
+    return bool(updated)
+
+
+def discard_entry(seq):
+    """Ta bort en misslyckad post ur journalen (ändringarna i den skrivs aldrig)"""
+    with _journal() as connection:
+        deleted = connection.execute("DELETE FROM journal WHERE seq = ? AND status = 'failed'", (seq,)).rowcount
+        _adjust(failed=-deleted)
+    if deleted:
+        print(f"Discarded failed journal entry {seq}")
+    _replayer.wake()
+    return bool(deleted)
+
+
+def list_entries(status=None):
+    """Journalens poster (utan operationerna), äldst först"""
+    query = "SELECT seq, collection, description, created_at, status, attempts, last_error FROM journal"
+    params = ()
+    if status:
+        query += " WHERE status = ?"
+        params = (status,)
+    with _journal() as connection:
+        rows = connection.execute(query + " ORDER BY seq", params).fetchall()
+    columns = ['seq', 'collection', 'description', 'created_at', 'status', 'attempts', 'last_error']
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def journaled_bulk_write(collection, operations, description=""):
+    """
+    Skriv operationerna som en ordnad bulk_write, eller journalför dem om databasen
+    inte svarar eller om tidigare skrivningar fortfarande väntar (för att behålla ordningen).
+
+    :return: BulkWriteResult, eller None om skrivningen lades i journalen.
+    """
+    from database import get_database, is_degraded, report_database_error
+
+    if is_degraded() or pending_count():
+        append(collection, operations, description)
+        return None
+    try:
+        db = get_database()
+    except Exception as e:
+        print(f"Database unavailable: {e}")
+        append(collection, operations, description)
+        return None
+
+    # Andra fel än anslutningsfel (t.ex. dubbletter) skickas vidare till anroparen
+    try:
+        return db[collection].bulk_write(operations, ordered=True)
+    except ConnectionFailure as e:
+        report_database_error(e)
+        append(collection, operations, description)
+        return None
+
+
+def replay_pending():
+    """
+    Spela upp väntande poster i ordning. Avbryts vid första anslutningsfel så att
+    ordningen behålls; en post som misslyckas av andra skäl försöks igen och ges
+    upp (status 'failed') efter MAX_ATTEMPTS försök. En misslyckad post stoppar
+    uppspelningen tills den har försökts igen eller kastats från Admin-panelen.
+
+    :return: Antal poster som skrevs till databasen.
+    """
+    from database import get_database, is_degraded, report_database_error
+    from Data import bump_data_version
+
+    if is_degraded():
+        return 0
+
+    with _journal() as connection:
+        entries = connection.execute(
+            "SELECT seq, collection, operations, attempts, status FROM journal "
+            "WHERE status IN ('pending', 'failed') ORDER BY seq"
+        ).fetchall()
+
+    replayed = 0
+    for seq, collection, operations, attempts, status in entries:
+        if status == 'failed':
+            print(f"Journal replay stopped at failed entry {seq}")
+            break
+        try:
+            db = get_database()
+            db[collection].bulk_write(decode_operations(operations), ordered=True)
+            bump_data_version(db, plan_changed=collection == 'goals')
+        except ConnectionFailure as e:
+            report_database_error(e)
+            break
+        except Exception as e:
+            status = 'failed' if attempts + 1 >= MAX_ATTEMPTS else 'pending'
+            with _journal() as connection:
+                connection.execute("UPDATE journal SET attempts = ?, last_error = ?, status = ? WHERE seq = ?",
+                                   (attempts + 1, f"{type(e).__name__}: {e}", status, seq))
+                if status == 'failed':
+                    _adjust(pending=-1, failed=1)
+            print(f"Error replaying journal entry {seq}: {e}")
+            break
+
+        with _journal() as connection:
+            if connection.execute("DELETE FROM journal WHERE seq = ?", (seq,)).rowcount:
+                _adjust(pending=-1)
+        replayed += 1
+
+    if replayed:
+        print(f"Replayed {replayed} journaled writes")
+    return replayed
+
+
+class _JournalReplayer:
+    """Bakgrundstråd som spelar upp journalen när databasen svarar igen."""
+
+    def __init__(self, interval=REPLAY_INTERVAL):
+        self.interval = interval
+        self._wake = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="journal-replay", daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        self.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                if pending_count():
+                    replay_pending()
+            except Exception as e:
+                print(f"Error in journal replay: {e}")
+
+
+_replayer = _JournalReplayer()
+
+
+def start_replay():
+    """Starta uppspelningen (t.ex. vid uppstart om journalen har poster från en tidigare körning)"""
+    # Skapa tabellen och läs räknarna redan vid uppstart
+    pending_count()
+    _replayer.start()